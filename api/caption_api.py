@@ -11,6 +11,12 @@ from tqdm import tqdm
 import shutil
 import sys
 
+# 文件名编解码与data_process下的脚本共用
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_process")
+)
+import filename_codec
+
 
 # 配置日志系统
 def setup_logging(log_dir="logs"):
@@ -106,8 +112,10 @@ async def process_single_image(filename, image_dir_path, bbox_dir_path, save_dir
 
         # 提取类别信息
         try:
-            class_index = filename[8:11]
-            class_index = int(class_index) - 1
+            class_code = filename_codec.class_code_of(filename)
+            if class_code == filename_codec.UNKNOWN_CLASS:
+                raise ValueError("文件名中没有类别编码")
+            class_index = class_code - 1
             class_name = class_names[class_index]
             class_prompt = {}
             class_prompt["图片文件名"] = filename
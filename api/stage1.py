@@ -11,6 +11,13 @@ from tqdm import tqdm
 import shutil
 import sys
 
+# 文件名编解码、标注存储与data_process下的脚本共用
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_process")
+)
+import filename_codec
+from label_store import LabelStore
+
 
 # 配置日志系统
 def setup_logging(log_dir="logs"):
@@ -94,57 +101,38 @@ def encode_image(image_path):
         raise
 
 
-def read_bbox(bbox_path):
-    """读取边界框信息，返回(边界框字符串, 标注数量)"""
+def read_bbox(bbox_path, label_store):
+    """从标注列式存储读取边界框信息，返回(边界框字符串, 标注数量)"""
     result = ""
-    bbox_count = 0  # 统计标注数量
-
-    if not os.path.exists(bbox_path):
+    boxes = label_store.get(bbox_path)
+    if boxes is None:
         logging.warning(f"边界框文件不存在: {bbox_path}")
-        return result, bbox_count
+        return result, 0
 
-    try:
-        with open(bbox_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-
-        for idx, line in enumerate(lines, 1):
-            parts = line.strip().split()
-            if len(parts) < 5:
-                logging.warning(
-                    f"标注行格式错误，跳过第 {idx} 行：{line.strip()}，文件：{bbox_path}"
-                )
-                continue
-
-            # 解析YOLO格式标注
-            class_id = int(parts[0])
-            x_center = float(parts[1])
-            y_center = float(parts[2])
-            bbox_width = float(parts[3])
-            bbox_height = float(parts[4])
-
-            # 转换为像素坐标
-            x_min = round(float(x_center - bbox_width / 2), 2)
-            y_min = round(float(y_center - bbox_height / 2), 2)
-            x_max = round(float(x_center + bbox_width / 2), 2)
-            y_max = round(float(y_center + bbox_height / 2), 2)
-
-            # 确保坐标在图片范围内
-            x_min = str(max(0, x_min))
-            y_min = str(max(0, y_min))
-            x_max = str(min(1, x_max))
-            y_max = str(min(1, y_max))
-
-            result += f"[{x_min},{y_min},{x_max},{y_max}]"
-            bbox_count += 1  # 增加标注数量
-
-        logging.info(f"成功读取边界框文件: {bbox_path}, 标注数量: {bbox_count}")
-        return result, bbox_count
-    except Exception as e:
-        logging.error(f"读取边界框文件 {bbox_path} 失败: {str(e)}", exc_info=True)
-        return result, bbox_count
+    for error in label_store.errors_of(bbox_path):
+        logging.warning(
+            f"标注行格式错误，跳过第 {error['line']} 行（{error['reason']}），文件：{bbox_path}"
+        )
 
+    # 转换为左上角、右下角坐标（先整体计算，再逐个格式化）
+    x_min = (boxes["cx"] - boxes["w"] / 2).tolist()
+    y_min = (boxes["cy"] - boxes["h"] / 2).tolist()
+    x_max = (boxes["cx"] + boxes["w"] / 2).tolist()
+    y_max = (boxes["cy"] + boxes["h"] / 2).tolist()
 
-async def process_single_image(filename, image_dir_path, bbox_dir_path, save_dir_path):
+    # 确保坐标在图片范围内
+    for box in zip(x_min, y_min, x_max, y_max):
+        x1, y1, x2, y2 = (round(value, 2) for value in box)
+        result += f"[{max(0, x1)},{max(0, y1)},{min(1, x2)},{min(1, y2)}]"
+
+    bbox_count = len(boxes)
+    logging.info(f"成功读取边界框文件: {bbox_path}, 标注数量: {bbox_count}")
+    return result, bbox_count
+
+
+async def process_single_image(
+    filename, image_dir_path, bbox_dir_path, save_dir_path, label_store
+):
     """异步处理单张图片，同时复制标注文件"""
     # 检查文件是否已处理
     output_file = os.path.join(save_dir_path, filename.split(".")[0] + "_caption.txt")
@@ -164,7 +152,7 @@ async def process_single_image(filename, image_dir_path, bbox_dir_path, save_dir
                 return False
 
         # 读取边界框信息并检查数量
-        bbox_prompt, bbox_count = read_bbox(bbox_path)
+        bbox_prompt, bbox_count = read_bbox(bbox_path, label_store)
 
         # 如果标注数量超过阈值，跳过处理
         if bbox_count > MAX_BBOX_COUNT:
@@ -179,8 +167,10 @@ async def process_single_image(filename, image_dir_path, bbox_dir_path, save_dir
 
         # 提取类别信息
         try:
-            class_index = filename[8:11]
-            class_index = int(class_index) - 1
+            class_code = filename_codec.class_code_of(filename)
+            if class_code == filename_codec.UNKNOWN_CLASS:
+                raise ValueError("文件名中没有类别编码")
+            class_index = class_code - 1
             class_name = class_names[class_index]
             class_prompt = class_prompt_json[class_name]
             class_prompt["图片文件名"] = filename
@@ -304,13 +294,20 @@ async def process_images_async(image_dir_path, bbox_dir_path, save_dir_path):
         )
         return
 
+    # 整个标注目录一次加载（带缓存），各任务直接查询
+    try:
+        label_store = LabelStore.load(bbox_dir_path)
+    except OSError as e:
+        logging.error(f"加载标注目录失败: {bbox_dir_path}, 错误: {str(e)}")
+        return
+
     # 使用信号量控制并发数量
     semaphore = asyncio.Semaphore(MAX_CONCURRENT_TASKS)
 
     async def sem_task(filename):
         async with semaphore:
             return await process_single_image(
-                filename, image_dir_path, bbox_dir_path, save_dir_path
+                filename, image_dir_path, bbox_dir_path, save_dir_path, label_store
             )
 
     # 创建所有任务并执行
@@ -11,6 +11,12 @@ from tqdm import tqdm
 import shutil
 import sys
 
+# 文件名编解码与data_process下的脚本共用
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data_process")
+)
+import filename_codec
+
 
 # 配置日志系统
 def setup_logging(log_dir="logs"):
@@ -73,8 +79,10 @@ def encode_image(image_path):
 async def process_single_image(filename, base_dir_path, save_dir_path):
     """异步处理单张图片，同时复制标注文件"""
     # 检查文件是否已处理
+    record = filename_codec.parse(filename)
     output_file = os.path.join(
-        save_dir_path, filename.split("_")[0] + "_caption_en.txt"
+        save_dir_path,
+        filename_codec.format_name(record.class_code, record.sequence, "caption_en"),
     )
     if os.path.exists(output_file):
         logging.info(f"文件 {filename} 已处理，跳过{output_file}")
@@ -182,7 +190,7 @@ async def process_images_async(file_dir_path, save_dir_path):
         filename_list = [
             name
             for name in os.listdir(file_dir_path)
-            if name.split("_")[-1].lower() == "caption.txt"
+            if getattr(filename_codec.try_parse(name), "kind", None) == "caption_cn"
         ]
         logging.info(
             f"在目录 {file_dir_path} 中找到 {len(filename_list)} 个caption文件"
@@ -6,6 +6,8 @@ import pandas as pd
 from collections import defaultdict
 from matplotlib.patches import Rectangle
 
+from label_store import BOX_DTYPE, LabelStore
+
 # 设置英文显示和论文格式风格
 plt.style.use("seaborn-v0_8-muted")  # 低饱和度风格
 plt.rcParams["font.family"] = ["Times New Roman", "Arial"]
@@ -47,9 +49,11 @@ class_names = [
     "Wheat Midge",
 ]
 image_data = []
-bbox_data = []
+bbox_data = []  # (类别名, 该图片的检测框数组)
 class_counts = defaultdict(int)
 image_bbox_counts = defaultdict(lambda: defaultdict(int))  # 记录每张图片的检测框数量
+# 全部标注一次加载（带缓存），不再逐个文件解析
+label_store = LabelStore.load(base_dir)
 
 # 遍历所有类别文件夹
 for index, class_folder in enumerate(os.listdir(base_dir)):
@@ -89,37 +93,36 @@ for index, class_folder in enumerate(os.listdir(base_dir)):
             txt_file = os.path.splitext(file)[0] + ".txt"
             txt_path = os.path.join(class_path, txt_file)
 
-            bbox_count = 0
-            if os.path.exists(txt_path):
-                with open(txt_path, "r") as f:
-                    for line in f:
-                        parts = line.strip().split()
-                        if len(parts) >= 5:
-                            bbox_count += 1
-                            _, x_center, y_center, w, h = map(float, parts[:5])
-
-                            bbox_aspect_ratio = (
-                                min(w, h) / max(w, h) if min(w, h) > 0 else 0
-                            )
-                            bbox_area_ratio = (w * h) * 100
-
-                            bbox_data.append(
-                                {
-                                    "class": class_name,
-                                    "area_ratio": bbox_area_ratio,
-                                    "aspect_ratio": bbox_aspect_ratio,
-                                    "center_x": x_center,
-                                    "center_y": y_center,
-                                    "width": w,  # 保存宽度
-                                    "height": h,  # 保存高度
-                                }
-                            )
+            boxes = label_store.get(txt_path)
+            bbox_count = 0 if boxes is None else len(boxes)
+            if bbox_count:
+                bbox_data.append((class_name, boxes))
 
             image_bbox_counts[class_name][file] = bbox_count
 
 # 转换为DataFrame
 image_df = pd.DataFrame(image_data)
-bbox_df = pd.DataFrame(bbox_data)
+# 所有检测框合并后一次性计算面积占比与宽高比
+all_boxes = np.concatenate(
+    [boxes for _, boxes in bbox_data] or [np.zeros(0, dtype=BOX_DTYPE)]
+)
+w, h = all_boxes["w"], all_boxes["h"]
+short_side = np.minimum(w, h)
+bbox_df = pd.DataFrame(
+    {
+        "class": np.repeat(
+            [name for name, _ in bbox_data], [len(boxes) for _, boxes in bbox_data]
+        ),
+        "area_ratio": (w * h) * 100,
+        "aspect_ratio": np.divide(
+            short_side, np.maximum(w, h), out=np.zeros_like(w), where=short_side > 0
+        ),
+        "center_x": all_boxes["cx"],
+        "center_y": all_boxes["cy"],
+        "width": w,  # 保存宽度
+        "height": h,  # 保存高度
+    }
+)
 
 # 计算总数用于百分比转换
 total_images = len(image_df)
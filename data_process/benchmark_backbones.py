@@ -0,0 +1,176 @@
+"""
+去重特征骨干网络基准测试
+对image_deduplication.BACKBONES中的每个骨干网络统计：
+1. 吞吐量（images/s）与模型加载时间
+2. 特征维度、模型参数内存与特征矩阵内存
+3. 与参考重复组（标注CSV或ResNet50结果）的成对一致性（precision/recall/F1）
+"""
+
+import argparse
+import os
+import random
+import time
+from itertools import combinations
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+
+from image_deduplication import (
+    BACKBONES,
+    extract_features,
+    find_duplicates,
+    load_model,
+)
+
+try:
+    import psutil  # 可选依赖，用于统计进程常驻内存
+except ImportError:
+    psutil = None
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def groups_to_pairs(groups: List[Set[str]]) -> Set[Tuple[str, str]]:
+    """将重复组展开为无序图片对集合"""
+    pairs = set()
+    for group in groups:
+        for a, b in combinations(sorted(group), 2):
+            pairs.add((a, b))
+    return pairs
+
+
+def pair_agreement(
+    pred_groups: List[Set[str]], ref_groups: List[Set[str]]
+) -> Tuple[float, float, float]:
+    """计算预测重复组与参考重复组的成对precision/recall/F1"""
+    pred_pairs = groups_to_pairs(pred_groups)
+    ref_pairs = groups_to_pairs(ref_groups)
+    hits = len(pred_pairs & ref_pairs)
+    precision = hits / len(pred_pairs) if pred_pairs else 1.0
+    recall = hits / len(ref_pairs) if ref_pairs else 1.0
+    f1 = (
+        2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+    )
+    return precision, recall, f1
+
+
+def load_labelled_groups(csv_file: str) -> List[Set[str]]:
+    """读取标注的重复组CSV（与save_duplicates_to_csv格式一致：group_id, image_path）"""
+    df = pd.read_csv(csv_file, encoding="utf-8-sig")
+    return [set(group["image_path"]) for _, group in df.groupby("group_id")]
+
+
+def best_threshold(
+    features: Dict[str, np.ndarray], ref_groups: List[Set[str]]
+) -> Tuple[float, float]:
+    """在0.80~0.99范围内寻找与参考组F1最高的阈值"""
+    best = (0.0, -1.0)
+    for threshold in np.arange(0.80, 1.0, 0.01):
+        groups = find_duplicates(features, threshold=float(threshold))
+        f1 = pair_agreement(groups, ref_groups)[2]
+        if f1 > best[1]:
+            best = (float(threshold), f1)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="去重特征骨干网络基准测试")
+    parser.add_argument("--input_dir", type=str, required=True, help="测试图片目录")
+    parser.add_argument(
+        "--backbones",
+        type=str,
+        default=",".join(BACKBONES),
+        help="参与测试的骨干网络，逗号分隔",
+    )
+    parser.add_argument(
+        "--labels_csv",
+        type=str,
+        default=None,
+        help="人工标注的重复组CSV（group_id, image_path），未提供时以ResNet50结果为参考",
+    )
+    parser.add_argument("--sample_size", type=int, default=500, help="采样图片数量")
+    parser.add_argument("--threshold", type=float, default=0.95, help="相似度阈值")
+    parser.add_argument("--batch_size", type=int, default=32, help="批量处理的图片数量")
+    parser.add_argument("--seed", type=int, default=42, help="采样随机种子")
+    parser.add_argument(
+        "--output_csv", type=str, default="./backbone_benchmark.csv", help="结果CSV"
+    )
+    args = parser.parse_args()
+
+    backbones = [name.strip() for name in args.backbones.split(",") if name.strip()]
+    for name in backbones:
+        if name not in BACKBONES:
+            raise ValueError(f"不支持的骨干网络：{name}（可选：{list(BACKBONES)}）")
+
+    image_paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(args.input_dir)
+        for file in files
+        if file.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+    # 标注样本中的图片必须包含在测试集中，其余随机补足
+    ref_groups = load_labelled_groups(args.labels_csv) if args.labels_csv else None
+    labelled = sorted(set().union(*ref_groups)) if ref_groups else []
+    others = [path for path in image_paths if path not in set(labelled)]
+    random.Random(args.seed).shuffle(others)
+    sample = labelled + others[: max(0, args.sample_size - len(labelled))]
+    print(f"测试样本 {len(sample)} 张图片（其中标注 {len(labelled)} 张）")
+
+    if ref_groups is None:
+        # 以ResNet50为参考时先计算参考组，且保证ResNet50排在第一位
+        backbones = ["resnet50"] + [name for name in backbones if name != "resnet50"]
+
+    print(f"CPU线程数：{torch.get_num_threads()}")
+    rows = []
+    for name in backbones:
+        # 模型进入进程内缓存，随后的extract_features直接复用
+        start = time.perf_counter()
+        model, _, _ = load_model(name)
+        load_time = time.perf_counter() - start
+        param_mb = sum(p.numel() * p.element_size() for p in model.parameters()) / 2**20
+
+        start = time.perf_counter()
+        features = extract_features(sample, batch_size=args.batch_size, backbone=name)
+        elapsed = time.perf_counter() - start
+        dim = BACKBONES[name][2]
+
+        groups = find_duplicates(features, threshold=args.threshold)
+        if ref_groups is None:
+            ref_groups = groups
+        precision, recall, f1 = pair_agreement(groups, ref_groups)
+        best_t, best_f1 = best_threshold(features, ref_groups)
+
+        row = {
+            "backbone": name,
+            "images_per_s": round(len(features) / elapsed, 2) if elapsed > 0 else 0,
+            "load_time_s": round(load_time, 2),
+            "embedding_dim": dim,
+            "param_mb": round(param_mb, 1),
+            "embedding_mb": round(len(features) * dim * 4 / 2**20, 2),
+            "rss_mb": (
+                round(psutil.Process().memory_info().rss / 2**20, 1) if psutil else None
+            ),
+            "groups": len(groups),
+            "precision": round(precision, 4),
+            "recall": round(recall, 4),
+            "f1": round(f1, 4),
+            "best_threshold": round(best_t, 2),
+            "best_f1": round(best_f1, 4),
+        }
+        rows.append(row)
+        print(
+            f"{name}: {row['images_per_s']} images/s，维度 {dim}，参数 {row['param_mb']}MB，"
+            f"F1 {row['f1']}（最佳阈值 {row['best_threshold']}，F1 {row['best_f1']}）"
+        )
+
+    df = pd.DataFrame(rows)
+    df.to_csv(args.output_csv, index=False, encoding="utf-8-sig")
+    print(df.to_string(index=False))
+    print(f"基准测试结果已保存到 {args.output_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+害虫类别表
+功能：
+1. 从config/class_table.json读取类别编号（重新编号后的0起编号）、英文名、中文名及别名
+2. 将标注工具中的各种写法（英文名、中文名、拼音、带编号前缀的文件夹名等）统一映射为类别编号
+"""
+
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+DEFAULT_TABLE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "config", "class_table.json"
+)
+_SEPARATORS = re.compile(r"[\s_\-]+")
+_FOLDER_PREFIX = re.compile(r"^\d+_")
+
+
+def normalize(label: str) -> str:
+    """统一大小写并去掉空格、下划线、连字符，如"Corn Borer" -> "cornborer" """
+    return _SEPARATORS.sub("", label.strip().lower())
+
+
+class ClassTable:
+    """类别编号与名称的双向查询"""
+
+    def __init__(self, classes: List[dict]):
+        self.classes = sorted(classes, key=lambda c: c["id"])
+        self.names = [c["name"] for c in self.classes]
+        self.cn_names = [c.get("cn", c["name"]) for c in self.classes]
+        self.lookup: Dict[str, int] = {}
+        for c in self.classes:
+            for label in [c["name"], c.get("cn", "")] + c.get("aliases", []):
+                if not label:
+                    continue
+                key = normalize(label)
+                if self.lookup.get(key, c["id"]) != c["id"]:
+                    raise ValueError(f"类别别名冲突: {label}")
+                self.lookup[key] = c["id"]
+
+    @classmethod
+    def load(cls, table_file: Optional[str] = None) -> "ClassTable":
+        with open(table_file or DEFAULT_TABLE, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["classes"])
+
+    def __len__(self) -> int:
+        return len(self.classes)
+
+    def id_of(self, label: str) -> Optional[int]:
+        """返回标签对应的类别编号，未知标签返回None；"02_nianchong"等文件夹名去掉编号前缀后再查"""
+        key = normalize(label)
+        if key in self.lookup:
+            return self.lookup[key]
+        return self.lookup.get(normalize(_FOLDER_PREFIX.sub("", label.strip())))
@@ -0,0 +1,383 @@
+"""
+YOLO标注与COCO标注文件互相转换
+功能：
+1. 导出：按make_splits.py输出的train/val/test图片列表（或整个图片目录），
+   每个子集生成一个COCO标注JSON；图片尺寸只读文件头，不解码图片
+2. 导出时逐批读取图片与标注并直接写入文件，检测框先写入临时文件再拼接，内存占用与数据集大小无关
+3. 可选读取stage1/stage2生成的描述文件，将每个害虫的生命阶段、形态特征作为对应检测框的attributes写入
+4. 导入：将COCO标注JSON转换回每张图片一个YOLO标注txt
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from class_table import ClassTable
+from filename_codec import SUFFIXES
+from label_store import parse_label_file
+from make_splits import SPLITS
+from tobbox import IMG_EXTENSIONS
+
+# 描述文件字段 -> attributes字段；英文描述文件同时包含中英文，优先于中文描述文件
+CAPTION_FIELDS = {
+    "caption_cn": (
+        "害虫{}",
+        {
+            "害虫所处的生命阶段": "life_stage_cn",
+            "害虫形态特征": "characteristics_cn",
+        },
+    ),
+    "caption_en": (
+        "pest {}",
+        {
+            "The life stage of pest CN": "life_stage_cn",
+            "The life stage of pest EN": "life_stage_en",
+            "The Characteristics of pest CN": "characteristics_cn",
+            "The Characteristics of pest EN": "characteristics_en",
+        },
+    ),
+}
+# 导出时额外输出的统计项
+STAT_KEYS = (
+    "unreadable_images",
+    "missing_labels",
+    "malformed_lines",
+    "unknown_class",
+    "with_attributes",
+)
+
+
+def read_image_size(img_path: str) -> Tuple[int, int]:
+    """只读取文件头获取图片(宽, 高)"""
+    from PIL import Image
+
+    with Image.open(img_path) as img:
+        return img.size
+
+
+def read_caption_attributes(
+    img_path: str, caption_dir: str
+) -> Dict[int, Dict[str, str]]:
+    """
+    读取图片对应的描述文件，返回{害虫序号(从1开始): attributes}
+    描述文件在caption_dir/类别文件夹/或caption_dir/下，序号与标注文件中检测框的顺序一致
+    """
+    base_name = os.path.splitext(os.path.basename(img_path))[0]
+    class_folder = os.path.basename(os.path.dirname(img_path))
+    attributes: Dict[int, Dict[str, str]] = defaultdict(dict)
+    for kind in ("caption_cn", "caption_en"):
+        key_pattern, fields = CAPTION_FIELDS[kind]
+        name = base_name + SUFFIXES[kind]
+        for caption_path in (
+            os.path.join(caption_dir, class_folder, name),
+            os.path.join(caption_dir, name),
+        ):
+            if os.path.exists(caption_path):
+                break
+        else:
+            continue
+        try:
+            with open(caption_path, "r", encoding="utf-8") as f:
+                # 处理可能的格式问题（如多余的逗号等）
+                data = json.loads(re.sub(r",\s*}", "}", f.read()))
+        except (OSError, ValueError) as e:
+            print(f"无法解析描述文件 {caption_path}: {e}")
+            continue
+        pest_num = 1
+        while isinstance(data.get(key_pattern.format(pest_num)), dict):
+            pest = data[key_pattern.format(pest_num)]
+            for source, target in fields.items():
+                value = pest.get(source)
+                if isinstance(value, str) and value.strip():
+                    attributes[pest_num][target] = value.strip()
+            pest_num += 1
+    return dict(attributes)
+
+
+def read_item(img_path: str, caption_dir: Optional[str]) -> Optional[dict]:
+    """读取一张图片的尺寸、YOLO标注与描述属性，图片无法读取时返回None"""
+    try:
+        width, height = read_image_size(img_path)
+    except OSError as e:
+        print(f"无法读取图片 {img_path}: {e}")
+        return None
+    txt_path = os.path.splitext(img_path)[0] + ".txt"
+    has_label = os.path.exists(txt_path)
+    rows, errors = parse_label_file(txt_path) if has_label else ([], [])
+    captions = read_caption_attributes(img_path, caption_dir) if caption_dir else {}
+    return {
+        "path": img_path,
+        "width": width,
+        "height": height,
+        "rows": rows,
+        "has_label": has_label,
+        "num_errors": len(errors),
+        "captions": captions,
+    }
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def export_coco(
+    image_paths: Iterable[str],
+    output_file: str,
+    table: ClassTable,
+    image_root: Optional[str] = None,
+    caption_dir: Optional[str] = None,
+    num_workers: int = 16,
+    batch_size: int = 512,
+) -> Dict[str, int]:
+    """
+    将一组图片及其YOLO标注流式写成一个COCO标注文件
+    image_root：file_name写为相对image_root的路径，为None时写绝对路径
+    类别编号：COCO的category_id = YOLO类别编号 + 1（0保留给背景）
+    返回统计信息
+    """
+    stats = defaultdict(int)
+    categories = [
+        {"id": c["id"] + 1, "name": c["name"], "supercategory": "pest", "name_cn": cn}
+        for c, cn in zip(table.classes, table.cn_names)
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(output_file)), exist_ok=True)
+    with open(output_file, "w", encoding="utf-8") as out, tempfile.TemporaryFile(
+        "w+", encoding="utf-8", dir=os.path.dirname(os.path.abspath(output_file))
+    ) as annotation_buffer:
+        out.write('{"info": ')
+        out.write(json.dumps({"description": "PD16-MW pest dataset"}))
+        out.write(', "licenses": [], "categories": ')
+        out.write(json.dumps(categories, ensure_ascii=False))
+        out.write(', "images": [')
+
+        annotation_id = 0
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            for batch in _batches(image_paths, batch_size):
+                items = executor.map(lambda p: read_item(p, caption_dir), batch)
+                for item in items:
+                    if item is None:
+                        stats["unreadable_images"] += 1
+                        continue
+                    image_id = stats["images"] + 1
+                    file_name = os.path.abspath(item["path"])
+                    if image_root:
+                        file_name = os.path.relpath(file_name, image_root)
+                        file_name = file_name.replace(os.sep, "/")
+                    image = {
+                        "id": image_id,
+                        "file_name": file_name,
+                        "width": item["width"],
+                        "height": item["height"],
+                    }
+                    out.write(("," if image_id > 1 else "") + "\n")
+                    out.write(json.dumps(image, ensure_ascii=False))
+                    stats["images"] += 1
+                    stats["missing_labels"] += not item["has_label"]
+                    stats["malformed_lines"] += item["num_errors"]
+
+                    w_img, h_img = item["width"], item["height"]
+                    for pest_num, (_, cls, cx, cy, w, h) in enumerate(item["rows"], 1):
+                        cls = int(cls)
+                        if not 0 <= cls < len(table):
+                            stats["unknown_class"] += 1
+                            continue
+                        annotation_id += 1
+                        box_w, box_h = w * w_img, h * h_img
+                        annotation = {
+                            "id": annotation_id,
+                            "image_id": image_id,
+                            "category_id": cls + 1,
+                            "bbox": [
+                                round((cx - w / 2) * w_img, 2),
+                                round((cy - h / 2) * h_img, 2),
+                                round(box_w, 2),
+                                round(box_h, 2),
+                            ],
+                            "area": round(box_w * box_h, 2),
+                            "iscrowd": 0,
+                        }
+                        if pest_num in item["captions"]:
+                            annotation["attributes"] = item["captions"][pest_num]
+                            stats["with_attributes"] += 1
+                        separator = "," if annotation_id > 1 else ""
+                        annotation_buffer.write(
+                            separator
+                            + "\n"
+                            + json.dumps(annotation, ensure_ascii=False)
+                        )
+
+        stats["annotations"] = annotation_id
+        out.write('\n], "annotations": [')
+        annotation_buffer.seek(0)
+        shutil.copyfileobj(annotation_buffer, out)
+        out.write("\n]}\n")
+    return dict(stats)
+
+
+def list_images(image_dir: str) -> List[str]:
+    """递归列出目录下的全部图片"""
+    paths = []
+    for root, dirs, files in os.walk(image_dir):
+        dirs.sort()
+        paths.extend(
+            os.path.join(root, name)
+            for name in sorted(files)
+            if name.lower().endswith(IMG_EXTENSIONS)
+        )
+    return paths
+
+
+def read_split_list(list_file: str) -> Iterator[str]:
+    """逐行读取make_splits.py输出的图片列表"""
+    with open(list_file, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield line.strip()
+
+
+def import_coco(
+    coco_file: str, output_dir: str, table: Optional[ClassTable] = None
+) -> Dict[str, int]:
+    """
+    将COCO标注文件转换为YOLO标注，每张图片输出output_dir/file_name对应的txt（无标注的图片输出空文件）
+    类别按名称查类别表，查不到时按category_id排序后的序号
+    """
+    with open(coco_file, "r", encoding="utf-8") as f:
+        coco = json.load(f)
+
+    class_of = {}
+    for rank, category in enumerate(sorted(coco["categories"], key=lambda c: c["id"])):
+        class_id = table.id_of(category["name"]) if table is not None else None
+        class_of[category["id"]] = rank if class_id is None else class_id
+
+    by_image = defaultdict(list)
+    for annotation in coco["annotations"]:
+        by_image[annotation["image_id"]].append(annotation)
+
+    stats = defaultdict(int)
+    for image in coco["images"]:
+        file_name = image["file_name"]
+        if os.path.isabs(file_name):
+            file_name = os.path.basename(file_name)
+        txt_path = os.path.join(output_dir, os.path.splitext(file_name)[0] + ".txt")
+        os.makedirs(os.path.dirname(txt_path), exist_ok=True)
+        w_img, h_img = image["width"], image["height"]
+        lines = []
+        for annotation in sorted(by_image.get(image["id"], []), key=lambda a: a["id"]):
+            if annotation.get("iscrowd", 0):
+                stats["crowd_skipped"] += 1
+                continue
+            x, y, w, h = annotation["bbox"]
+            lines.append(
+                f"{class_of[annotation['category_id']]} {(x + w / 2) / w_img:.6f} "
+                f"{(y + h / 2) / h_img:.6f} {w / w_img:.6f} {h / h_img:.6f}\n"
+            )
+        with open(txt_path, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+        stats["images"] += 1
+        stats["annotations"] += len(lines)
+    return dict(stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO标注与COCO标注文件互相转换")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser(
+        "export", help="YOLO -> COCO（每个子集一个文件）"
+    )
+    source = export_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--split_dir",
+        type=str,
+        help="make_splits.py的输出目录（train.txt/val.txt/test.txt）",
+    )
+    source.add_argument(
+        "--image_dir", type=str, help="图片目录（图片与YOLO标注同名同目录）"
+    )
+    export_parser.add_argument(
+        "--output_dir", type=str, required=True, help="COCO文件输出目录"
+    )
+    export_parser.add_argument(
+        "--image_root",
+        type=str,
+        default=None,
+        help="file_name相对该目录（默认：--image_dir模式相对图片目录，--split_dir模式写绝对路径）",
+    )
+    export_parser.add_argument(
+        "--caption_dir",
+        type=str,
+        default=None,
+        help="描述文件目录，提供时写入attributes",
+    )
+    export_parser.add_argument(
+        "--name", type=str, default="all", help="--image_dir模式下输出文件的子集名"
+    )
+    export_parser.add_argument("--class_table", type=str, default=None, help="类别表")
+    export_parser.add_argument("--num_workers", type=int, default=16, help="读取线程数")
+
+    import_parser = subparsers.add_parser("import", help="COCO -> YOLO")
+    import_parser.add_argument(
+        "--coco_file", type=str, required=True, help="COCO标注文件"
+    )
+    import_parser.add_argument(
+        "--output_dir", type=str, required=True, help="YOLO标注输出目录"
+    )
+    import_parser.add_argument("--class_table", type=str, default=None, help="类别表")
+    args = parser.parse_args()
+
+    table = ClassTable.load(args.class_table)
+    start = time.perf_counter()
+    if args.command == "import":
+        stats = import_coco(args.coco_file, args.output_dir, table)
+        print(f"导入完成：{stats}，耗时 {time.perf_counter() - start:.1f}s")
+        return
+
+    if args.split_dir:
+        jobs = [
+            (split, read_split_list(os.path.join(args.split_dir, f"{split}.txt")))
+            for split in SPLITS
+            if os.path.exists(os.path.join(args.split_dir, f"{split}.txt"))
+        ]
+        image_root = args.image_root
+    else:
+        jobs = [(args.name, list_images(args.image_dir))]
+        image_root = args.image_root or args.image_dir
+
+    for split, image_paths in jobs:
+        output_file = os.path.join(args.output_dir, f"instances_{split}.json")
+        split_start = time.perf_counter()
+        stats = export_coco(
+            image_paths,
+            output_file,
+            table,
+            image_root=image_root,
+            caption_dir=args.caption_dir,
+            num_workers=args.num_workers,
+        )
+        elapsed = time.perf_counter() - split_start
+        print(
+            f"{split}：{stats.get('images', 0)} 张图片，{stats.get('annotations', 0)} 个检测框，"
+            f"耗时 {elapsed:.1f}s -> {output_file}"
+        )
+        for key in STAT_KEYS:
+            if stats.get(key):
+                print(f"- {key}：{stats[key]}")
+    print(f"全部完成，耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+按类别生成标注缩略图拼图（contact sheet）
+功能：
+1. 每个类别文件夹的图片按缩小倍数解码，用与tobbox.py相同的方式和配色绘制标注框，缩放为统一大小的缩略图
+2. 每cols×rows张缩略图拼成一张大图，缩略图下方标注文件名与检测框数量
+3. 可按检测框数量、检测框面积或文件名排序，便于集中检查异常标注
+4. 以拼图为单位多进程并行生成，同时输出拼图位置 -> 原图路径的索引CSV
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from label_store import LabelStore
+from tobbox import (
+    CUSTOM_COLORS,
+    IMG_EXTENSIONS,
+    load_annotations,
+    read_image,
+    render_annotations,
+    write_image,
+)
+
+SORT_KEYS = ("count", "area", "name")
+CAPTION_HEIGHT = 18  # 缩略图下方文字条高度
+BACKGROUND = (40, 40, 40)
+
+
+def list_class_dirs(img_root: str) -> List[Tuple[str, str]]:
+    """返回[(类别名, 图片文件夹)]；img_root下没有子文件夹时视为一个类别"""
+    subdirs = sorted(
+        (entry.name, entry.path) for entry in os.scandir(img_root) if entry.is_dir()
+    )
+    return subdirs or [(os.path.basename(os.path.normpath(img_root)), img_root)]
+
+
+def collect_items(
+    class_dir: str, txt_dir: str, store: LabelStore, sort: str, descending: bool
+) -> List[tuple]:
+    """收集一个类别的图片及标注，按sort排序；返回[(图片路径, 标注列表或None)]"""
+    items = []
+    for name in os.listdir(class_dir):
+        if not name.lower().endswith(IMG_EXTENSIONS):
+            continue
+        txt_path = os.path.join(txt_dir, os.path.splitext(name)[0] + ".txt")
+        annotations, _ = load_annotations(txt_path, store)
+        items.append((os.path.join(class_dir, name), annotations))
+
+    def sort_key(item):
+        annotations = item[1] or []
+        if sort == "count":
+            return len(annotations), item[0]
+        if sort == "area":
+            return sum(ann[3] * ann[4] for ann in annotations), item[0]
+        return item[0]
+
+    items.sort(key=sort_key, reverse=descending)
+    return items
+
+
+def placeholder_tile(tile_size: int, text: str) -> np.ndarray:
+    """无法生成缩略图时的占位图（背景色加红色提示文字）"""
+    tile = np.full((tile_size, tile_size, 3), BACKGROUND, dtype=np.uint8)
+    cv2.putText(
+        tile,
+        text,
+        (8, tile_size // 2),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        0.5,
+        (0, 0, 255),
+        1,
+        cv2.LINE_AA,
+    )
+    return tile
+
+
+def make_tile(
+    img_path: str,
+    annotations: Optional[list],
+    tile_size: int,
+    decode_scale: int,
+) -> np.ndarray:
+    """
+    生成单张带标注的缩略图（tile_size×tile_size，保持宽高比，四周填充背景色）
+    图片无法读取或标注无法绘制（如类别编号超出颜色表）时返回占位图，不影响同一拼图的其他图片
+    """
+    try:
+        img = read_image(img_path, decode_scale)
+    except FileNotFoundError:
+        return placeholder_tile(tile_size, "unreadable")
+
+    img_h, img_w = img.shape[:2]
+    ratio = tile_size / max(img_h, img_w)
+    new_w = max(1, int(img_w * ratio))
+    new_h = max(1, int(img_h * ratio))
+    img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+    if annotations:
+        # 线宽等按相对原图的总缩小倍数缩放
+        try:
+            render_annotations(
+                img,
+                annotations,
+                CUSTOM_COLORS,
+                preview_scale=max(1.0, decode_scale / ratio),
+            )
+        except (ValueError, IndexError) as e:
+            print(f"标注绘制失败 {img_path}: {e}")
+            return placeholder_tile(tile_size, "bad label")
+    tile = np.full((tile_size, tile_size, 3), BACKGROUND, dtype=np.uint8)
+    top = (tile_size - new_h) // 2
+    left = (tile_size - new_w) // 2
+    tile[top : top + new_h, left : left + new_w] = img
+    return tile
+
+
+def _build_sheet(task: tuple) -> Tuple[str, int, Optional[str]]:
+    """子进程中生成一张拼图，返回(拼图路径, 图片数量, 错误信息)"""
+    sheet_path, items, cols, rows, tile_size, decode_scale, quality = task
+    try:
+        cell_h = tile_size + CAPTION_HEIGHT
+        sheet = np.full(
+            (rows * cell_h, cols * tile_size, 3), BACKGROUND, dtype=np.uint8
+        )
+        for k, (img_path, annotations) in enumerate(items):
+            row, col = divmod(k, cols)
+            y, x = row * cell_h, col * tile_size
+            sheet[y : y + tile_size, x : x + tile_size] = make_tile(
+                img_path, annotations, tile_size, decode_scale
+            )
+            count = len(annotations) if annotations is not None else "-"
+            caption = f"{os.path.splitext(os.path.basename(img_path))[0]} [{count}]"
+            cv2.putText(
+                sheet,
+                caption,
+                (x + 4, y + tile_size + CAPTION_HEIGHT - 5),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.4,
+                (230, 230, 230),
+                1,
+                cv2.LINE_AA,
+            )
+        # 最后一张拼图只保留有图片的行
+        used_rows = (len(items) + cols - 1) // cols
+        write_image(sheet_path, sheet[: used_rows * cell_h], quality)
+        return sheet_path, len(items), None
+    except Exception as e:
+        return sheet_path, len(items), str(e)
+
+
+def _init_worker():
+    # 每个进程生成一张拼图，关闭OpenCV内部线程避免与进程池争抢CPU
+    cv2.setNumThreads(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按类别生成标注缩略图拼图")
+    parser.add_argument(
+        "--img_root", type=str, required=True, help="图片根目录（每个类别一个子文件夹）"
+    )
+    parser.add_argument(
+        "--txt_root",
+        type=str,
+        default=None,
+        help="标注根目录（子文件夹与图片一致），默认同图片根目录",
+    )
+    parser.add_argument(
+        "--output_dir", type=str, default="./contact_sheets", help="输出目录"
+    )
+    parser.add_argument("--cols", type=int, default=8, help="每张拼图的列数")
+    parser.add_argument("--rows", type=int, default=6, help="每张拼图的行数")
+    parser.add_argument("--tile_size", type=int, default=256, help="缩略图边长")
+    parser.add_argument(
+        "--decode_scale",
+        type=int,
+        default=4,
+        choices=[1, 2, 4, 8],
+        help="图片解码缩小倍数",
+    )
+    parser.add_argument(
+        "--sort", type=str, default="count", choices=SORT_KEYS, help="排序方式"
+    )
+    parser.add_argument("--ascending", action="store_true", help="升序（默认降序）")
+    parser.add_argument(
+        "--format", type=str, default="jpg", choices=["jpg", "webp", "png"]
+    )
+    parser.add_argument("--quality", type=int, default=85, help="输出质量")
+    parser.add_argument(
+        "--num_workers", type=int, default=None, help="进程数，默认CPU核数"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    txt_root = args.txt_root or args.img_root
+    # 整个标注根目录一次加载（带缓存）
+    store = LabelStore.load(txt_root)
+    per_sheet = args.cols * args.rows
+
+    tasks = []
+    index_rows = []
+    for class_name, class_dir in list_class_dirs(args.img_root):
+        txt_dir = os.path.join(txt_root, os.path.relpath(class_dir, args.img_root))
+        items = collect_items(class_dir, txt_dir, store, args.sort, not args.ascending)
+        if not items:
+            continue
+        class_output = os.path.join(args.output_dir, class_name)
+        os.makedirs(class_output, exist_ok=True)
+        for sheet_id, begin in enumerate(range(0, len(items), per_sheet)):
+            sheet_items = items[begin : begin + per_sheet]
+            sheet_path = os.path.join(
+                class_output, f"sheet_{sheet_id:03d}.{args.format}"
+            )
+            tasks.append(
+                (
+                    sheet_path,
+                    sheet_items,
+                    args.cols,
+                    args.rows,
+                    args.tile_size,
+                    args.decode_scale,
+                    args.quality,
+                )
+            )
+            for k, (img_path, annotations) in enumerate(sheet_items):
+                index_rows.append(
+                    {
+                        "class": class_name,
+                        "sheet": sheet_path,
+                        "row": k // args.cols,
+                        "col": k % args.cols,
+                        "image_path": img_path,
+                        "box_count": (
+                            len(annotations) if annotations is not None else None
+                        ),
+                    }
+                )
+        num_sheets = (len(items) + per_sheet - 1) // per_sheet
+        print(f"{class_name}：{len(items)} 张图片，{num_sheets} 张拼图")
+
+    num_workers = args.num_workers or os.cpu_count() or 1
+    if num_workers <= 1 or len(tasks) <= 1:
+        results = list(map(_build_sheet, tasks))
+    else:
+        # spawn启动的子进程不继承父进程的状态，各平台行为一致
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        ) as executor:
+            results = list(executor.map(_build_sheet, tasks))
+
+    failures = [(path, error) for path, _, error in results if error]
+    for path, error in failures:
+        print(f"生成拼图 {path} 失败: {error}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    index_csv = os.path.join(args.output_dir, "sheet_index.csv")
+    pd.DataFrame(index_rows).to_csv(index_csv, index=False, encoding="utf-8-sig")
+    elapsed = time.perf_counter() - start
+    num_images = sum(count for _, count, error in results if not error)
+    print(
+        f"拼图生成完成：{len(results) - len(failures)}/{len(results)} 张拼图，"
+        f"{num_images} 张图片，耗时 {elapsed:.1f}s（{num_images / max(elapsed, 1e-9):.1f} 张/s）"
+    )
+    print(f"拼图索引已保存到 {index_csv}")
+
+
+if __name__ == "__main__":
+    main()
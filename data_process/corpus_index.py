@@ -0,0 +1,353 @@
+"""
+语料库特征索引与增量去重工具
+功能：
+1. build：为已整理好的数据集提取特征，建立持久化的特征索引
+2. query：只对新到的一批图片提取特征，与索引中的语料库比对，报告每张新图片的重复匹配
+3. 可选将判定为非重复的新图片追加到索引中，每批的计算量只与批次大小相关
+
+索引目录结构：
+- meta.json：模型信息（含权重标识，build/query时与当前权重不一致则拒绝）、特征维度、条目数量
+- embeddings.f32：L2归一化后的float32特征矩阵（按行追加）
+- paths.txt：与特征矩阵逐行对应的图片路径
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from image_deduplication import (
+    BACKBONES,
+    extract_features,
+    extract_features_sharded,
+    model_identity,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+class CorpusIndex:
+    """持久化的特征索引（只追加）"""
+
+    META_FILE = "meta.json"
+    EMBEDDING_FILE = "embeddings.f32"
+    PATHS_FILE = "paths.txt"
+
+    def __init__(self, index_dir: str, meta: dict):
+        self.index_dir = index_dir
+        self.meta = meta
+        self.dim = meta["dim"]
+        self.count = meta["count"]
+        self.paths: List[str] = []
+        self.matrix = np.empty((0, self.dim), dtype=np.float32)
+        self._load_data()
+
+    @classmethod
+    def create(
+        cls,
+        index_dir: str,
+        backbone: str,
+        int8_model: Optional[str] = None,
+        weights: Optional[str] = None,
+    ) -> "CorpusIndex":
+        """新建空索引"""
+        os.makedirs(index_dir, exist_ok=True)
+        meta = {
+            "backbone": backbone,
+            "int8_model": int8_model,
+            "model": model_identity(backbone, weights, int8_model),
+            "dim": BACKBONES[backbone][2],
+            "count": 0,
+        }
+        for file_name in (cls.EMBEDDING_FILE, cls.PATHS_FILE):
+            open(os.path.join(index_dir, file_name), "wb").close()
+        cls._write_meta(index_dir, meta)
+        return cls(index_dir, meta)
+
+    @classmethod
+    def load(
+        cls, index_dir: str, weights: Optional[str] = None, verify_model: bool = False
+    ) -> "CorpusIndex":
+        """
+        加载已有索引
+        verify_model: 需要用weights提取新特征时置为True，模型与建索引时不一致则报错，
+                      避免不同模型的特征混在同一索引中
+        """
+        meta_path = os.path.join(index_dir, cls.META_FILE)
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"索引不存在：{meta_path}")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            index = cls(index_dir, json.load(f))
+        if verify_model:
+            index.verify_model(weights)
+        return index
+
+    def verify_model(self, weights: Optional[str] = None):
+        """检查当前权重与索引记录的模型一致；旧索引没有记录时补记当前模型"""
+        backbone, int8_model = self.model_key
+        current = model_identity(backbone, weights, int8_model)
+        recorded = self.meta.get("model")
+        if recorded is None:
+            print(f"索引未记录模型权重，按当前权重记录：{current}")
+            self.meta["model"] = current
+            self._write_meta(self.index_dir, self.meta)
+        elif recorded != current:
+            raise ValueError(
+                f"当前模型（{current}）与索引 {self.index_dir} 的模型（{recorded}）不一致，"
+                "特征不可比，请使用建索引时的权重"
+            )
+
+    @staticmethod
+    def _write_meta(index_dir: str, meta: dict):
+        # 先写临时文件再替换，保证meta.json始终完整
+        tmp_path = os.path.join(index_dir, CorpusIndex.META_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, os.path.join(index_dir, CorpusIndex.META_FILE))
+
+    def _load_data(self):
+        """读取特征与路径；以meta中的count为准，清理中断追加留下的多余数据"""
+        paths_file = os.path.join(self.index_dir, self.PATHS_FILE)
+        embedding_file = os.path.join(self.index_dir, self.EMBEDDING_FILE)
+        with open(paths_file, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.paths = lines[: self.count]
+        self.matrix = np.fromfile(
+            embedding_file, dtype=np.float32, count=self.count * self.dim
+        ).reshape(self.count, self.dim)
+
+        if len(lines) > self.count:
+            with open(paths_file, "w", encoding="utf-8") as f:
+                f.write("".join(path + "\n" for path in self.paths))
+        if os.path.getsize(embedding_file) > self.count * self.dim * 4:
+            with open(embedding_file, "r+b") as f:
+                f.truncate(self.count * self.dim * 4)
+
+    @property
+    def model_key(self) -> Tuple[str, Optional[str]]:
+        return self.meta["backbone"], self.meta.get("int8_model")
+
+    def append(self, paths: List[str], matrix: np.ndarray):
+        """追加条目：先追加特征和路径，最后更新meta中的count（提交点）"""
+        if not paths:
+            return
+        matrix = normalize(matrix)
+        with open(os.path.join(self.index_dir, self.EMBEDDING_FILE), "ab") as f:
+            f.write(matrix.tobytes())
+        paths_file = os.path.join(self.index_dir, self.PATHS_FILE)
+        with open(paths_file, "a", encoding="utf-8") as f:
+            f.write("".join(path + "\n" for path in paths))
+
+        self.paths = self.paths + list(paths)
+        self.matrix = np.vstack([self.matrix, matrix])
+        self.count = len(self.paths)
+        self.meta["count"] = self.count
+        self._write_meta(self.index_dir, self.meta)
+
+    def search(
+        self, queries: np.ndarray, top_k: int = 5, block_size: int = 1024
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        查询每个特征在索引中最相似的top_k条目
+        返回：(条目索引矩阵, 相似度矩阵)，形状均为(查询数, min(top_k, 索引大小))，按相似度降序
+        """
+        queries = normalize(queries)
+        k = min(top_k, self.count)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        if k == 0:
+            return indices, scores
+
+        for start in range(0, len(queries), block_size):
+            similarity = queries[start : start + block_size] @ self.matrix.T
+            # argpartition只做部分排序，再对k个候选排序
+            top = np.argpartition(-similarity, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(similarity, top, axis=1)
+            order = np.argsort(-top_scores, axis=1)
+            indices[start : start + block_size] = np.take_along_axis(top, order, axis=1)
+            scores[start : start + block_size] = np.take_along_axis(
+                top_scores, order, axis=1
+            )
+        return indices, scores
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    """按行L2归一化，使点积等于余弦相似度"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    return matrix / (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12)
+
+
+def list_images(input_dir: str) -> List[str]:
+    """递归列出目录中的所有图片"""
+    return sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(input_dir)
+        for file in files
+        if file.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def embed_images(
+    image_paths: List[str], index: CorpusIndex, args
+) -> Dict[str, np.ndarray]:
+    """使用与索引一致的模型提取特征"""
+    backbone, int8_model = index.model_key
+    if args.shards > 1:
+        return extract_features_sharded(
+            image_paths,
+            num_shards=args.shards,
+            batch_size=args.batch_size,
+            backbone=backbone,
+            int8_model=int8_model,
+            weights=args.weights,
+        )
+    return extract_features(
+        image_paths,
+        batch_size=args.batch_size,
+        backbone=backbone,
+        int8_model=int8_model,
+        weights=args.weights,
+    )
+
+
+def build_index(args):
+    """为语料库目录建立索引（已在索引中的图片跳过）"""
+    if os.path.exists(os.path.join(args.index_dir, CorpusIndex.META_FILE)):
+        index = CorpusIndex.load(args.index_dir, args.weights, verify_model=True)
+    else:
+        index = CorpusIndex.create(
+            args.index_dir, args.backbone, args.int8_model, args.weights
+        )
+
+    indexed = set(index.paths)
+    image_paths = [path for path in list_images(args.corpus_dir) if path not in indexed]
+    print(f"索引已有 {index.count} 张图片，新增 {len(image_paths)} 张")
+    if not image_paths:
+        return
+
+    start = time.perf_counter()
+    features = embed_images(image_paths, index, args)
+    paths = list(features.keys())
+    if not paths:
+        print("新增图片均无法读取，索引未改变")
+        return
+    index.append(paths, np.stack([features[path] for path in paths]))
+    print(
+        f"索引构建完成，共 {index.count} 张图片，耗时 {time.perf_counter() - start:.1f}s"
+    )
+
+
+def query_batch(args):
+    """新批次与语料库比对，报告匹配结果并可选追加非重复图片"""
+    import pandas as pd
+
+    index = CorpusIndex.load(args.index_dir, args.weights, verify_model=True)
+    image_paths = list_images(args.batch_dir)
+    print(f"索引共 {index.count} 张图片，新批次 {len(image_paths)} 张")
+    if not image_paths:
+        return
+
+    start = time.perf_counter()
+    features = embed_images(image_paths, index, args)
+    paths = list(features.keys())
+    if not paths:
+        print("新批次中没有可读取的图片")
+        return
+    queries = normalize(np.stack([features[path] for path in paths]))
+    indices, scores = index.search(queries, top_k=args.top_k)
+
+    rows = []
+    accepted: List[int] = []
+    for i, path in enumerate(paths):
+        matches = [
+            (index.paths[j], float(score))
+            for j, score in zip(indices[i], scores[i])
+            if score >= args.threshold
+        ]
+        status = "duplicate" if matches else "accepted"
+        # 批次内部去重：与已接受的新图片重复的也不追加
+        if not matches and accepted:
+            batch_similarity = queries[accepted] @ queries[i]
+            best = int(np.argmax(batch_similarity))
+            if batch_similarity[best] >= args.threshold:
+                status = "batch_duplicate"
+                matches = [(paths[accepted[best]], float(batch_similarity[best]))]
+        if status == "accepted":
+            accepted.append(i)
+
+        rows.append(
+            {
+                "image_path": path,
+                "status": status,
+                "best_match": matches[0][0] if matches else "",
+                "similarity": round(matches[0][1], 4) if matches else None,
+                "matches": ";".join(f"{p}:{s:.4f}" for p, s in matches),
+            }
+        )
+
+    df = pd.DataFrame(rows)
+    df.to_csv(args.report_csv, index=False, encoding="utf-8-sig")
+    counts = df["status"].value_counts().to_dict()
+    print(
+        f"比对完成，耗时 {time.perf_counter() - start:.1f}s："
+        f"与语料库重复 {counts.get('duplicate', 0)} 张，"
+        f"批次内重复 {counts.get('batch_duplicate', 0)} 张，"
+        f"新图片 {counts.get('accepted', 0)} 张"
+    )
+    print(f"比对报告已保存到 {args.report_csv}")
+
+    if args.append and accepted:
+        index.append([paths[i] for i in accepted], queries[accepted])
+        print(f"已将 {len(accepted)} 张新图片追加到索引，索引共 {index.count} 张")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="语料库特征索引与增量去重工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub):
+        sub.add_argument("--index_dir", type=str, required=True, help="索引目录")
+        sub.add_argument(
+            "--batch_size", type=int, default=32, help="批量处理的图片数量"
+        )
+        sub.add_argument("--shards", type=int, default=1, help="特征提取的CPU进程数")
+        sub.add_argument("--weights", type=str, default=None, help="本地权重文件或目录")
+
+    build = subparsers.add_parser("build", help="为语料库建立/补充索引")
+    add_common(build)
+    build.add_argument("--corpus_dir", type=str, required=True, help="语料库图片目录")
+    build.add_argument(
+        "--backbone",
+        type=str,
+        default="resnet50",
+        choices=list(BACKBONES),
+        help="新建索引时使用的骨干网络（已有索引沿用原模型）",
+    )
+    build.add_argument(
+        "--int8_model", type=str, default=None, help="新建索引时使用的INT8量化模型"
+    )
+
+    query = subparsers.add_parser("query", help="新批次与语料库比对")
+    add_common(query)
+    query.add_argument("--batch_dir", type=str, required=True, help="新批次图片目录")
+    query.add_argument("--threshold", type=float, default=0.95, help="相似度阈值")
+    query.add_argument("--top_k", type=int, default=5, help="每张图片报告的最多匹配数")
+    query.add_argument(
+        "--report_csv", type=str, default="./batch_matches.csv", help="比对报告CSV"
+    )
+    query.add_argument(
+        "--append", action="store_true", help="将非重复的新图片追加到索引"
+    )
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args)
+    else:
+        query_batch(args)
+
+
+if __name__ == "__main__":
+    main()
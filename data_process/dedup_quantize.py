@@ -0,0 +1,211 @@
+"""
+去重特征提取器INT8量化工具（CPU推理）
+功能：
+1. 使用PyTorch FX训练后静态量化，在少量害虫图片上校准
+2. 校验量化模型与FP32模型的余弦相似度误差是否在容差内
+3. 对比FP32与INT8的CPU推理速度（两个模型都加载并预热后，只对同一批预处理好的张量计时），并导出TorchScript模型供image_deduplication.py使用
+"""
+
+import argparse
+import copy
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+from image_deduplication import (
+    BACKBONES,
+    WEIGHTS_ENV,
+    get_feature_extractor,
+    iter_image_batches,
+    load_model,
+)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def select_engine() -> str:
+    """选择当前CPU可用的量化后端（优先x86，其次fbgemm/qnnpack）"""
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in torch.backends.quantized.supported_engines:
+            return engine
+    raise RuntimeError("当前PyTorch不支持任何INT8量化后端")
+
+
+def quantize_feature_extractor(
+    backbone: str,
+    calibration_paths: List[str],
+    batch_size: int = 32,
+    weights: Optional[str] = None,
+) -> torch.nn.Module:
+    """
+    对骨干网络做训练后静态量化，使用calibration_paths中的图片统计激活范围
+    weights: 本地权重文件或目录，见get_feature_extractor
+    """
+    engine = select_engine()
+    torch.backends.quantized.engine = engine
+
+    model = get_feature_extractor(backbone, weights)
+    example_inputs = (torch.randn(1, 3, 224, 224),)
+    prepared = prepare_fx(
+        copy.deepcopy(model), get_default_qconfig_mapping(engine), example_inputs
+    )
+
+    calibrated = 0
+    with torch.inference_mode():
+        for images, _ in iter_image_batches(calibration_paths, batch_size):
+            prepared(images)
+            calibrated += len(images)
+    if calibrated == 0:
+        raise ValueError("没有可用于校准的图片")
+    print(f"量化校准完成：后端 {engine}，校准图片 {calibrated} 张")
+
+    return convert_fx(prepared)
+
+
+def save_quantized_extractor(model: torch.nn.Module, output_path: str):
+    """将量化模型导出为TorchScript，加载时无需重新校准"""
+    with torch.inference_mode():
+        scripted = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+    scripted = torch.jit.freeze(scripted.eval())
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    torch.jit.save(scripted, output_path)
+    print(f"INT8模型已保存到 {output_path}")
+
+
+def load_quantized_extractor(model_path: str) -> torch.nn.Module:
+    """加载导出的INT8 TorchScript模型"""
+    torch.backends.quantized.engine = select_engine()
+    model = torch.jit.load(model_path, map_location="cpu")
+    model.eval()
+    return model
+
+
+def time_inference(
+    model: torch.nn.Module,
+    batches: List[Tuple[torch.Tensor, List[str]]],
+    memory_format: torch.memory_format,
+) -> Tuple[Dict[str, np.ndarray], float]:
+    """
+    在预处理好的同一组批次上推理，返回(特征, 前向推理耗时)
+    先用第一个批次预热，计时不含模型加载与图片解码
+    """
+    inputs = [images.to(memory_format=memory_format) for images, _ in batches]
+    features = {}
+    with torch.inference_mode():
+        model(inputs[0])
+        start = time.perf_counter()
+        outputs = [model(images) for images in inputs]
+        elapsed = time.perf_counter() - start
+    for (_, paths), output in zip(batches, outputs):
+        features.update(zip(paths, output.flatten(1).numpy()))
+    return features, elapsed
+
+
+def compare_similarities(
+    fp32_features: Dict[str, np.ndarray], int8_features: Dict[str, np.ndarray]
+) -> Tuple[float, float]:
+    """
+    比较两组特征的图片间余弦相似度矩阵
+    返回：(相似度最大绝对误差, 同一图片FP32/INT8特征的最小余弦相似度)
+    """
+    paths = [path for path in fp32_features if path in int8_features]
+    a = np.stack([fp32_features[path] for path in paths]).astype(np.float32)
+    b = np.stack([int8_features[path] for path in paths]).astype(np.float32)
+    a /= np.linalg.norm(a, axis=1, keepdims=True) + 1e-12
+    b /= np.linalg.norm(b, axis=1, keepdims=True) + 1e-12
+
+    max_error = float(np.abs(a @ a.T - b @ b.T).max())
+    min_self = float((a * b).sum(axis=1).min())
+    return max_error, min_self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="去重特征提取器INT8量化工具")
+    parser.add_argument(
+        "--calib_dir", type=str, required=True, help="校准/验证图片目录（害虫图片）"
+    )
+    parser.add_argument(
+        "--backbone",
+        type=str,
+        default="resnet50",
+        choices=list(BACKBONES),
+        help="需要量化的骨干网络",
+    )
+    parser.add_argument("--num_calib", type=int, default=200, help="校准图片数量")
+    parser.add_argument("--num_val", type=int, default=200, help="验证图片数量")
+    parser.add_argument("--batch_size", type=int, default=32, help="批量处理的图片数量")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.02,
+        help="图片间余弦相似度允许的最大绝对误差",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="INT8模型输出路径，默认为./<backbone>_int8.pt",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="采样随机种子")
+    parser.add_argument(
+        "--weights",
+        type=str,
+        default=None,
+        help=f"本地权重文件或目录（离线环境使用），也可通过环境变量{WEIGHTS_ENV}设置",
+    )
+    args = parser.parse_args()
+    args.output = args.output or f"./{args.backbone}_int8.pt"
+
+    image_paths = sorted(
+        os.path.join(root, file)
+        for root, _, files in os.walk(args.calib_dir)
+        for file in files
+        if file.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    random.Random(args.seed).shuffle(image_paths)
+    calib_paths = image_paths[: args.num_calib]
+    # 验证集尽量与校准集不重叠，图片不足时复用校准图片
+    val_paths = (
+        image_paths[args.num_calib : args.num_calib + args.num_val] or calib_paths
+    )
+    print(f"校准图片 {len(calib_paths)} 张，验证图片 {len(val_paths)} 张")
+
+    model = quantize_feature_extractor(
+        args.backbone, calib_paths, args.batch_size, args.weights
+    )
+    save_quantized_extractor(model, args.output)
+
+    # FP32与INT8均在CPU上推理，对比速度与相似度误差；
+    # 两个模型先加载好，验证图片只解码一次，计时只包含前向推理
+    fp32_model, _, fp32_format = load_model(args.backbone, "cpu", args.weights)
+    int8_model, _, int8_format = load_model(args.backbone, int8_model=args.output)
+    batches = list(iter_image_batches(val_paths, args.batch_size))
+    if not batches:
+        raise ValueError("没有可读取的验证图片")
+    fp32_features, fp32_time = time_inference(fp32_model, batches, fp32_format)
+    int8_features, int8_time = time_inference(int8_model, batches, int8_format)
+
+    max_error, min_self = compare_similarities(fp32_features, int8_features)
+    print(
+        f"FP32: {len(fp32_features) / fp32_time:.1f} images/s，"
+        f"INT8: {len(int8_features) / int8_time:.1f} images/s，"
+        f"加速 {fp32_time / int8_time:.2f}x"
+    )
+    print(
+        f"图片间相似度最大误差 {max_error:.4f}（容差 {args.tolerance}），"
+        f"FP32/INT8特征最小余弦相似度 {min_self:.4f}"
+    )
+    if max_error > args.tolerance:
+        print("⚠️  量化误差超出容差，建议增加校准图片或继续使用FP32模型")
+    else:
+        print("✅ 量化误差在容差范围内，可使用 --int8_model 进行去重")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+重复图像组HTML报告
+功能：
+1. 多进程生成缩略图（JPEG按draft模式降采样解码），按路径+修改时间+大小缓存，重复运行直接复用
+2. 生成静态HTML页面，展示全部重复组、组内各图与保留图的相似度及保留/移动决定
+3. 不弹出窗口、不阻塞流程，可在无界面的服务器上运行；也可单独从重复组CSV生成报告
+"""
+
+import argparse
+import hashlib
+import html
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+THUMB_SIZE = 160  # 缩略图最长边
+THUMB_QUALITY = 80
+
+
+def thumbnail_name(image_path: str, size: int) -> str:
+    """缩略图缓存文件名：路径、修改时间、大小和缩略图尺寸任一变化都会重新生成"""
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}|{size}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".jpg"
+
+
+def _make_thumbnail(task: Tuple[str, str, int]) -> Tuple[str, Optional[str]]:
+    """子进程中生成单张缩略图，返回(原图路径, 缩略图路径)，失败时缩略图路径为None"""
+    image_path, thumb_dir, size = task
+    try:
+        thumb_path = os.path.join(thumb_dir, thumbnail_name(image_path, size))
+        with Image.open(image_path) as img:
+            # JPEG在解码阶段直接缩小，避免解码全分辨率图像
+            img.draft("RGB", (size, size))
+            img = img.convert("RGB")
+            img.thumbnail((size, size))
+            # 先写临时文件再改名，中断时不会留下损坏的缓存
+            tmp_path = f"{thumb_path}.{os.getpid()}.tmp"
+            img.save(tmp_path, "JPEG", quality=THUMB_QUALITY)
+            os.replace(tmp_path, thumb_path)
+        return image_path, thumb_path
+    except Exception as e:
+        print(f"无法生成缩略图 {image_path}: {e}")
+        return image_path, None
+
+
+def build_thumbnails(
+    image_paths: List[str],
+    thumb_dir: str,
+    size: int = THUMB_SIZE,
+    num_workers: Optional[int] = None,
+) -> Dict[str, str]:
+    """并行生成缩略图，返回{原图路径: 缩略图路径}；已缓存的缩略图不启动子进程"""
+    os.makedirs(thumb_dir, exist_ok=True)
+    thumbnails = {}
+    tasks = []
+    for path in dict.fromkeys(image_paths):
+        try:
+            thumb_path = os.path.join(thumb_dir, thumbnail_name(path, size))
+        except OSError as e:
+            print(f"无法读取文件 {path}: {e}")
+            continue
+        if os.path.exists(thumb_path):
+            thumbnails[path] = thumb_path
+        else:
+            tasks.append((path, thumb_dir, size))
+
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers <= 1 or len(tasks) < 64:
+        results = map(_make_thumbnail, tasks)
+        thumbnails.update((path, thumb) for path, thumb in results if thumb)
+        return thumbnails
+
+    # spawn启动的子进程不继承父进程中已加载的torch线程池等状态
+    with ProcessPoolExecutor(
+        max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        results = executor.map(_make_thumbnail, tasks, chunksize=32)
+        thumbnails.update((path, thumb) for path, thumb in results if thumb)
+    return thumbnails
+
+
+def group_similarities(
+    plan: List[Tuple[List[str], List[Tuple[str, str]]]],
+    features: Optional[Dict[str, np.ndarray]] = None,
+    exact_groups: Optional[List[Set[str]]] = None,
+) -> Dict[str, float]:
+    """
+    计算每组中各图片与参考图（保留的图片，全部移动时为组内第一张）的余弦相似度
+    字节完全相同的图片记为1.0，没有特征的图片（如感知哈希组）不记录
+    """
+    features = features or {}
+    exact_of = {path: i for i, group in enumerate(exact_groups or []) for path in group}
+    scores = {}
+    for kept, moves in plan:
+        members = kept + [src for src, _ in moves]
+        reference = members[0]
+        ref_feature = features.get(reference)
+        if ref_feature is not None:
+            ref_feature = ref_feature / (np.linalg.norm(ref_feature) + 1e-12)
+        for path in members[1:]:
+            if path in exact_of and exact_of.get(reference) == exact_of[path]:
+                scores[path] = 1.0
+            elif ref_feature is not None and path in features:
+                feature = features[path]
+                norm = np.linalg.norm(feature) + 1e-12
+                scores[path] = float(ref_feature @ feature / norm)
+    return scores
+
+
+_PAGE_HEAD = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 16px; background: #fafafa; }}
+.group {{ background: #fff; border: 1px solid #ddd; margin: 12px 0; padding: 8px; }}
+.group h3 {{ margin: 0 0 6px; font-size: 14px; }}
+.items {{ display: flex; flex-wrap: wrap; gap: 8px; }}
+.item {{ width: {size}px; font-size: 11px; word-break: break-all; }}
+.item img {{ width: {size}px; height: {size}px; object-fit: contain; background: #eee; }}
+.keep {{ border-top: 4px solid #53ab37; }}
+.move {{ border-top: 4px solid #ee5346; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+<p>{summary}</p>
+"""
+
+
+def write_html_report(
+    plan: List[Tuple[List[str], List[Tuple[str, str]]]],
+    output_html: str,
+    thumbnails: Dict[str, str],
+    scores: Optional[Dict[str, float]] = None,
+    size: int = THUMB_SIZE,
+    title: str = "重复图像组报告",
+    link_moved: bool = True,
+):
+    """
+    写出静态HTML报告
+    plan：move_plan()的结果，每组为(保留的图片列表, [(移动的原路径, 目标路径)])
+    缩略图与原图均以相对于报告文件的路径引用；link_moved时移动的图片链接到移动后的位置
+    """
+    scores = scores or {}
+    report_dir = os.path.dirname(os.path.abspath(output_html))
+
+    def rel(path: str) -> str:
+        try:
+            path = os.path.relpath(os.path.abspath(path), report_dir)
+        except ValueError:
+            # Windows下报告与图片不在同一盘符时无法使用相对路径
+            return html.escape(Path(os.path.abspath(path)).as_uri())
+        return html.escape(path.replace(os.sep, "/"))
+
+    def item(path: str, link: str, decision: str) -> str:
+        score = scores.get(path)
+        score_text = f"{score:.4f}" if score is not None else "-"
+        thumb = thumbnails.get(path)
+        img = (
+            f'<img loading="lazy" src="{rel(thumb)}">'
+            if thumb
+            else "<div>无缩略图</div>"
+        )
+        label = "保留" if decision == "keep" else "移动"
+        return (
+            f'<div class="item {decision}"><a href="{rel(link)}" target="_blank">{img}</a>'
+            f"<div>{label} | 相似度 {score_text}</div>"
+            f"<div>{html.escape(os.path.basename(path))}</div></div>"
+        )
+
+    num_kept = sum(len(kept) for kept, _ in plan)
+    num_moved = sum(len(moves) for _, moves in plan)
+    summary = f"共 {len(plan)} 组重复图片，保留 {num_kept} 张，移动 {num_moved} 张"
+    parts = [_PAGE_HEAD.format(title=html.escape(title), size=size, summary=summary)]
+    for group_id, (kept, moves) in enumerate(plan):
+        parts.append(
+            f'<div class="group"><h3>重复组 {group_id}（{len(kept) + len(moves)} 张）</h3>'
+            '<div class="items">'
+        )
+        parts.extend(item(path, path, "keep") for path in kept)
+        parts.extend(
+            item(src, dst if link_moved else src, "move") for src, dst in moves
+        )
+        parts.append("</div></div>\n")
+    parts.append("</body>\n</html>\n")
+
+    os.makedirs(report_dir, exist_ok=True)
+    with open(output_html, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
+
+
+def generate_report(
+    plan: List[Tuple[List[str], List[Tuple[str, str]]]],
+    output_html: str,
+    scores: Optional[Dict[str, float]] = None,
+    thumb_dir: Optional[str] = None,
+    size: int = THUMB_SIZE,
+    num_workers: Optional[int] = None,
+    link_moved: bool = True,
+):
+    """生成缩略图并写出报告，缩略图默认缓存在报告所在目录的thumbs子目录"""
+    start = time.perf_counter()
+    thumb_dir = thumb_dir or os.path.join(
+        os.path.dirname(os.path.abspath(output_html)), "thumbs"
+    )
+    image_paths = [
+        path for kept, moves in plan for path in kept + [src for src, _ in moves]
+    ]
+    thumbnails = build_thumbnails(image_paths, thumb_dir, size, num_workers)
+    write_html_report(
+        plan, output_html, thumbnails, scores, size, link_moved=link_moved
+    )
+    print(
+        f"重复图像报告已保存到 {output_html}（{len(plan)} 组，{len(thumbnails)} 张缩略图，"
+        f"耗时 {time.perf_counter() - start:.1f}s）"
+    )
+
+
+def main():
+    import pandas as pd
+
+    from image_deduplication import move_plan
+
+    parser = argparse.ArgumentParser(description="由重复组CSV生成HTML报告")
+    parser.add_argument(
+        "--csv_file",
+        type=str,
+        required=True,
+        help="save_duplicates_to_csv输出的重复组CSV",
+    )
+    parser.add_argument(
+        "--output_html", type=str, default="./dedup_report.html", help="报告路径"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="./repeat",
+        help="重复图片的移动目标目录（用于展示决定）",
+    )
+    parser.add_argument("--no_keep_first", action="store_true", help="每组全部移动")
+    parser.add_argument(
+        "--moved", action="store_true", help="重复图片已被移动，链接指向移动后的位置"
+    )
+    parser.add_argument("--thumb_dir", type=str, default=None, help="缩略图缓存目录")
+    parser.add_argument(
+        "--thumb_size", type=int, default=THUMB_SIZE, help="缩略图最长边"
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=None, help="缩略图生成进程数"
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv_file, encoding="utf-8-sig")
+    groups = [
+        set(group["image_path"]) for _, group in df.groupby("group_id", sort=True)
+    ]
+    plan = move_plan(groups, args.output_dir, keep_first=not args.no_keep_first)
+    generate_report(
+        plan,
+        args.output_html,
+        thumb_dir=args.thumb_dir,
+        size=args.thumb_size,
+        num_workers=args.num_workers,
+        link_moved=args.moved,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+PD16-MW文件名编解码
+文件名格式：PD16-MW-CCCSSSSS + 后缀，CCC为3位类别编码，SSSSS为5位序号
+- 标注文件：PD16-MW-00200001.txt
+- 图片文件：PD16-MW-00200001.jpg
+- 中文描述：PD16-MW-00200001_caption.txt
+- 英文描述：PD16-MW-00200001_caption_en.txt
+后缀不区分大小写（PD16-MW-00200001.JPG同样识别为图片）
+
+正则在导入时编译一次，解析/生成结果按文件名缓存，
+reindex、去重、检索、划分以及api下的脚本都通过本模块取类别编码和序号，保证解析规则一致
+"""
+
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import Optional
+
+FILE_PREFIX = "PD16-MW-"  # 文件名前缀
+NUM_DIGITS_TOTAL = 8  # 文件名中数字部分总位数
+CLASS_CODE_DIGITS = 3  # 数字部分中类别编码的位数（前N位）
+UNKNOWN_CLASS = -1  # 文件名不符合格式时class_code_of的返回值
+
+# 文件类型标识 -> 文件名后缀
+SUFFIXES = {
+    "annotation": ".txt",
+    "image": ".jpg",
+    "caption_cn": "_caption.txt",
+    "caption_en": "_caption_en.txt",
+}
+_KIND_OF_SUFFIX = {suffix: kind for kind, suffix in SUFFIXES.items()}
+
+_SEQUENCE_DIGITS = NUM_DIGITS_TOTAL - CLASS_CODE_DIGITS
+_STEM = (
+    rf"{re.escape(FILE_PREFIX)}(\d{{{CLASS_CODE_DIGITS}}})(\d{{{_SEQUENCE_DIGITS}}})"
+)
+# 完整文件名：后缀按长度降序排列，_caption_en.txt优先于.txt匹配；后缀不区分大小写
+FILENAME_PATTERN = re.compile(
+    rf"^{_STEM}((?i:"
+    + "|".join(re.escape(s) for s in sorted(_KIND_OF_SUFFIX, key=len, reverse=True))
+    + r"))$"
+)
+# 只匹配编号部分，用于任意后缀的图片（去重、检索时可能是.png等）
+STEM_PATTERN = re.compile(rf"^{_STEM}")
+
+# (类别编码int, 序号str, 文件类型标识str)
+FileName = namedtuple("FileName", ["class_code", "sequence", "kind"])
+
+CACHE_SIZE = 1 << 17
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def try_parse(filename: str) -> Optional[FileName]:
+    """解析文件名（不含目录），格式不符时返回None"""
+    match = FILENAME_PATTERN.match(filename)
+    if match is None:
+        return None
+    class_code, sequence, suffix = match.groups()
+    return FileName(int(class_code), sequence, _KIND_OF_SUFFIX[suffix.lower()])
+
+
+def parse(filename: str) -> FileName:
+    """解析文件名（不含目录），格式不符时抛出ValueError"""
+    record = try_parse(filename)
+    if record is None:
+        raise ValueError(f"文件名格式不支持：{filename}")
+    return record
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def format_name(class_code: int, sequence: str, kind: str) -> str:
+    """由类别编码、序号和文件类型生成文件名"""
+    if kind not in SUFFIXES:
+        raise ValueError(f"不支持的文件类型：{kind}")
+    return f"{base_name(class_code, sequence)}{SUFFIXES[kind]}"
+
+
+def base_name(class_code: int, sequence: str) -> str:
+    """不带后缀的文件名，如PD16-MW-00200001"""
+    return f"{FILE_PREFIX}{class_code:0{CLASS_CODE_DIGITS}d}{sequence}"
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _class_code_of_name(filename: str) -> int:
+    match = STEM_PATTERN.match(filename)
+    return int(match.group(1)) if match else UNKNOWN_CLASS
+
+
+def class_code_of(path: str) -> int:
+    """从路径的文件名中取出类别编码（与parse一致为int，如2），格式不符时返回UNKNOWN_CLASS"""
+    return _class_code_of_name(os.path.basename(path))
@@ -1,36 +1,48 @@
 import os
 import argparse
 import shutil
+import tempfile
+import time
 from pathlib import Path
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Optional, Tuple, Set
 
 import numpy as np
-import pandas as pd
 from PIL import Image
-import matplotlib.pyplot as plt
-from sklearn.metrics.pairwise import cosine_similarity
-
-import torch
-import torch.nn as nn
-import torchvision.models as models
-import torchvision.transforms as transforms
-from torch.utils.data import Dataset, DataLoader
-
-# 设置中文字体支持
-plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
-
-# 定义图像转换
-transform = transforms.Compose(
-    [
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
+
+from filename_codec import class_code_of
+from image_hash import find_exact_duplicates, hash_prefilter
+
+# torch/torchvision/sklearn/pandas/matplotlib等重量级依赖在需要的阶段才导入，
+# 只做文件哈希去重时不会加载它们
+
+# 本地权重路径的环境变量（文件或目录），离线环境下可代替--weights参数
+WEIGHTS_ENV = "DEDUP_WEIGHTS"
+
+_transform = None
+# 进程内模型缓存：(backbone, device, weights, int8_model) -> 模型，处理多个目录时复用
+_model_cache = {}
+
+
+def get_transform():
+    """获取图像预处理转换（首次调用时构建）"""
+    global _transform
+    if _transform is None:
+        import torchvision.transforms as transforms
+
+        _transform = transforms.Compose(
+            [
+                transforms.Resize((224, 224)),
+                transforms.ToTensor(),
+                transforms.Normalize(
+                    mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]
+                ),
+            ]
+        )
+    return _transform
 
 
-class ImageDataset(Dataset):
-    """用于加载图像的数据集类"""
+class ImageDataset:
+    """用于加载图像的数据集类（满足DataLoader的映射式数据集接口）"""
 
     def __init__(self, image_paths: List[str], transform=None):
         self.image_paths = image_paths
@@ -52,81 +64,603 @@ class ImageDataset(Dataset):
             return None, image_path
 
 
-def get_feature_extractor():
-    """获取预训练的ResNet50模型作为特征提取器"""
-    model = models.resnet50(pretrained=True)
-    # 移除最后的全连接层，只保留特征提取部分
-    model = nn.Sequential(*list(model.children())[:-1])
+# 可选的特征提取骨干网络：名称 -> (torchvision模型名, 分类头属性名, 特征维度, 预训练权重)
+# 预训练权重固定为具体版本，不用DEFAULT：DEFAULT随torchvision版本变化（如resnet50已指向V2），
+# 会使特征、相似度阈值、特征缓存与语料索引全部失效
+BACKBONES = {
+    "resnet50": ("resnet50", "fc", 2048, "IMAGENET1K_V1"),
+    "resnet18": ("resnet18", "fc", 512, "IMAGENET1K_V1"),
+    "mobilenet_v3_large": ("mobilenet_v3_large", "classifier", 960, "IMAGENET1K_V1"),
+    "mobilenet_v3_small": ("mobilenet_v3_small", "classifier", 576, "IMAGENET1K_V1"),
+    "efficientnet_b0": ("efficientnet_b0", "classifier", 1280, "IMAGENET1K_V1"),
+}
+
+
+def pretrained_weights(backbone: str):
+    """骨干网络对应的torchvision预训练权重枚举"""
+    import torchvision.models as models
+
+    model_name, _, _, weights_name = BACKBONES[backbone]
+    return models.get_model_weights(model_name)[weights_name]
+
+
+def resolve_weights_file(backbone: str, weights: str) -> str:
+    """
+    解析本地权重文件路径
+    weights为文件时直接使用；为目录时按BACKBONES中固定的预训练权重文件名查找
+    （兼容TORCH_HOME缓存目录结构：<dir>/checkpoints/<文件名>）
+    """
+    if os.path.isfile(weights):
+        return weights
+
+    file_name = os.path.basename(pretrained_weights(backbone).url)
+    for candidate in (
+        os.path.join(weights, file_name),
+        os.path.join(weights, "checkpoints", file_name),
+    ):
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f"在 {weights} 中未找到 {backbone} 的权重文件 {file_name}")
+
+
+def model_identity(
+    backbone: str, weights: Optional[str] = None, int8_model: Optional[str] = None
+) -> str:
+    """
+    特征模型的标识，用于判断缓存或索引中的特征是否来自同一模型
+    INT8模型或自定义权重文件记为"绝对路径|大小|修改时间"；
+    使用固定版本的预训练权重（含其本地副本）时记为权重名
+    """
+    if int8_model:
+        path = int8_model
+    else:
+        weights = weights or os.environ.get(WEIGHTS_ENV)
+        if not weights:
+            return f"{backbone}|{BACKBONES[backbone][3]}"
+        path = resolve_weights_file(backbone, weights)
+        if os.path.basename(path) == os.path.basename(pretrained_weights(backbone).url):
+            return f"{backbone}|{BACKBONES[backbone][3]}"
+    stat = os.stat(path)
+    return f"{backbone}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def get_feature_extractor(backbone: str = "resnet50", weights: Optional[str] = None):
+    """
+    获取预训练的骨干网络作为特征提取器，默认ResNet50
+    weights: 本地权重文件或目录，未指定时读取环境变量DEDUP_WEIGHTS；
+             都未设置时使用BACKBONES中固定版本的预训练权重（已缓存则不联网，否则首次下载）
+    """
+    if backbone not in BACKBONES:
+        raise ValueError(f"不支持的骨干网络：{backbone}（可选：{list(BACKBONES)}）")
+
+    import torch
+    import torch.nn as nn
+    import torchvision.models as models
+
+    model_name, head_attr, _, _ = BACKBONES[backbone]
+    weights = weights or os.environ.get(WEIGHTS_ENV)
+    if weights:
+        weights_file = resolve_weights_file(backbone, weights)
+        model = models.get_model(model_name, weights=None)
+        model.load_state_dict(
+            torch.load(weights_file, map_location="cpu", weights_only=True)
+        )
+    else:
+        model = models.get_model(model_name, weights=pretrained_weights(backbone))
+    # 将分类头替换为恒等映射，输出全局池化后的特征向量
+    setattr(model, head_attr, nn.Identity())
     model.eval()
     return model
 
 
-@torch.no_grad()
+def load_model(
+    backbone: str = "resnet50",
+    device: Optional[str] = None,
+    weights: Optional[str] = None,
+    int8_model: Optional[str] = None,
+):
+    """
+    构建特征提取模型，同一进程内按参数缓存复用
+    返回：(模型, torch设备, 输入张量内存布局)
+    """
+    import torch
+
+    if int8_model:
+        device = "cpu"
+        memory_format = torch.contiguous_format
+    else:
+        device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        # channels_last内存布局对卷积网络在CPU/GPU上都更快
+        memory_format = torch.channels_last
+
+    key = (backbone, device, weights, int8_model)
+    if key not in _model_cache:
+        start = time.perf_counter()
+        if int8_model:
+            from dedup_quantize import load_quantized_extractor
+
+            model = load_quantized_extractor(int8_model)
+            name = int8_model
+        else:
+            model = get_feature_extractor(backbone, weights).to(
+                device, memory_format=memory_format
+            )
+            name = backbone
+        _model_cache[key] = model
+        print(f"模型 {name} 已加载到 {device}，耗时 {time.perf_counter() - start:.2f}s")
+
+    return _model_cache[key], torch.device(device), memory_format
+
+
+def collate_skip_failed(batch):
+    """过滤掉无法加载的图像后再组成批次，整批失败时返回(None, [])"""
+    import torch
+
+    valid = [(image, path) for image, path in batch if image is not None]
+    if not valid:
+        return None, []
+    images, paths = zip(*valid)
+    return torch.stack(images), list(paths)
+
+
+def iter_image_batches(image_paths: List[str], batch_size: int = 32):
+    """按批次读取并预处理图像，产出(图像张量, 路径列表)"""
+    from torch.utils.data import DataLoader
+
+    dataset = ImageDataset(image_paths, transform=get_transform())
+    dataloader = DataLoader(
+        dataset, batch_size=batch_size, shuffle=False, collate_fn=collate_skip_failed
+    )
+    for images, paths in dataloader:
+        if images is not None:
+            yield images, paths
+
+
 def extract_features(
-    image_paths: List[str], batch_size: int = 32
+    image_paths: List[str],
+    batch_size: int = 32,
+    backbone: str = "resnet50",
+    int8_model: Optional[str] = None,
+    device: Optional[str] = None,
+    weights: Optional[str] = None,
 ) -> Dict[str, np.ndarray]:
-    """从图像中提取特征"""
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = get_feature_extractor().to(device)
+    """
+    从图像中提取特征
+    int8_model: dedup_quantize.py导出的INT8量化模型路径，指定后在CPU上使用量化模型推理
+    device: 推理设备，默认有GPU时使用cuda，否则使用cpu
+    weights: 本地权重文件或目录，见get_feature_extractor
+    """
+    import torch
 
-    dataset = ImageDataset(image_paths, transform=transform)
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    model, device, memory_format = load_model(backbone, device, weights, int8_model)
 
     features = {}
 
-    for images, paths in dataloader:
-        # 过滤掉无法加载的图像
-        valid_indices = [i for i, img in enumerate(images) if img is not None]
-        if not valid_indices:
-            continue
+    with torch.inference_mode():
+        for images, paths in iter_image_batches(image_paths, batch_size):
+            images = images.to(device, memory_format=memory_format)
+            # 提取特征并展平为一维向量
+            outputs = model(images).flatten(1).cpu().numpy()
+
+            # 保存特征
+            for path, feature in zip(paths, outputs):
+                features[path] = feature
+
+    return features
+
+
+def _extract_shard(
+    shard_paths: List[str],
+    row_offset: int,
+    matrix_file: str,
+    mask_file: str,
+    shape: Tuple[int, int],
+    num_threads: int,
+    batch_size: int,
+    backbone: str,
+    int8_model: Optional[str],
+    weights: Optional[str],
+) -> int:
+    """子进程：提取一个分片的特征，直接写入共享的内存映射矩阵，返回成功数量"""
+    import torch
+
+    torch.set_num_threads(num_threads)
+    matrix = np.memmap(matrix_file, dtype=np.float32, mode="r+", shape=shape)
+    mask = np.memmap(mask_file, dtype=np.uint8, mode="r+", shape=(shape[0],))
+    rows = {path: row_offset + i for i, path in enumerate(shard_paths)}
+
+    features = extract_features(
+        shard_paths,
+        batch_size=batch_size,
+        backbone=backbone,
+        int8_model=int8_model,
+        device="cpu",
+        weights=weights,
+    )
+    for path, feature in features.items():
+        matrix[rows[path]] = feature
+        mask[rows[path]] = 1
+    matrix.flush()
+    mask.flush()
+    return len(features)
 
-        valid_images = torch.stack([images[i] for i in valid_indices]).to(device)
-        valid_paths = [paths[i] for i in valid_indices]
 
-        # 提取特征
-        outputs = model(valid_images)
-        # 将特征展平为一维向量
-        outputs = outputs.squeeze(-1).squeeze(-1).cpu().numpy()
+def extract_features_sharded(
+    image_paths: List[str],
+    num_shards: int,
+    batch_size: int = 32,
+    backbone: str = "resnet50",
+    int8_model: Optional[str] = None,
+    weights: Optional[str] = None,
+) -> Dict[str, np.ndarray]:
+    """
+    多进程分片提取特征（纯CPU环境）
+    image_paths按连续区间切分为num_shards份，每个进程加载自己的模型副本，
+    并按CPU核数平分torch线程数；结果写入同一个内存映射矩阵，避免进程间传输大数组
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    num_shards = max(1, min(num_shards, len(image_paths)))
+    num_threads = max(1, (os.cpu_count() or 1) // num_shards)
+    shape = (len(image_paths), BACKBONES[backbone][2])
+    shard_size = (len(image_paths) + num_shards - 1) // num_shards
+
+    with tempfile.TemporaryDirectory(prefix="dedup_features_") as tmp_dir:
+        matrix_file = os.path.join(tmp_dir, "features.f32")
+        mask_file = os.path.join(tmp_dir, "mask.u8")
+        np.memmap(matrix_file, dtype=np.float32, mode="w+", shape=shape).flush()
+        np.memmap(mask_file, dtype=np.uint8, mode="w+", shape=(shape[0],)).flush()
+
+        print(f"特征提取分为 {num_shards} 个进程，每个进程 {num_threads} 个线程")
+        start = time.perf_counter()
+        # 使用spawn启动子进程，避免fork继承父进程的torch线程池状态
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=num_shards, mp_context=context
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _extract_shard,
+                    image_paths[offset : offset + shard_size],
+                    offset,
+                    matrix_file,
+                    mask_file,
+                    shape,
+                    num_threads,
+                    batch_size,
+                    backbone,
+                    int8_model,
+                    weights,
+                )
+                for offset in range(0, len(image_paths), shard_size)
+            ]
+            done = sum(future.result() for future in futures)
+        elapsed = time.perf_counter() - start
+        print(f"分片特征提取完成：{done} 张，{done / elapsed:.1f} images/s")
 
-        # 保存特征
-        for path, feature in zip(valid_paths, outputs):
-            features[path] = feature
+        matrix = np.memmap(matrix_file, dtype=np.float32, mode="r", shape=shape)
+        mask = np.memmap(mask_file, dtype=np.uint8, mode="r", shape=(shape[0],))
+        features = {
+            path: np.array(matrix[i]) for i, path in enumerate(image_paths) if mask[i]
+        }
+        # Windows下需先释放内存映射才能删除临时目录
+        del matrix, mask
 
     return features
 
 
+def compute_similarity_edges(
+    features: Dict[str, np.ndarray], min_threshold: float, block_size: int = 1024
+) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    计算相似度不低于min_threshold的所有图片对（只保留上三角i<j）
+    按块计算余弦相似度，内存占用与block_size*N成正比，而不是N*N
+    返回：(路径列表, 行索引, 列索引, 相似度)，按相似度从高到低排序
+    """
+    paths = list(features.keys())
+    if len(paths) < 2:
+        empty = np.empty(0, dtype=np.int64)
+        return paths, empty, empty, np.empty(0, dtype=np.float32)
+
+    matrix = np.array([features[path] for path in paths], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+    rows, cols, sims = [], [], []
+    for start in range(0, len(paths), block_size):
+        similarity = matrix[start : start + block_size] @ matrix.T
+        hit_r, hit_c = np.nonzero(similarity >= min_threshold)
+        upper = hit_c > hit_r + start
+        hit_r, hit_c = hit_r[upper], hit_c[upper]
+        rows.append(hit_r + start)
+        cols.append(hit_c)
+        sims.append(similarity[hit_r, hit_c])
+
+    rows, cols, sims = np.concatenate(rows), np.concatenate(cols), np.concatenate(sims)
+    order = np.argsort(-sims, kind="stable")
+    return paths, rows[order], cols[order], sims[order]
+
+
+def groups_from_edges(
+    paths: List[str], rows: np.ndarray, cols: np.ndarray
+) -> List[Set[str]]:
+    """
+    由图片对构造重复组，分组规则与逐行扫描相似度矩阵一致：
+    按行号顺序，未被归组的图片i与所有相似的j>i组成一组，组内的j不再作为组首
+    """
+    order = np.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else []
+
+    duplicates = []
+    visited = set()
+    for k, start in enumerate(starts):
+        end = starts[k + 1] if k + 1 < len(starts) else len(rows)
+        i = int(rows[start])
+        if i in visited:
+            continue
+        members = cols[start:end]
+        visited.update(members.tolist())
+        duplicates.append({paths[i]} | {paths[j] for j in members})
+    return duplicates
+
+
 def find_duplicates(
     features: Dict[str, np.ndarray], threshold: float = 0.95
 ) -> List[Set[str]]:
     """找出相似的图像组"""
-    paths = list(features.keys())
-    feature_matrix = np.array([features[path] for path in paths])
+    paths, rows, cols, _ = compute_similarity_edges(features, threshold)
+    return groups_from_edges(paths, rows, cols)
 
-    # 计算余弦相似度矩阵
-    similarity_matrix = cosine_similarity(feature_matrix)
 
-    # 找出相似度超过阈值的图像对
-    duplicates = []
-    visited = set()
+def _describe_group(group: Set[str], max_names: int = 5) -> str:
+    """组内文件名的简短描述，超出部分只显示数量"""
+    names = sorted(os.path.basename(path) for path in group)
+    text = ";".join(names[:max_names])
+    if len(names) > max_names:
+        text += f";...(+{len(names) - max_names})"
+    return text
 
-    for i in range(len(paths)):
-        if i in visited:
+
+def sweep_thresholds(
+    feature_parts: List[Dict[str, np.ndarray]],
+    thresholds: List[float],
+    base_groups: Optional[List[Set[str]]] = None,
+    num_examples: int = 3,
+) -> List[dict]:
+    """
+    阈值扫描：每个特征分区只在最低阈值下计算一次图片对，
+    之后按相似度排序取前缀即可得到任意更高阈值下的分组
+    base_groups: 与阈值无关的前置阶段结果（文件哈希/感知哈希），会与每个阈值的结果合并
+    """
+    base_groups = base_groups or []
+    edge_parts = [
+        compute_similarity_edges(part, min(thresholds)) for part in feature_parts
+    ]
+
+    results = []
+    for threshold in sorted(thresholds):
+        cnn_groups = []
+        for paths, rows, cols, sims in edge_parts:
+            # 相似度降序排列，>=threshold的图片对是一个前缀
+            count = int(np.searchsorted(-sims, -threshold, side="right"))
+            cnn_groups.extend(groups_from_edges(paths, rows[:count], cols[:count]))
+        groups = merge_stage_groups(base_groups, cnn_groups)
+        results.append(
+            {
+                "threshold": threshold,
+                "groups": len(groups),
+                "images_in_groups": sum(len(group) for group in groups),
+                "images_removed": sum(len(group) - 1 for group in groups),
+                "examples": " | ".join(
+                    _describe_group(group) for group in groups[:num_examples]
+                ),
+            }
+        )
+    return results
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    """文件签名（修改时间ns, 大小），用于判断特征缓存是否失效"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_feature_cache(
+    cache_file: str, model_key: str
+) -> Dict[str, Tuple[Tuple[int, int], np.ndarray]]:
+    """读取特征缓存，模型不一致或文件不存在时返回空缓存"""
+    if not os.path.exists(cache_file):
+        return {}
+    data = np.load(cache_file, allow_pickle=False)
+    if str(data["model_key"]) != model_key:
+        print(
+            f"特征缓存 {cache_file} 的模型为 {data['model_key']}，与当前模型不一致，忽略"
+        )
+        return {}
+    return {
+        path: ((int(mtime), int(size)), feature)
+        for path, mtime, size, feature in zip(
+            data["paths"].tolist(), data["mtimes"], data["sizes"], data["features"]
+        )
+    }
+
+
+def save_feature_cache(
+    cache_file: str,
+    model_key: str,
+    cache: Dict[str, Tuple[Tuple[int, int], np.ndarray]],
+):
+    """保存特征缓存（.npz），记录每张图片的修改时间和大小"""
+    paths = list(cache.keys())
+    if not paths:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+    np.savez(
+        cache_file,
+        model_key=np.array(model_key),
+        paths=np.array(paths),
+        mtimes=np.array([cache[path][0][0] for path in paths], dtype=np.int64),
+        sizes=np.array([cache[path][0][1] for path in paths], dtype=np.int64),
+        features=np.stack([cache[path][1] for path in paths]).astype(np.float32),
+    )
+
+
+def partition_by_class(
+    features: Dict[str, np.ndarray],
+) -> Dict[int, Dict[str, np.ndarray]]:
+    """按文件名中的类别编码划分特征"""
+    partitions: Dict[int, Dict[str, np.ndarray]] = {}
+    for path, feature in features.items():
+        partitions.setdefault(class_code_of(path), {})[path] = feature
+    return partitions
+
+
+def split_groups_by_class(
+    groups: List[Set[str]], kept_paths: Optional[List[str]] = None
+) -> Tuple[List[Set[str]], Optional[List[str]]]:
+    """
+    按文件名中的类别编码拆分重复组，只保留同一类别内的重复关系（跨类别的由泄漏扫描报告）
+    kept_paths：前置阶段保留、继续参与比对的图片；拆分后每个类别至少保留一张，避免漏比
+    返回：(类别内的重复组, 更新后的kept_paths)
+    """
+    kept = list(kept_paths) if kept_paths is not None else None
+    kept_set = set(kept or [])
+    class_groups = []
+    for group in groups:
+        by_class: Dict[int, Set[str]] = {}
+        for path in group:
+            by_class.setdefault(class_code_of(path), set()).add(path)
+        for members in by_class.values():
+            if len(members) > 1:
+                class_groups.append(members)
+            if kept is not None and not members & kept_set:
+                kept.append(min(members))
+    return class_groups, kept
+
+
+def find_duplicates_partitioned(
+    features: Dict[str, np.ndarray],
+    threshold: float = 0.95,
+    num_workers: Optional[int] = None,
+) -> List[Set[str]]:
+    """在每个类别内部分别查找重复图片（多线程并行），不做跨类别比较"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    partitions = partition_by_class(features)
+    print(
+        "按类别分区去重："
+        + "，".join(
+            f"{code:03d}({len(part)}张)" for code, part in sorted(partitions.items())
+        )
+    )
+    # 相似度矩阵计算在numpy/BLAS中释放GIL，线程池即可并行
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = executor.map(
+            lambda part: find_duplicates(part, threshold=threshold),
+            [partitions[code] for code in sorted(partitions)],
+        )
+        return [group for groups in results for group in groups]
+
+
+def find_cross_class_leaks(
+    features: Dict[str, np.ndarray],
+    threshold: float = 0.95,
+    block_size: int = 1024,
+) -> List[Tuple[str, str, float]]:
+    """
+    跨类别泄漏扫描：查找被归到不同害虫类别下的同一张图片（标注噪声）
+    只比较不同类别之间的图片对，按块计算避免构造完整相似度矩阵
+    返回：[(图片a, 图片b, 相似度)]
+    """
+    paths = list(features.keys())
+    if not paths:
+        return []
+    matrix = np.array([features[path] for path in paths], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+    codes = np.array([class_code_of(path) for path in paths])
+
+    leaks = []
+    for code in sorted(set(codes)):
+        rows = np.flatnonzero(codes == code)
+        # 每对类别只比较一次：当前类别与编码更大的类别
+        cols = np.flatnonzero(codes > code)
+        if len(cols) == 0:
             continue
+        for start in range(0, len(rows), block_size):
+            block_rows = rows[start : start + block_size]
+            similarity = matrix[block_rows] @ matrix[cols].T
+            hit_r, hit_c = np.nonzero(similarity >= threshold)
+            for r, c in zip(hit_r, hit_c):
+                leaks.append(
+                    (paths[block_rows[r]], paths[cols[c]], float(similarity[r, c]))
+                )
+    return leaks
 
-        group = {paths[i]}
-        for j in range(i + 1, len(paths)):
-            if similarity_matrix[i, j] >= threshold:
-                group.add(paths[j])
-                visited.add(j)
 
-        if len(group) > 1:
-            duplicates.append(group)
+def save_leaks_to_csv(leaks: List[Tuple[str, str, float]], output_file: str):
+    """将跨类别疑似重复图片对保存到CSV文件"""
+    import pandas as pd
 
-    return duplicates
+    df = pd.DataFrame(
+        [
+            {
+                "image_a": a,
+                "class_a": class_code_of(a),
+                "image_b": b,
+                "class_b": class_code_of(b),
+                "similarity": round(similarity, 4),
+            }
+            for a, b, similarity in leaks
+        ],
+        columns=["image_a", "class_a", "image_b", "class_b", "similarity"],
+    )
+    df.to_csv(output_file, index=False, encoding="utf-8-sig")
+    print(f"跨类别疑似重复信息已保存到 {output_file}")
+
+
+def merge_groups(groups: List[Set[str]]) -> List[Set[str]]:
+    """合并存在共同图片的重复组（并查集），用于汇总各阶段的结果"""
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for group in groups:
+        members = list(group)
+        for other in members[1:]:
+            parent[find(other)] = find(members[0])
+
+    merged: Dict[str, Set[str]] = {}
+    for path in parent:
+        merged.setdefault(find(path), set()).add(path)
+    return [group for group in merged.values() if len(group) > 1]
+
+
+def merge_stage_groups(
+    base_groups: List[Set[str]], cnn_groups: List[Set[str]]
+) -> List[Set[str]]:
+    """
+    汇总各阶段结果：文件哈希/感知哈希组之间、以及它们与CNN组之间有共同图片时合并；
+    CNN组之间不做传递合并，保持find_duplicates的分组（A~B、B~C不会连成{A,B,C}）
+    """
+    base_paths = {path for group in base_groups for path in group}
+    linked = [group for group in cnn_groups if not base_paths.isdisjoint(group)]
+    separate = [group for group in cnn_groups if base_paths.isdisjoint(group)]
+    return merge_groups(list(base_groups) + linked) + separate
 
 
 def visualize_duplicates(duplicate_groups: List[Set[str]], max_groups: int = 5):
     """可视化重复的图像组"""
+    import matplotlib.pyplot as plt
+
+    # 设置中文字体支持
+    plt.rcParams["font.family"] = ["SimHei", "WenQuanYi Micro Hei", "Heiti TC"]
+
     for i, group in enumerate(duplicate_groups[:max_groups]):
         plt.figure(figsize=(15, 10))
         plt.suptitle(f"重复图像组 {i+1}", fontsize=16)
@@ -147,9 +681,11 @@ def visualize_duplicates(duplicate_groups: List[Set[str]], max_groups: int = 5):
 
 def save_duplicates_to_csv(duplicate_groups: List[Set[str]], output_file: str):
     """将重复图像组保存到CSV文件"""
+    import pandas as pd
+
     data = []
     for group_id, group in enumerate(duplicate_groups):
-        for path in group:
+        for path in sorted(group):
             data.append(
                 {
                     "group_id": group_id,
@@ -158,29 +694,45 @@ def save_duplicates_to_csv(duplicate_groups: List[Set[str]], output_file: str):
                 }
             )
 
-    df = pd.DataFrame(data)
+    # 没有重复组时也写出表头，下游读取时列名不缺失
+    df = pd.DataFrame(data, columns=["group_id", "image_path", "file_name"])
     df.to_csv(output_file, index=False, encoding="utf-8-sig")
     print(f"重复图像信息已保存到 {output_file}")
 
 
+def move_plan(
+    duplicate_groups: List[Set[str]], destination_dir: str, keep_first: bool = True
+) -> List[Tuple[List[str], List[Tuple[str, str]]]]:
+    """
+    生成每组的保留/移动决定：组内按路径排序，keep_first时保留第一张
+    返回：[(保留的图片列表, [(原路径, 目标路径)])]，移动与报告共用同一份决定
+    """
+    plan = []
+    for group_id, group in enumerate(duplicate_groups):
+        members = sorted(group)
+        kept = members[:1] if keep_first else []
+        moves = [
+            # 添加组ID作为前缀，避免文件名冲突
+            (
+                src,
+                os.path.join(
+                    destination_dir, f"group_{group_id}_{os.path.basename(src)}"
+                ),
+            )
+            for src in members[len(kept) :]
+        ]
+        plan.append((kept, moves))
+    return plan
+
+
 def move_duplicates(
     duplicate_groups: List[Set[str]], destination_dir: str, keep_first: bool = True
 ):
     """移动重复的图像到指定目录"""
     os.makedirs(destination_dir, exist_ok=True)
 
-    for group_id, group in enumerate(duplicate_groups):
-        # 转换为列表以便索引
-        group_list = list(group)
-        # 如果keep_first为True，则保留第一个图像，移动其余的
-        # 否则，移动所有图像
-        start_idx = 1 if keep_first else 0
-
-        for i in range(start_idx, len(group_list)):
-            src_path = group_list[i]
-            file_name = os.path.basename(src_path)
-            # 添加组ID作为前缀，避免文件名冲突
-            dst_path = os.path.join(destination_dir, f"group_{group_id}_{file_name}")
+    for _, moves in move_plan(duplicate_groups, destination_dir, keep_first):
+        for src_path, dst_path in moves:
             try:
                 shutil.move(src_path, dst_path)
                 print(f"已移动: {src_path} -> {dst_path}")
@@ -188,32 +740,243 @@ def move_duplicates(
                 print(f"无法移动 {src_path}: {e}")
 
 
+def default_report_path(input_dir: str) -> str:
+    """默认报告路径：当前工作目录下按输入目录命名，不写入数据集或重复图片输出目录"""
+    name = os.path.basename(os.path.normpath(input_dir))
+    return os.path.join(os.getcwd(), f"dedup_report_{name}.html")
+
+
+def dedup_folder(input_dir: str, output_dir: str, args):
+    """对单个目录执行完整的去重流程"""
+    # 获取所有图片文件
+    image_extensions = [".jpg", ".jpeg", ".png", ".bmp", ".webp"]
+    image_paths = []
+
+    for root, _, files in os.walk(input_dir):
+        for file in files:
+            if any(file.lower().endswith(ext) for ext in image_extensions):
+                image_paths.append(os.path.join(root, file))
+
+    print(f"找到 {len(image_paths)} 张图片")
+
+    if not image_paths:
+        print("没有找到图片，跳过该目录")
+        return
+
+    duplicate_groups = []
+    exact_groups, hash_groups = [], []
+    cnn_paths = image_paths
+
+    # 字节完全相同的图片直接成组，不解码，只保留每组一张进入后续阶段
+    if not args.no_exact:
+        print("正在按文件内容查找完全相同的图片...")
+        start = time.perf_counter()
+        exact_groups, cnn_paths = find_exact_duplicates(
+            image_paths, num_workers=args.num_workers
+        )
+        if args.partition_by_class:
+            # 跨类别的完全相同图片只通过泄漏扫描报告，不移动；每个类别各保留一张继续比对
+            class_groups, cnn_paths = split_groups_by_class(exact_groups, cnn_paths)
+            duplicate_groups.extend(class_groups)
+        else:
+            duplicate_groups.extend(exact_groups)
+        print(
+            f"内容哈希耗时 {time.perf_counter() - start:.1f}s，找到 {len(exact_groups)} 组完全相同的图片，"
+            f"剩余 {len(cnn_paths)} 张待比对"
+        )
+
+    # 感知哈希预筛选：确定的重复直接成组，只有疑似重复的图片进入CNN阶段
+    if args.prefilter != "none":
+        print(f"正在计算感知哈希（{args.prefilter}）...")
+        start = time.perf_counter()
+        hash_groups, cnn_paths = hash_prefilter(
+            cnn_paths,
+            method=args.prefilter,
+            strict_distance=args.hash_strict,
+            loose_distance=args.hash_loose,
+            num_workers=args.num_workers,
+        )
+        if args.partition_by_class:
+            duplicate_groups.extend(split_groups_by_class(hash_groups)[0])
+        else:
+            duplicate_groups.extend(hash_groups)
+        print(
+            f"哈希阶段耗时 {time.perf_counter() - start:.1f}s，确定 {len(hash_groups)} 组重复，"
+            f"{len(cnn_paths)} 张疑似重复图片交给CNN复核"
+        )
+
+    features = {}
+    if cnn_paths:
+        # 提取特征（命中缓存且文件未修改的图片直接复用）
+        # 缓存键包含实际使用的权重，换权重后不会误用旧特征
+        model_key = model_identity(args.backbone, args.weights, args.int8_model)
+        cache = (
+            load_feature_cache(args.feature_cache, model_key)
+            if args.feature_cache
+            else {}
+        )
+        for path in cnn_paths:
+            if path in cache and cache[path][0] == _file_signature(path):
+                features[path] = cache[path][1]
+        missing = [path for path in cnn_paths if path not in features]
+        if cache:
+            print(f"特征缓存命中 {len(features)} 张，需要提取 {len(missing)} 张")
+
+        if missing:
+            print("正在提取图片特征...")
+            if args.shards > 1:
+                new_features = extract_features_sharded(
+                    missing,
+                    num_shards=args.shards,
+                    batch_size=args.batch_size,
+                    backbone=args.backbone,
+                    int8_model=args.int8_model,
+                    weights=args.weights,
+                )
+            else:
+                new_features = extract_features(
+                    missing,
+                    batch_size=args.batch_size,
+                    backbone=args.backbone,
+                    int8_model=args.int8_model,
+                    weights=args.weights,
+                )
+            features.update(new_features)
+            if args.feature_cache:
+                for path, feature in new_features.items():
+                    cache[path] = (_file_signature(path), feature)
+                save_feature_cache(args.feature_cache, model_key, cache)
+        print(f"共获得 {len(features)} 张图片的特征")
+
+    if args.sweep:
+        # 阈值扫描模式：只报告各阈值下的结果，不移动文件
+        # （前置阶段没有留下待CNN复核的图片时，各阈值结果相同）
+        thresholds = args.sweep
+        if args.partition_by_class:
+            partitions = partition_by_class(features)
+            parts = [partitions[code] for code in sorted(partitions)]
+        else:
+            parts = [features]
+        start = time.perf_counter()
+        rows = sweep_thresholds(parts, thresholds, base_groups=duplicate_groups)
+        print(f"阈值扫描耗时 {time.perf_counter() - start:.2f}s")
+        for row in rows:
+            print(
+                f"阈值 {row['threshold']:.3f}：{row['groups']} 组，"
+                f"移除 {row['images_removed']} 张，示例：{row['examples'] or '-'}"
+            )
+        if args.sweep_csv:
+            import pandas as pd
+
+            pd.DataFrame(rows).to_csv(args.sweep_csv, index=False, encoding="utf-8-sig")
+            print(f"阈值扫描结果已保存到 {args.sweep_csv}")
+        return
+
+    cnn_groups = []
+    if features:
+        # 找出重复图片
+        print("正在查找重复图片...")
+        if args.partition_by_class:
+            cnn_groups = find_duplicates_partitioned(
+                features, threshold=args.threshold, num_workers=args.num_workers
+            )
+        else:
+            cnn_groups = find_duplicates(features, threshold=args.threshold)
+
+    duplicate_groups = merge_stage_groups(duplicate_groups, cnn_groups)
+    print(f"找到 {len(duplicate_groups)} 组重复图片")
+
+    if args.cross_class_scan:
+        # 文件哈希/感知哈希阶段已成组的图片若跨类别，同样属于泄漏
+        # （完全相同的文件相似度记为1.0，感知哈希组没有余弦相似度，记为NaN）
+        leaks = [
+            (a, b, similarity)
+            for groups, similarity in ((exact_groups, 1.0), (hash_groups, float("nan")))
+            for group in groups
+            for a in sorted(group)
+            for b in sorted(group)
+            if class_code_of(a) < class_code_of(b)
+        ]
+        if features:
+            leak_threshold = args.leak_threshold or args.threshold
+            leaks.extend(find_cross_class_leaks(features, threshold=leak_threshold))
+        # 同一图片对可能在多个阶段被发现，只保留最先发现的一条
+        first_seen = {}
+        for a, b, similarity in leaks:
+            first_seen.setdefault((a, b), (a, b, similarity))
+        leaks = list(first_seen.values())
+        print(f"跨类别扫描：发现 {len(leaks)} 对疑似同一图片被归入不同类别")
+        save_leaks_to_csv(leaks, args.leak_csv)
+
+    # 保存重复图片信息到CSV（make_splits.py、dedup_report.py等读取此文件）
+    if args.csv_file:
+        save_duplicates_to_csv(duplicate_groups, args.csv_file)
+
+    # 生成HTML报告（不阻塞），matplotlib窗口仅在--plot时打开
+    if args.visualize and duplicate_groups:
+        from dedup_report import generate_report, group_similarities
+
+        plan = move_plan(duplicate_groups, output_dir, keep_first=args.keep_first)
+        scores = group_similarities(plan, features or None, exact_groups)
+        generate_report(
+            plan,
+            args.report_html or default_report_path(input_dir),
+            scores=scores,
+            thumb_dir=args.thumb_dir,
+            num_workers=args.num_workers,
+            link_moved=not args.no_move,
+        )
+    if args.plot and duplicate_groups:
+        visualize_duplicates(duplicate_groups)
+
+    # 移动重复图片
+    if not args.no_move and duplicate_groups:
+        move_duplicates(duplicate_groups, output_dir, keep_first=args.keep_first)
+
+    print("图片去重处理完成!")
+
+
 def main():
     parser = argparse.ArgumentParser(description="基于深度学习的图片去重工具")
     parser.add_argument(
         "--input_dir",
         type=str,
-        default=r"C:\Users\35088\Desktop\25.7.24\pest_text\api\data\08_xijiangchong",
-        help="包含图片的输入目录",
+        nargs="+",
+        default=[r"C:\Users\35088\Desktop\25.7.24\pest_text\api\data\08_xijiangchong"],
+        help="包含图片的输入目录，可指定多个（模型只加载一次，各目录分别去重）",
     )
     parser.add_argument(
         "--output_dir",
         type=str,
         default=r"C:\Users\35088\Desktop\25.7.24\pest_text\api\repeat\08_xijiangchong",
-        help="重复图片的输出目录",
+        help="重复图片的输出目录，指定多个输入目录时按输入目录名建立子目录",
     )
     parser.add_argument(
         "--threshold",
         type=float,
         default=0.95,
-        help="相似度阈值，范围从0到1，值越大表示要求越严格",
+        help="相似度阈值，范围从0到1，值越大表示要求越严格；"
+        "CNN阶段的组之间不做传递合并，只与哈希阶段有共同图片的组合并",
     )
     parser.add_argument("--batch_size", type=int, default=32, help="批量处理的图片数量")
+    parser.add_argument(
+        "--int8_model",
+        type=str,
+        default=None,
+        help="dedup_quantize.py导出的INT8量化模型路径，指定后使用CPU量化推理（--backbone需与量化时一致）",
+    )
+    parser.add_argument(
+        "--backbone",
+        type=str,
+        default="resnet50",
+        choices=list(BACKBONES),
+        help="特征提取骨干网络，轻量模型速度更快但需重新评估阈值",
+    )
     parser.add_argument(
         "--csv_file",
         type=str,
         default="./duplicates.csv",
-        help="保存重复图片信息的CSV文件",
+        help="保存重复图片信息的CSV文件（make_splits.py --dup_csv的输入），传空字符串则不保存",
     )
     parser.add_argument(
         "--keep_first",
@@ -225,48 +988,137 @@ def main():
         "--no_move", action="store_true", help="只识别重复图片，不移动它们"
     )
     parser.add_argument(
-        "--visualize", default=True, action="store_true", help="可视化部分重复图片组"
+        "--visualize",
+        default=True,
+        action="store_true",
+        help="生成包含全部重复组缩略图、相似度和保留/移动决定的HTML报告",
+    )
+    parser.add_argument(
+        "--no_visualize",
+        dest="visualize",
+        action="store_false",
+        help="不生成HTML报告",
+    )
+    parser.add_argument(
+        "--report_html",
+        type=str,
+        default=None,
+        help="HTML报告路径，默认为当前工作目录下的dedup_report_<输入目录名>.html",
+    )
+    parser.add_argument(
+        "--thumb_dir",
+        type=str,
+        default=None,
+        help="缩略图缓存目录，默认为报告所在目录的thumbs子目录",
+    )
+    parser.add_argument(
+        "--plot",
+        action="store_true",
+        help="额外用matplotlib窗口显示前5组重复图片（会阻塞，需图形界面）",
+    )
+    parser.add_argument(
+        "--no_exact",
+        action="store_true",
+        help="关闭按文件内容哈希查找完全相同图片的预处理",
+    )
+    parser.add_argument(
+        "--prefilter",
+        type=str,
+        default="none",
+        choices=["none", "phash", "dhash"],
+        help="感知哈希预筛选算法，none表示所有图片都走CNN特征比对",
+    )
+    parser.add_argument(
+        "--hash_strict",
+        type=int,
+        default=4,
+        help="汉明距离不超过该值的图片直接判定为重复（64位哈希）",
+    )
+    parser.add_argument(
+        "--hash_loose",
+        type=int,
+        default=12,
+        help="汉明距离在(hash_strict, hash_loose]内的图片交给CNN复核",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="特征提取的CPU进程数，大于1时按进程分片并行提取（适用于多核无GPU主机）",
+    )
+    parser.add_argument(
+        "--partition_by_class",
+        action="store_true",
+        help="只在同一类别编码（文件名第9-11位）内部比较，各类别并行去重",
+    )
+    parser.add_argument(
+        "--cross_class_scan",
+        action="store_true",
+        help="额外扫描不同类别之间的重复图片（标注噪声），结果只报告不移动",
+    )
+    parser.add_argument(
+        "--leak_threshold",
+        type=float,
+        default=None,
+        help="跨类别扫描的相似度阈值，默认与--threshold相同",
+    )
+    parser.add_argument(
+        "--leak_csv",
+        type=str,
+        default="./cross_class_leaks.csv",
+        help="保存跨类别疑似重复图片对的CSV文件",
+    )
+    parser.add_argument(
+        "--feature_cache",
+        type=str,
+        default=None,
+        help="特征缓存文件（.npz），按路径+修改时间+大小复用已提取的特征",
+    )
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        default=None,
+        help="阈值扫描，逗号分隔的阈值列表（如0.90,0.93,0.95），只报告结果不移动文件",
+    )
+    parser.add_argument(
+        "--sweep_csv",
+        type=str,
+        default="./threshold_sweep.csv",
+        help="保存阈值扫描结果的CSV文件",
+    )
+    parser.add_argument(
+        "--weights",
+        type=str,
+        default=None,
+        help=f"本地权重文件或目录（离线环境使用），也可通过环境变量{WEIGHTS_ENV}设置",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="哈希计算的并行数，默认根据CPU核数自动设置",
     )
 
     args = parser.parse_args()
+    if args.sweep is not None:
+        # 在处理目录之前检查阈值列表，空列表或非法值直接报错
+        try:
+            args.sweep = [float(v) for v in args.sweep.split(",") if v.strip()]
+        except ValueError:
+            parser.error(f"--sweep 的阈值必须是数字：{args.sweep}")
+        if not args.sweep:
+            parser.error("--sweep 至少需要一个阈值")
+        if not all(0 <= value <= 1 for value in args.sweep):
+            parser.error("--sweep 的阈值范围应为0到1")
 
-    # 获取所有图片文件
-    image_extensions = [".jpg", ".jpeg", ".png", ".bmp", ".webp"]
-    image_paths = []
-
-    for root, _, files in os.walk(args.input_dir):
-        for file in files:
-            if any(file.lower().endswith(ext) for ext in image_extensions):
-                image_paths.append(os.path.join(root, file))
-
-    print(f"找到 {len(image_paths)} 张图片")
-
-    if not image_paths:
-        print("没有找到图片，程序退出")
-        return
-
-    # 提取特征
-    print("正在提取图片特征...")
-    features = extract_features(image_paths, batch_size=args.batch_size)
-    print(f"成功提取 {len(features)} 张图片的特征")
-
-    # 找出重复图片
-    print("正在查找重复图片...")
-    duplicate_groups = find_duplicates(features, threshold=args.threshold)
-    print(f"找到 {len(duplicate_groups)} 组重复图片")
-
-    # 保存重复图片信息到CSV
-    # save_duplicates_to_csv(duplicate_groups, args.csv_file)
-
-    # 可视化重复图片
-    if args.visualize and duplicate_groups:
-        visualize_duplicates(duplicate_groups)
-
-    # 移动重复图片
-    if not args.no_move and duplicate_groups:
-        move_duplicates(duplicate_groups, args.output_dir, keep_first=args.keep_first)
-
-    print("图片去重处理完成!")
+    for input_dir in args.input_dir:
+        output_dir = args.output_dir
+        if len(args.input_dir) > 1:
+            output_dir = os.path.join(
+                output_dir, os.path.basename(os.path.normpath(input_dir))
+            )
+        print(f"\n开始处理目录：{input_dir}")
+        dedup_folder(input_dir, output_dir, args)
 
 
 if __name__ == "__main__":
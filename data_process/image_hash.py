@@ -0,0 +1,290 @@
+"""
+图像哈希工具
+功能：
+1. 按文件大小+内容哈希查找字节完全相同的图片（无需解码）
+2. 计算64位感知哈希（dHash / pHash），多进程并行
+3. 基于BK树按汉明距离快速查找近似重复图像
+"""
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+try:
+    import xxhash  # 可选依赖，速度更快；未安装时使用标准库BLAKE2
+except ImportError:
+    xxhash = None
+
+HASH_SIZE = 8  # 哈希边长，8x8=64位
+PHASH_IMG_SIZE = 32  # pHash做DCT前的缩放尺寸
+READ_CHUNK_SIZE = 1 << 20  # 内容哈希的流式读取块大小（1MB）
+
+
+def file_digest(file_path: str) -> str:
+    """流式计算文件内容哈希（优先xxh3_128，否则BLAKE2b）"""
+    hasher = xxhash.xxh3_128() if xxhash else hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def find_exact_duplicates(
+    image_paths: List[str], num_workers: Optional[int] = None
+) -> Tuple[List[Set[str]], List[str]]:
+    """
+    查找字节完全相同的图片
+    先按文件大小分组，只有大小相同的文件才读取内容计算哈希（多线程并行读取）
+    返回：(完全重复的图片组列表, 去重后的图片路径列表)
+    去重后的列表保留每组中按输入顺序出现的第一张，顺序与输入一致
+    """
+    size_groups: Dict[int, List[str]] = {}
+    for path in image_paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"无法读取文件大小 {path}: {e}")
+            continue
+        size_groups.setdefault(size, []).append(path)
+
+    # 大小唯一的文件不可能有完全相同的副本，无需读取内容
+    to_hash = [
+        (size, path)
+        for size, paths in size_groups.items()
+        if len(paths) > 1
+        for path in paths
+    ]
+
+    def digest_or_none(path):
+        try:
+            return file_digest(path)
+        except OSError as e:
+            print(f"无法读取文件 {path}: {e}")
+            return None
+
+    num_workers = num_workers or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        digests = executor.map(digest_or_none, [path for _, path in to_hash])
+
+    content_groups: Dict[Tuple[int, str], List[str]] = {}
+    for (size, path), digest in zip(to_hash, digests):
+        if digest is not None:
+            content_groups.setdefault((size, digest), []).append(path)
+
+    duplicates = set()
+    exact_groups = []
+    for paths in content_groups.values():
+        if len(paths) > 1:
+            exact_groups.append(set(paths))
+            duplicates.update(paths[1:])
+
+    unique_paths = [path for path in image_paths if path not in duplicates]
+    return exact_groups, unique_paths
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """生成n阶DCT-II变换矩阵（正交归一化）"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    mat = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    mat[0, :] = np.sqrt(1.0 / n)
+    return mat
+
+
+_DCT = _dct_matrix(PHASH_IMG_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    """将布尔数组按行优先顺序打包为整数"""
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _load_gray(image_path: str, size: Tuple[int, int]) -> np.ndarray:
+    """以灰度读取并缩放图像，JPEG使用draft模式在解码阶段直接降采样"""
+    with Image.open(image_path) as img:
+        img.draft("L", (size[0] * 4, size[1] * 4))
+        img = img.convert("L").resize(size, Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32)
+
+
+def dhash(image_path: str) -> int:
+    """差值哈希：比较相邻像素亮度"""
+    pixels = _load_gray(image_path, (HASH_SIZE + 1, HASH_SIZE))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image_path: str) -> int:
+    """感知哈希：对32x32灰度图做DCT，取低频8x8与中值比较"""
+    pixels = _load_gray(image_path, (PHASH_IMG_SIZE, PHASH_IMG_SIZE))
+    dct = _DCT @ pixels @ _DCT.T
+    low_freq = dct[:HASH_SIZE, :HASH_SIZE]
+    return _bits_to_int(low_freq > np.median(low_freq))
+
+
+HASH_FUNCS = {"dhash": dhash, "phash": phash}
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """计算两个哈希值的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+def _hash_one(args: Tuple[str, str]) -> Tuple[str, Optional[int]]:
+    """子进程中计算单张图片的哈希，失败返回None"""
+    image_path, method = args
+    try:
+        return image_path, HASH_FUNCS[method](image_path)
+    except Exception as e:
+        print(f"无法计算哈希 {image_path}: {e}")
+        return image_path, None
+
+
+def compute_hashes(
+    image_paths: List[str],
+    method: str = "phash",
+    num_workers: Optional[int] = None,
+    chunksize: int = 64,
+) -> Dict[str, int]:
+    """并行计算所有图像的感知哈希，返回{路径: 哈希值}"""
+    if method not in HASH_FUNCS:
+        raise ValueError(f"不支持的哈希算法：{method}（可选：{list(HASH_FUNCS)}）")
+
+    num_workers = num_workers or os.cpu_count() or 1
+    tasks = [(path, method) for path in image_paths]
+    hashes = {}
+    if num_workers <= 1:
+        results = map(_hash_one, tasks)
+        for path, value in results:
+            if value is not None:
+                hashes[path] = value
+        return hashes
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for path, value in executor.map(_hash_one, tasks, chunksize=chunksize):
+            if value is not None:
+                hashes[path] = value
+    return hashes
+
+
+class BKTree:
+    """按汉明距离组织的BK树，支持半径查询"""
+
+    def __init__(self):
+        self.root = None  # 节点结构：[哈希值, {距离: 子节点}]
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = [value, {}]
+            return
+
+        node = self.root
+        while True:
+            dist = hamming_distance(value, node[0])
+            if dist == 0:
+                return
+            child = node[1].get(dist)
+            if child is None:
+                node[1][dist] = [value, {}]
+                return
+            node = child
+
+    def query(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """返回与value汉明距离不超过radius的所有(哈希值, 距离)"""
+        if self.root is None:
+            return []
+
+        results = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            dist = hamming_distance(value, node[0])
+            if dist <= radius:
+                results.append((node[0], dist))
+            # 三角不等式剪枝：只需访问距离在[dist-radius, dist+radius]内的子树
+            for child_dist, child in node[1].items():
+                if dist - radius <= child_dist <= dist + radius:
+                    stack.append(child)
+        return results
+
+
+def find_hash_matches(
+    hashes: Dict[str, int], radius: int
+) -> List[Tuple[str, str, int]]:
+    """查找汉明距离不超过radius的所有图像对，返回[(路径a, 路径b, 距离)]"""
+    # 相同哈希值的图片先归并，BK树中只保留唯一哈希
+    buckets: Dict[int, List[str]] = {}
+    for path, value in hashes.items():
+        buckets.setdefault(value, []).append(path)
+
+    tree = BKTree()
+    for value in buckets:
+        tree.add(value)
+
+    pairs = []
+    for value, paths in buckets.items():
+        for i in range(len(paths)):
+            for j in range(i + 1, len(paths)):
+                pairs.append((paths[i], paths[j], 0))
+
+        for other, dist in tree.query(value, radius):
+            # 每对不同哈希只记录一次
+            if other <= value:
+                continue
+            for a in paths:
+                for b in buckets[other]:
+                    pairs.append((a, b, dist))
+    return pairs
+
+
+def hash_prefilter(
+    image_paths: List[str],
+    method: str = "phash",
+    strict_distance: int = 4,
+    loose_distance: int = 12,
+    num_workers: Optional[int] = None,
+) -> Tuple[List[Set[str]], List[str]]:
+    """
+    感知哈希预筛选
+    - 汉明距离 <= strict_distance 的图片对直接判定为重复
+    - strict_distance < 距离 <= loose_distance 的图片为疑似重复，交给CNN复核
+    返回：(确定的重复组列表, 需要CNN复核的图片路径列表)
+    无法计算哈希的图片也会放入复核列表
+    """
+    hashes = compute_hashes(image_paths, method=method, num_workers=num_workers)
+    pairs = find_hash_matches(hashes, loose_distance)
+
+    # 并查集合并确定重复的图片对
+    parent = {}
+
+    def find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    ambiguous = set()
+    for a, b, dist in pairs:
+        if dist <= strict_distance:
+            parent[find(a)] = find(b)
+        else:
+            ambiguous.update((a, b))
+
+    components: Dict[str, Set[str]] = {}
+    for path in parent:
+        components.setdefault(find(path), set()).add(path)
+    confirmed_groups = [group for group in components.values() if len(group) > 1]
+
+    failed = [path for path in image_paths if path not in hashes]
+    candidates = [path for path in image_paths if path in ambiguous] + failed
+    return confirmed_groups, candidates
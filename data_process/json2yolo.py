@@ -1,59 +1,223 @@
-import chardet
-
-
-def detect_encoding(file_path):
-    with open(file_path, "rb") as f:
-        raw_data = f.read(10000)  # 读取前10000字节用于检测
-    result = chardet.detect(raw_data)
-    return result["encoding"]
-
-
-file_path = r"C:\Users\Jason Guo\Desktop\pest_text\duplicates\03_mianlingchong\cuts\PD16-MW-00300225.json"  # 替换成实际的文件路径
-encoding = detect_encoding(file_path)
-print(f"检测到的编码: {encoding}")
-
+"""
+LabelMe JSON标注批量转YOLO格式
+功能：
+1. 递归遍历整个目录树的JSON标注，多进程并行转换，输出目录保持相同的子目录结构
+2. 标签名（英文名、中文名、拼音或别名）按config/class_table.json映射为类别编号
+3. 矩形、多边形、折线等多点标注取外接矩形，圆形取外切正方形，结果裁剪到图片范围内
+4. 优先按UTF-8读取，解码失败时才用chardet检测编码
+"""
+
+import argparse
 import json
-
-
-def json_to_yolo(json_path, output_path):
-    # 读取JSON文件
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
+import multiprocessing
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from class_table import ClassTable
+
+# chardet置信度过低时（JSON中非ASCII字符很少）按中文Windows默认编码读取
+FALLBACK_ENCODING = "gb18030"
+MIN_CONFIDENCE = 0.5
+
+_table: Optional[ClassTable] = None
+
+
+def read_json(json_path: str) -> dict:
+    """读取JSON：先按UTF-8解码，失败时再检测编码"""
+    with open(json_path, "rb") as f:
+        raw_data = f.read()
+    try:
+        text = raw_data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        import chardet
+
+        result = chardet.detect(raw_data[:10000])
+        encoding = result["encoding"]
+        if not encoding or (result["confidence"] or 0) < MIN_CONFIDENCE:
+            encoding = FALLBACK_ENCODING
+        text = raw_data.decode(encoding)
+    return json.loads(text)
+
+
+def shape_to_box(
+    shape: dict, image_width: float, image_height: float
+) -> Optional[Tuple[float, float, float, float]]:
+    """将一个标注形状转换为YOLO格式的(cx, cy, w, h)，无效形状返回None"""
+    points = shape.get("points") or []
+    if not points:
+        return None
+    if shape.get("shape_type") == "circle" and len(points) >= 2:
+        # 圆形：第一个点为圆心，第二个点在圆周上
+        (x0, y0), (px, py) = points[:2]
+        r = ((px - x0) ** 2 + (py - y0) ** 2) ** 0.5
+        xs, ys = (x0 - r, x0 + r), (y0 - r, y0 + r)
+    else:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+    x1 = min(max(min(xs), 0.0), image_width)
+    x2 = min(max(max(xs), 0.0), image_width)
+    y1 = min(max(min(ys), 0.0), image_height)
+    y2 = min(max(max(ys), 0.0), image_height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (
+        (x1 + x2) / (2 * image_width),
+        (y1 + y2) / (2 * image_height),
+        (x2 - x1) / image_width,
+        (y2 - y1) / image_height,
+    )
+
+
+def json_to_yolo(
+    json_path: str, output_path: str, table: ClassTable
+) -> Tuple[int, Counter]:
+    """
+    转换单个JSON文件，返回(写入的检测框数量, 未知标签或无效形状计数)
+    """
+    data = read_json(json_path)
     # 获取图像的宽度和高度
     image_width = data["imageWidth"]
     image_height = data["imageHeight"]
 
-    # 打开输出文件
-    with open(output_path, "w") as f:
-        # 遍历所有的标注形状
-        for shape in data["shapes"]:
-            # 获取类别标签
-            label = shape["label"]
-            # 获取标注的点
-            points = shape["points"]
-            # 计算矩形的左上角和右下角坐标
-            x1, y1 = points[0]
-            x2, y2 = points[1]
-
-            # 计算YOLO格式的中心点坐标和宽度、高度
-            x_center = (x1 + x2) / (2 * image_width)
-            y_center = (y1 + y2) / (2 * image_height)
-            width = (x2 - x1) / image_width
-            height = (y2 - y1) / image_height
-
-            # 将标签和坐标信息写入输出文件
-            f.write(f"{label} {x_center} {y_center} {width} {height}\n")
-
-
-import os
-
-
-json_path = r"C:\Users\35088\Desktop\25.7.24\pest_text\duplicates\02_nianchong\cut"
-
-for filename in os.listdir(json_path):
-    # 示例用法
-    if filename.endswith("json"):
-        input_path = os.path.join(json_path, filename)
-        output_path = os.path.join(json_path, filename.split(".")[0] + ".txt")
-        json_to_yolo(input_path, output_path)
+    lines: List[str] = []
+    skipped: Counter = Counter()
+    for shape in data.get("shapes", []):
+        label = str(shape.get("label", ""))
+        class_id = table.id_of(label)
+        if class_id is None:
+            skipped[f"未知标签:{label}"] += 1
+            continue
+        box = shape_to_box(shape, image_width, image_height)
+        if box is None:
+            skipped[f"无效形状:{shape.get('shape_type', 'unknown')}"] += 1
+            continue
+        cx, cy, w, h = box
+        lines.append(f"{class_id} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n")
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    return len(lines), skipped
+
+
+def find_json_files(input_dir: str, output_dir: Optional[str]) -> List[Tuple[str, str]]:
+    """递归查找JSON文件，返回[(JSON路径, 输出txt路径)]；output_dir为空时输出到JSON同目录"""
+    tasks = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        target_dir = root
+        if output_dir:
+            target_dir = os.path.join(output_dir, os.path.relpath(root, input_dir))
+        for filename in sorted(files):
+            if filename.lower().endswith(".json") and not filename.startswith("."):
+                stem = os.path.splitext(filename)[0]
+                tasks.append(
+                    (
+                        os.path.join(root, filename),
+                        os.path.join(target_dir, stem + ".txt"),
+                    )
+                )
+    return tasks
+
+
+def _init_worker(table_file: Optional[str]):
+    # 类别表每个进程只读取一次，不随任务重复传递
+    global _table
+    _table = ClassTable.load(table_file)
+
+
+def _convert_task(task: Tuple[str, str]) -> Tuple[str, int, Counter, Optional[str]]:
+    """子进程中转换一个文件，返回(JSON路径, 检测框数量, 跳过计数, 错误信息)"""
+    json_path, output_path = task
+    try:
+        num_boxes, skipped = json_to_yolo(json_path, output_path, _table)
+        return json_path, num_boxes, skipped, None
+    except Exception as e:
+        return json_path, 0, Counter(), str(e)
+
+
+def batch_convert(
+    input_dir: str,
+    output_dir: Optional[str] = None,
+    table_file: Optional[str] = None,
+    num_workers: Optional[int] = None,
+    chunksize: int = 64,
+    verbose: bool = False,
+) -> List[tuple]:
+    """批量转换input_dir下的全部JSON标注，返回每个文件的转换结果"""
+    start = time.perf_counter()
+    tasks = find_json_files(input_dir, output_dir)
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers <= 1 or len(tasks) < 2 * chunksize:
+        # 文件较少时进程启动开销大于收益，直接串行
+        _init_worker(table_file)
+        results = list(map(_convert_task, tasks))
+    else:
+        # spawn启动的子进程不继承父进程的状态，各平台行为一致
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(table_file,),
+        ) as executor:
+            results = list(executor.map(_convert_task, tasks, chunksize=chunksize))
+
+    skipped_total: Counter = Counter()
+    failures = 0
+    for json_path, num_boxes, skipped, error in results:
+        skipped_total.update(skipped)
+        if error:
+            failures += 1
+            print(f"转换 {json_path} 失败: {error}")
+        elif verbose:
+            print(f"{json_path}: {num_boxes} 个检测框")
+    elapsed = time.perf_counter() - start
+    num_boxes = sum(r[1] for r in results)
+    print(
+        f"转换完成：{len(results) - failures}/{len(results)} 个文件，{num_boxes} 个检测框，"
+        f"耗时 {elapsed:.1f}s（{len(results) / max(elapsed, 1e-9):.1f} 个/s）"
+    )
+    for reason, count in skipped_total.most_common():
+        print(f"- 跳过 {reason}：{count}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LabelMe JSON标注批量转YOLO格式")
+    parser.add_argument(
+        "--input_dir", type=str, required=True, help="JSON标注根目录（含子目录）"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default=None,
+        help="YOLO标注输出根目录，默认与JSON同目录",
+    )
+    parser.add_argument(
+        "--class_table",
+        type=str,
+        default=None,
+        help="类别表，默认config/class_table.json",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=None, help="进程数，默认CPU核数"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=64, help="每次分发给子进程的文件数"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="逐个输出每个文件的检测框数量"
+    )
+    args = parser.parse_args()
+
+    batch_convert(
+        args.input_dir,
+        args.output_dir,
+        table_file=args.class_table,
+        num_workers=args.num_workers,
+        chunksize=args.chunksize,
+        verbose=args.verbose,
+    )
@@ -0,0 +1,347 @@
+"""
+YOLO标注列式存储
+功能：
+1. 一次扫描数据集目录下的全部YOLO标注文件，多线程读取解析，
+   所有检测框存入一个NumPy结构化数组（文件编号、行号、类别、cx、cy、w、h），按文件连续存放
+2. 解析结果缓存为npz文件，按每个文件的修改时间和大小判断是否失效，只重新解析变化的文件；
+   缓存默认放在用户缓存目录（可用环境变量LABEL_CACHE_DIR指定），不写入数据集目录
+3. 记录格式错误的行（字段数少于5、无法转换为数字、类别不是整数），供调用方统一报告；
+   多于5列时（如附带置信度）只取前5列
+4. tobbox.py、make_splits.py、1_imagebbox_analysis.py、api/stage1.py通过本模块读取标注，
+   不再各自逐行解析文本
+"""
+
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import filename_codec
+
+# 每个检测框一行：所属文件编号、在标注文件中的行号（从1开始）、类别及归一化坐标
+BOX_DTYPE = np.dtype(
+    [
+        ("file", np.int32),
+        ("line", np.int32),
+        ("cls", np.int32),
+        ("cx", np.float64),
+        ("cy", np.float64),
+        ("w", np.float64),
+        ("h", np.float64),
+    ]
+)
+# 格式错误的行：所属文件编号、行号、原因
+ERROR_DTYPE = np.dtype([("file", np.int32), ("line", np.int32), ("reason", "U32")])
+
+CACHE_DIR_ENV = "LABEL_CACHE_DIR"
+CACHE_VERSION = 2
+
+
+def default_cache_file(label_dir: str) -> str:
+    """默认缓存路径：用户缓存目录下按标注目录绝对路径的哈希命名，同名目录互不覆盖"""
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    if not cache_dir:
+        base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+        base = base or os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(base, "pest_labels")
+    abs_dir = os.path.abspath(label_dir)
+    digest = hashlib.sha1(abs_dir.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(abs_dir)}_{digest}.npz")
+
+
+def is_label_file(name: str) -> bool:
+    """YOLO标注文件：.txt且不是描述文件（_caption.txt/_caption_en.txt）"""
+    if not name.endswith(".txt"):
+        return False
+    record = filename_codec.try_parse(name)
+    return record is None or record.kind == "annotation"
+
+
+def parse_label_text(text: str) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+    """
+    解析一个标注文件的内容
+    返回：(检测框数组[(行号, 类别, cx, cy, w, h)]，float64，形状(n, 6)；[(行号, 错误原因)])
+    """
+    rows = []
+    line_numbers = []
+    errors = []
+    for line_number, line in enumerate(text.splitlines(), 1):
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) < 5:
+            errors.append((line_number, f"字段数为{len(parts)}"))
+            continue
+        # 多出的列（如预测结果附带的置信度）忽略
+        rows.append(parts[:5])
+        line_numbers.append(line_number)
+
+    if not rows:
+        return np.empty((0, 6)), errors
+    try:
+        # 字段数都正确时一次转换整个文件
+        values = np.array(rows, dtype=np.float64)
+        valid = np.ones(len(rows), dtype=bool)
+    except ValueError:
+        values = np.zeros((len(rows), 5))
+        valid = np.zeros(len(rows), dtype=bool)
+        for i, parts in enumerate(rows):
+            try:
+                values[i] = [float(p) for p in parts]
+                valid[i] = True
+            except ValueError:
+                errors.append((line_numbers[i], "无法转换为数字"))
+
+    non_integer = valid & (values[:, 0] != np.round(values[:, 0]))
+    for i in np.flatnonzero(non_integer):
+        errors.append((line_numbers[i], "类别不是整数"))
+    valid &= ~non_integer
+
+    errors.sort()
+    result = np.column_stack([np.array(line_numbers, dtype=np.float64), values])
+    return result[valid], errors
+
+
+def parse_label_file(txt_path: str) -> Tuple[np.ndarray, List[Tuple[int, str]]]:
+    """读取并解析单个标注文件，见parse_label_text"""
+    with open(txt_path, "r", encoding="utf-8") as f:
+        return parse_label_text(f.read())
+
+
+def to_records(rows: np.ndarray, file_id: int = 0) -> np.ndarray:
+    """parse_label_text的结果转为BOX_DTYPE结构化数组"""
+    boxes = np.zeros(len(rows), dtype=BOX_DTYPE)
+    boxes["file"] = file_id
+    boxes["line"] = rows[:, 0]
+    boxes["cls"] = rows[:, 1]
+    for i, field in enumerate(("cx", "cy", "w", "h"), 2):
+        boxes[field] = rows[:, i]
+    return boxes
+
+
+def scan_label_files(label_dir: str) -> Dict[str, Tuple[int, int]]:
+    """递归扫描标注文件，返回{相对路径: (修改时间ns, 大小)}，按路径排序"""
+    found = {}
+    stack = [label_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    stack.append(entry.path)
+                elif entry.is_file() and is_label_file(entry.name):
+                    stat = entry.stat()
+                    rel_path = os.path.relpath(entry.path, label_dir)
+                    found[rel_path.replace(os.sep, "/")] = (
+                        stat.st_mtime_ns,
+                        stat.st_size,
+                    )
+    return dict(sorted(found.items()))
+
+
+class LabelStore:
+    """数据集全部YOLO标注的列式存储（只读）"""
+
+    def __init__(
+        self,
+        label_dir: str,
+        files: List[str],
+        stats: np.ndarray,
+        boxes: np.ndarray,
+        errors: np.ndarray,
+    ):
+        self.label_dir = os.path.abspath(label_dir)
+        self.files = files  # 相对label_dir的路径，分隔符为/
+        self.stats = stats  # (文件数, 2)：修改时间ns、大小
+        self.boxes = boxes  # BOX_DTYPE，按文件编号、行号排序
+        self.errors = errors  # ERROR_DTYPE
+        self.file_id = {path: i for i, path in enumerate(files)}
+        # 第i个文件的检测框为boxes[offsets[i]:offsets[i + 1]]
+        self.counts = np.bincount(boxes["file"], minlength=len(files))
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    @classmethod
+    def load(
+        cls,
+        label_dir: str,
+        cache_file: Optional[str] = None,
+        num_workers: int = 16,
+        use_cache: bool = True,
+    ) -> "LabelStore":
+        """
+        加载label_dir下（含子目录）的全部标注
+        cache_file默认见default_cache_file；修改时间或大小未变的文件直接使用缓存
+        """
+        start = time.perf_counter()
+        cache_file = cache_file or default_cache_file(label_dir)
+        scanned = scan_label_files(label_dir)
+        cached = cls._read_cache(label_dir, cache_file) if use_cache else None
+
+        files = list(scanned)
+        file_id = {path: i for i, path in enumerate(files)}
+        # 缓存中修改时间和大小都未变化的文件：旧编号 -> 新编号（-1表示需要重新解析）
+        remap = np.full(len(cached.files) if cached is not None else 0, -1)
+        if cached is not None:
+            for old_id, path in enumerate(cached.files):
+                new_id = file_id.get(path)
+                if new_id is not None and scanned[path] == tuple(cached.stats[old_id]):
+                    remap[old_id] = new_id
+        reused = set(remap[remap >= 0].tolist())
+        to_parse = [path for i, path in enumerate(files) if i not in reused]
+
+        def parse(path):
+            try:
+                return parse_label_file(os.path.join(label_dir, path))
+            except (OSError, UnicodeDecodeError) as e:
+                return np.empty((0, 6)), [(0, f"无法读取：{type(e).__name__}")]
+
+        # 标注文件很小但数量多，多线程读取以掩盖IO延迟
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            parsed = list(executor.map(parse, to_parse))
+
+        box_parts = [np.zeros(0, dtype=BOX_DTYPE)]
+        error_parts = [np.zeros(0, dtype=ERROR_DTYPE)]
+        if cached is not None:
+            # 复用的检测框整体按编号映射，不逐个文件切片
+            for part, old in ((box_parts, cached.boxes), (error_parts, cached.errors)):
+                kept = old[remap[old["file"]] >= 0]
+                kept["file"] = remap[kept["file"]]
+                part.append(kept)
+        for path, (rows, error_list) in zip(to_parse, parsed):
+            box_parts.append(to_records(rows, file_id[path]))
+            error_parts.append(
+                np.array(
+                    [(file_id[path], line, reason) for line, reason in error_list],
+                    dtype=ERROR_DTYPE,
+                )
+            )
+        boxes = np.concatenate(box_parts)
+        errors = np.concatenate(error_parts)
+
+        store = cls(
+            label_dir,
+            files,
+            np.array([scanned[path] for path in files], dtype=np.int64).reshape(-1, 2),
+            boxes[np.argsort(boxes["file"], kind="stable")],
+            errors[np.argsort(errors["file"], kind="stable")],
+        )
+        if use_cache and (
+            to_parse or cached is None or len(reused) != len(cached.files)
+        ):
+            try:
+                store.save(cache_file)
+            except OSError as e:
+                # 缓存只用于加速，写入失败不影响本次结果
+                print(f"标注缓存无法写入 {cache_file}：{e}")
+        print(
+            f"标注已加载：{len(files)} 个文件（重新解析 {len(to_parse)} 个），"
+            f"{len(store.boxes)} 个检测框，{len(store.errors)} 行格式错误，"
+            f"耗时 {time.perf_counter() - start:.2f}s"
+        )
+        return store
+
+    @classmethod
+    def _read_cache(cls, label_dir: str, cache_file: str) -> Optional["LabelStore"]:
+        if not os.path.exists(cache_file):
+            return None
+        try:
+            with np.load(cache_file) as data:
+                if int(data["version"]) != CACHE_VERSION:
+                    return None
+                return cls(
+                    label_dir,
+                    data["files"].tolist(),
+                    data["stats"],
+                    data["boxes"],
+                    data["errors"],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"标注缓存无法读取，将重新解析：{e}")
+            return None
+
+    def save(self, cache_file: str):
+        """写入缓存（先写临时文件再替换）"""
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp_path = cache_file + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.array(CACHE_VERSION),
+            files=np.array(self.files, dtype=str),
+            stats=self.stats,
+            boxes=self.boxes,
+            errors=self.errors,
+        )
+        os.replace(tmp_path, cache_file)
+
+    def _key(self, txt_path: str) -> str:
+        """标注文件路径（绝对路径或相对当前目录）-> 存储中相对label_dir的路径"""
+        rel_path = os.path.relpath(os.path.abspath(txt_path), self.label_dir)
+        return rel_path.replace(os.sep, "/")
+
+    def __contains__(self, txt_path: str) -> bool:
+        return self._key(txt_path) in self.file_id
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def get(self, txt_path: str) -> Optional[np.ndarray]:
+        """某个标注文件的检测框（BOX_DTYPE），文件不存在时返回None"""
+        file_id = self.file_id.get(self._key(txt_path))
+        if file_id is None:
+            return None
+        return self.boxes[self.offsets[file_id] : self.offsets[file_id + 1]]
+
+    def errors_of(self, txt_path: str) -> np.ndarray:
+        """某个标注文件中格式错误的行"""
+        file_id = self.file_id.get(self._key(txt_path))
+        if file_id is None:
+            return np.zeros(0, dtype=ERROR_DTYPE)
+        return self.errors[self.errors["file"] == file_id]
+
+    def box_counts(self) -> Dict[str, int]:
+        """{相对路径: 检测框数量}"""
+        return dict(zip(self.files, self.counts.tolist()))
+
+    def file_column(self) -> np.ndarray:
+        """与boxes逐行对应的标注文件相对路径"""
+        return np.array(self.files, dtype=object)[self.boxes["file"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="YOLO标注列式存储（建立/更新缓存并汇总）"
+    )
+    parser.add_argument(
+        "--label_dir", type=str, required=True, help="标注文件目录（含子目录）"
+    )
+    parser.add_argument(
+        "--cache_file", type=str, default=None, help="缓存文件路径，默认在用户缓存目录"
+    )
+    parser.add_argument("--num_workers", type=int, default=16, help="读取线程数")
+    parser.add_argument("--errors_csv", type=str, default=None, help="保存格式错误的行")
+    args = parser.parse_args()
+
+    store = LabelStore.load(args.label_dir, args.cache_file, args.num_workers)
+    classes, counts = np.unique(store.boxes["cls"], return_counts=True)
+    for cls_id, count in zip(classes, counts):
+        print(f"- 类别 {cls_id}：{count} 个检测框")
+    print(f"无检测框的标注文件：{int((store.counts == 0).sum())} 个")
+
+    if args.errors_csv:
+        import pandas as pd
+
+        pd.DataFrame(
+            {
+                "file": [store.files[i] for i in store.errors["file"]],
+                "line": store.errors["line"],
+                "reason": store.errors["reason"],
+            }
+        ).to_csv(args.errors_csv, index=False, encoding="utf-8-sig")
+        print(f"格式错误的行已保存到 {args.errors_csv}")
+
+
+if __name__ == "__main__":
+    main()
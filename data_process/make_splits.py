@@ -0,0 +1,325 @@
+"""
+考虑重复图像的训练/验证/测试集划分工具
+功能：
+1. 扫描merge目录（每个类别一个文件夹，图片与YOLO标注同名），统计每张图片的检测框数量
+2. 以image_deduplication.py输出的重复组CSV和/或特征索引聚类得到的近似重复簇为最小划分单元，
+   同一单元的图片只会进入同一个子集
+3. 按（类别, 检测框数量档位）分层，按比例贪心分配，输出train/val/test图片列表
+4. 生成泄漏报告：跨子集的重复组，以及（提供特征索引时）验证/测试集与训练集间的高相似度图片对
+"""
+
+import argparse
+import os
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from label_store import LabelStore
+
+SPLITS = ("train", "val", "test")
+# 检测框数量档位：1个 / 2-3个 / 4个及以上（0个为无标注）
+BOX_BUCKETS = ((0, "0"), (1, "1"), (2, "2-3"), (4, "4+"))
+
+
+def box_bucket(box_count: int) -> str:
+    """检测框数量所在档位"""
+    label = BOX_BUCKETS[0][1]
+    for lower, name in BOX_BUCKETS:
+        if box_count >= lower:
+            label = name
+    return label
+
+
+def scan_merge_dir(merge_dir: str, num_workers: int = 16) -> pd.DataFrame:
+    """扫描merge目录，返回每张图片的路径、类别文件夹与检测框数量"""
+    records = []
+    for class_entry in sorted(os.scandir(merge_dir), key=lambda e: e.name):
+        if not class_entry.is_dir():
+            continue
+        for entry in os.scandir(class_entry.path):
+            if entry.is_file() and entry.name.lower().endswith(".jpg"):
+                records.append((entry.path, class_entry.name))
+    records.sort()
+
+    # 检测框数量取自标注列式存储（带缓存），标注文件不存在时为0
+    store = LabelStore.load(merge_dir, num_workers=num_workers)
+    box_counts = []
+    for path, _ in records:
+        boxes = store.get(os.path.splitext(path)[0] + ".txt")
+        box_counts.append(0 if boxes is None else len(boxes))
+
+    df = pd.DataFrame(records, columns=["image_path", "class"])
+    df["box_count"] = box_counts
+    df["box_bucket"] = [box_bucket(n) for n in box_counts]
+    return df
+
+
+class UnionFind:
+    """按图片序号合并划分单元"""
+
+    def __init__(self, n: int):
+        self.parent = np.arange(n)
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def load_group_csv(csv_file: str) -> List[List[str]]:
+    """读取重复组CSV（save_duplicates_to_csv格式：group_id, image_path）"""
+    df = pd.read_csv(csv_file, encoding="utf-8-sig")
+    return [list(group["image_path"]) for _, group in df.groupby("group_id")]
+
+
+def embedding_clusters(
+    index_dir: str, image_names: Set[str], threshold: float
+) -> Tuple[List[List[str]], Dict[str, np.ndarray]]:
+    """
+    用corpus_index.py的特征索引对图片聚类（相似度>=threshold的图片对连通即为一簇）
+    只在同一类别编码内计算相似度，计算量约为全量的1/类别数
+    返回：(簇列表, {文件名: 特征})
+    """
+    from corpus_index import CorpusIndex
+    from image_deduplication import compute_similarity_edges, partition_by_class
+
+    index = CorpusIndex.load(index_dir)
+    features = {
+        os.path.basename(path): index.matrix[i]
+        for i, path in enumerate(index.paths)
+        if os.path.basename(path) in image_names
+    }
+    print(f"特征索引中找到 {len(features)}/{len(image_names)} 张图片")
+
+    clusters = []
+    for partition in partition_by_class(features).values():
+        paths, rows, cols, _ = compute_similarity_edges(partition, threshold)
+        clusters.extend([paths[r], paths[c]] for r, c in zip(rows, cols))
+    return clusters, features
+
+
+def build_units(df: pd.DataFrame, groups: List[List[str]]) -> np.ndarray:
+    """合并所有重复组/簇，返回每张图片所属划分单元的编号（按文件名匹配）"""
+    row_of = {name: i for i, name in enumerate(df["file_name"])}
+    uf = UnionFind(len(df))
+    missing = 0
+    for group in groups:
+        rows = [row_of.get(os.path.basename(path)) for path in group]
+        rows = [row for row in rows if row is not None]
+        missing += len(group) - len(rows)
+        for row in rows[1:]:
+            uf.union(rows[0], row)
+    if missing:
+        print(f"重复组中有 {missing} 张图片不在merge目录中，已忽略")
+    return np.array([uf.find(i) for i in range(len(df))])
+
+
+def assign_splits(
+    df: pd.DataFrame, ratios: Tuple[float, float, float], seed: int
+) -> np.ndarray:
+    """
+    分层贪心分配：每个单元按（主要类别, 主要检测框档位）归入一层，
+    层内单元随机打乱后按大小降序，依次放入当前缺口（目标数-已分配数）最大的子集
+    """
+    ratios = np.asarray(ratios, dtype=np.float64) / sum(ratios)
+
+    def majority(column: str) -> pd.Series:
+        counts = df.groupby(["unit", column]).size().reset_index(name="n")
+        counts = counts.sort_values(
+            ["unit", "n"], ascending=[True, False], kind="stable"
+        )
+        return counts.drop_duplicates("unit").set_index("unit")[column]
+
+    unit_info = pd.DataFrame(
+        {
+            "size": df.groupby("unit").size(),
+            "class": majority("class"),
+            "box_bucket": majority("box_bucket"),
+        }
+    )
+
+    rng = random.Random(seed)
+    unit_split = {}
+    for _, stratum in unit_info.groupby(["class", "box_bucket"], sort=True):
+        unit_ids = list(stratum.index)
+        sizes = stratum["size"].to_dict()
+        rng.shuffle(unit_ids)
+        # 大单元先分配，避免最后放入大单元导致比例偏差
+        unit_ids.sort(key=lambda u: -sizes[u])
+        targets = ratios * stratum["size"].sum()
+        assigned = np.zeros(len(SPLITS))
+        for unit_id in unit_ids:
+            split = int(np.argmax(targets - assigned))
+            unit_split[unit_id] = split
+            assigned[split] += sizes[unit_id]
+
+    return np.array([SPLITS[unit_split[u]] for u in df["unit"]])
+
+
+def leakage_report(
+    df: pd.DataFrame,
+    groups: List[List[str]],
+    features: Optional[Dict[str, np.ndarray]],
+    leak_threshold: float,
+) -> pd.DataFrame:
+    """
+    检查划分结果的泄漏：
+    - group：输入的重复组跨越了多个子集（正常情况下应为0）
+    - embedding：验证/测试集与训练集之间相似度>=leak_threshold的图片对
+    """
+    split_of = dict(zip(df["file_name"], df["split"]))
+    rows = []
+    for group in groups:
+        splits = {split_of.get(os.path.basename(p)) for p in group} - {None}
+        if len(splits) > 1:
+            rows.append(
+                {
+                    "type": "group",
+                    "image_a": group[0],
+                    "image_b": ";".join(group[1:]),
+                    "split_a": ",".join(sorted(splits)),
+                    "split_b": "",
+                    "similarity": None,
+                }
+            )
+
+    if features:
+        names = [name for name in features if name in split_of]
+        matrix = np.stack([features[name] for name in names]).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+        split_ids = np.array([SPLITS.index(split_of[name]) for name in names])
+        # 只需比较训练集与验证/测试集
+        train = np.flatnonzero(split_ids == 0)
+        held_out = np.flatnonzero(split_ids != 0)
+        train_matrix = matrix[train]
+        for start in range(0, len(held_out), 1024):
+            block = held_out[start : start + 1024]
+            similarity = matrix[block] @ train_matrix.T
+            hit_r, hit_c = np.nonzero(similarity >= leak_threshold)
+            for r, c in zip(hit_r, hit_c):
+                rows.append(
+                    {
+                        "type": "embedding",
+                        "image_a": names[block[r]],
+                        "image_b": names[train[c]],
+                        "split_a": SPLITS[split_ids[block[r]]],
+                        "split_b": "train",
+                        "similarity": round(float(similarity[r, c]), 4),
+                    }
+                )
+
+    return pd.DataFrame(
+        rows, columns=["type", "image_a", "image_b", "split_a", "split_b", "similarity"]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="考虑重复图像的数据集划分工具")
+    parser.add_argument(
+        "--merge_dir", type=str, required=True, help="merge目录（每个类别一个子文件夹）"
+    )
+    parser.add_argument(
+        "--dup_csv",
+        type=str,
+        nargs="*",
+        default=[],
+        help="image_deduplication.py输出的重复组CSV",
+    )
+    parser.add_argument(
+        "--index_dir",
+        type=str,
+        default=None,
+        help="corpus_index.py的特征索引，用于聚类与泄漏检查",
+    )
+    parser.add_argument(
+        "--cluster_threshold", type=float, default=0.95, help="特征聚类的相似度阈值"
+    )
+    parser.add_argument(
+        "--leak_threshold",
+        type=float,
+        default=None,
+        help="泄漏检查的相似度阈值，默认同聚类阈值",
+    )
+    parser.add_argument(
+        "--ratios",
+        type=float,
+        nargs=3,
+        default=[0.8, 0.1, 0.1],
+        help="train/val/test比例",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output_dir", type=str, default="./splits", help="输出目录")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    df = scan_merge_dir(args.merge_dir)
+    df["file_name"] = [os.path.basename(path) for path in df["image_path"]]
+    print(f"共 {len(df)} 张图片，{df['class'].nunique()} 个类别")
+
+    groups = []
+    for csv_file in args.dup_csv:
+        groups.extend(load_group_csv(csv_file))
+    features = None
+    if args.index_dir:
+        clusters, features = embedding_clusters(
+            args.index_dir, set(df["file_name"]), args.cluster_threshold
+        )
+        groups.extend(clusters)
+
+    df["unit"] = build_units(df, groups)
+    print(
+        f"划分单元 {df['unit'].nunique()} 个（最大单元 {df['unit'].value_counts().max()} 张）"
+    )
+    df["split"] = assign_splits(df, tuple(args.ratios), args.seed)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for split in SPLITS:
+        with open(
+            os.path.join(args.output_dir, f"{split}.txt"), "w", encoding="utf-8"
+        ) as f:
+            f.writelines(
+                path + "\n" for path in df.loc[df["split"] == split, "image_path"]
+            )
+
+    summary = (
+        df.groupby(["class", "box_bucket", "split"])
+        .size()
+        .unstack("split", fill_value=0)
+    )
+    summary = summary.reindex(columns=list(SPLITS), fill_value=0)
+    summary.to_csv(
+        os.path.join(args.output_dir, "split_summary.csv"), encoding="utf-8-sig"
+    )
+    print(summary.to_string())
+
+    leak_threshold = args.leak_threshold or args.cluster_threshold
+    report = leakage_report(df, groups, features, leak_threshold)
+    report.to_csv(
+        os.path.join(args.output_dir, "leakage_report.csv"),
+        index=False,
+        encoding="utf-8-sig",
+    )
+
+    counts = Counter(df["split"])
+    print(
+        f"划分完成，耗时 {time.perf_counter() - start:.1f}s："
+        + "，".join(f"{split} {counts.get(split, 0)} 张" for split in SPLITS)
+    )
+    print(
+        f"泄漏报告：{len(report)} 条（阈值 {leak_threshold}），已保存到 {args.output_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,25 @@ YOLO标注文件+图片+描述文件批量处理工具
 1. 按规则修改YOLO标注文件类别编号
 2. 同步修改标注文件、图片文件、描述文件的文件名（更新类别编码）
 3. 修改描述文件（JSON格式）内部的Image filename字段
-4. 自动复制处理后的文件到输出目录（不覆盖原文件）
+4. 自动复制处理后的文件到输出目录（不覆盖原文件），或使用--in_place原地重命名
+5. 先用os.scandir一次性扫描四个目录生成清单（按类别编码+序号归并），
+   处理前集中报告孤立文件和缺失文件，再按清单执行
+6. 原地模式：两阶段重命名（临时名 -> 最终名）避免类别映射中的循环互相覆盖，
+   先写入日志再操作，中断后可用--resume继续或--rollback回滚
+7. 使用--config读取全部类别的映射与文件夹重命名表，一次扫描、所有类别并行处理
 """
 
 # 导入必要模块
 import os
 import shutil
-import re
 import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+import filename_codec
+from filename_codec import SUFFIXES
 
 # ===================== 配置参数（请根据实际情况修改）=====================
 # 原文件路径
@@ -30,28 +41,52 @@ CAPTION_EN_OUTPUT_DIR = r"D:\25.10.29backup\25.7.24\pest_text\api\data_processed
 # 类别映射规则（key=原类别，value=新类别）
 CLASS_MAPPING = {1: 3, 2: 0, 3: 2, 4: 1, 5: 4, 6: 5, 7: 6, 8: 7}
 
-# 文件名配置（根据你的文件名格式调整）
-FILE_PREFIX = "PD16-MW-"  # 文件名前缀
-NUM_DIGITS_TOTAL = 8  # 文件名中数字部分总位数
-CLASS_CODE_DIGITS = 3  # 数字部分中类别编码的位数（前N位）
-# 文件后缀配置
-IMAGE_SUFFIX = ".jpg"  # 图片文件后缀（原文件）
-ANNOTATION_SUFFIX = ".txt"  # 标注文件后缀
-CAPTION_CN_SUFFIX = "_caption.txt"  # 中文描述文件后缀
-CAPTION_EN_SUFFIX = "_caption_en.txt"  # 英文描述文件后缀
+# 文件名前缀、位数与各类文件后缀统一在filename_codec.py中配置
 IMAGE_JSON_SUFFIX = ".jpg"  # JSON中Image filename的后缀（示例中是.jpg）
+
+# 执行配置
+NUM_WORKERS = 16  # 并行处理文件的线程数（文件读写以IO等待为主）
+VERBOSE = False  # 是否逐个输出每个文件的处理结果
+INPLACE_LOG_FILE = "./reindex_inplace_log.jsonl"  # 原地模式的预写日志
+# 以上单类别路径仅在不使用--config时生效，多类别配置示例见config/reindex.json
 # ========================================================================
 
+# 四类文件：文件类型标识 -> (文件名后缀, 说明)
+FILE_KINDS = {
+    "annotation": (SUFFIXES["annotation"], "标注文件"),
+    "image": (SUFFIXES["image"], "图片文件"),
+    "caption_cn": (SUFFIXES["caption_cn"], "中文描述"),
+    "caption_en": (SUFFIXES["caption_en"], "英文描述"),
+}
+
+INPUT_DIRS = {
+    "annotation": ANNOTATIONS_INPUT_DIR,
+    "image": IMAGES_INPUT_DIR,
+    "caption_cn": CAPTION_CN_INPUT_DIR,
+    "caption_en": CAPTION_EN_INPUT_DIR,
+}
+OUTPUT_DIRS = {
+    "annotation": ANNOTATIONS_OUTPUT_DIR,
+    "image": IMAGES_OUTPUT_DIR,
+    "caption_cn": CAPTION_CN_OUTPUT_DIR,
+    "caption_en": CAPTION_EN_OUTPUT_DIR,
+}
+
+# 清单中展示的孤立/缺失文件示例数量
+MAX_REPORT_EXAMPLES = 10
+
+
+# 替换类别映射（--config或--resume时使用）
+def set_class_mapping(class_mapping):
+    """原地更新CLASS_MAPPING，各处理函数随之使用新的映射"""
+    CLASS_MAPPING.clear()
+    CLASS_MAPPING.update({int(k): int(v) for k, v in class_mapping.items()})
+
 
 # 创建输出目录（如果不存在）
-def create_output_dirs():
+def create_output_dirs(output_dirs=None):
     """创建所有输出目录"""
-    dirs = [
-        ANNOTATIONS_OUTPUT_DIR,
-        IMAGES_OUTPUT_DIR,
-        CAPTION_CN_OUTPUT_DIR,
-        CAPTION_EN_OUTPUT_DIR,
-    ]
+    dirs = list((output_dirs or OUTPUT_DIRS).values())
     for dir_path in dirs:
         os.makedirs(dir_path, exist_ok=True)
 
@@ -71,44 +106,9 @@ def parse_base_filename(filename):
     - 英文描述：PD16-MW-XXXXXXXX_caption_en.txt
     输出：(原类别编码int, 序号str, 文件类型标识str)
     文件类型标识：annotation/image/caption_cn/caption_en
+    格式不符时抛出ValueError
     """
-    # 定义所有支持的文件名模式
-    patterns = [
-        # (正则表达式, 文件类型标识)
-        (
-            rf"^{FILE_PREFIX}(\d{{{NUM_DIGITS_TOTAL}}}){ANNOTATION_SUFFIX}$",
-            "annotation",
-        ),
-        (rf"^{FILE_PREFIX}(\d{{{NUM_DIGITS_TOTAL}}}){IMAGE_SUFFIX}$", "image"),
-        (
-            rf"^{FILE_PREFIX}(\d{{{NUM_DIGITS_TOTAL}}}){CAPTION_CN_SUFFIX}$",
-            "caption_cn",
-        ),
-        (
-            rf"^{FILE_PREFIX}(\d{{{NUM_DIGITS_TOTAL}}}){CAPTION_EN_SUFFIX}$",
-            "caption_en",
-        ),
-    ]
-
-    for pattern, file_type in patterns:
-        match = re.match(pattern, filename)
-        if match:
-            num_str = match.group(1)  # 8位数字部分（如00200001）
-            # 提取类别编码（前CLASS_CODE_DIGITS位）和序号（后几位）
-            class_code_str = num_str[:CLASS_CODE_DIGITS]
-            sequence_str = num_str[CLASS_CODE_DIGITS:]
-
-            try:
-                original_class_code = int(class_code_str)
-            except ValueError:
-                raise ValueError(
-                    f"文件名中的类别编码不是数字：{class_code_str}（文件名：{filename}）"
-                )
-
-            return original_class_code, sequence_str, file_type
-
-    # 未匹配到任何支持的格式
-    raise ValueError(f"文件名格式不支持：{filename}")
+    return filename_codec.parse(filename)
 
 
 # 生成新的文件名（根据基础信息和文件类型）
@@ -120,36 +120,22 @@ def generate_new_filename(original_class_code, sequence_str, file_type):
             f"原类别 {original_class_code} 没有对应的映射规则，请检查CLASS_MAPPING配置"
         )
 
-    new_class_code = CLASS_MAPPING[original_class_code]
-    # 生成新的数字部分（类别编码补零到指定位数 + 序号）
-    new_class_code_str = f"{new_class_code:0{CLASS_CODE_DIGITS}d}"
-    new_num_str = new_class_code_str + sequence_str
-
-    # 根据文件类型生成对应文件名
-    if file_type == "annotation":
-        return f"{FILE_PREFIX}{new_num_str}{ANNOTATION_SUFFIX}"
-    elif file_type == "image":
-        return f"{FILE_PREFIX}{new_num_str}{IMAGE_SUFFIX}"
-    elif file_type == "caption_cn":
-        return f"{FILE_PREFIX}{new_num_str}{CAPTION_CN_SUFFIX}"
-    elif file_type == "caption_en":
-        return f"{FILE_PREFIX}{new_num_str}{CAPTION_EN_SUFFIX}"
-    else:
-        raise ValueError(f"不支持的文件类型：{file_type}")
+    # 类别编码补零到指定位数 + 序号 + 对应文件类型的后缀
+    return filename_codec.format_name(
+        CLASS_MAPPING[original_class_code], sequence_str, file_type
+    )
 
 
 # 生成JSON中Image filename的新值
 def generate_new_image_json_filename(original_class_code, sequence_str):
     """生成修改后的Image filename字段值（如PD16-MW-00000001.jpg）"""
     new_class_code = CLASS_MAPPING[original_class_code]
-    new_class_code_str = f"{new_class_code:0{CLASS_CODE_DIGITS}d}"
-    new_num_str = new_class_code_str + sequence_str
-    return f"{FILE_PREFIX}{new_num_str}{IMAGE_JSON_SUFFIX}"
+    return filename_codec.base_name(new_class_code, sequence_str) + IMAGE_JSON_SUFFIX
 
 
 # 处理单个标注文件
-def process_annotation_file(annotation_path, new_annotation_path):
-    """读取原标注文件，修改类别编号，写入新文件"""
+def process_annotation_file(annotation_path, new_annotation_path, log=print):
+    """读取原标注文件，修改类别编号，写入新文件（警告信息交给log输出）"""
     modified_lines = []
     with open(annotation_path, "r", encoding="utf-8") as f:
         lines = f.readlines()
@@ -163,7 +149,7 @@ def process_annotation_file(annotation_path, new_annotation_path):
         # YOLO标注格式：class_id x_center y_center width height
         parts = line.split()
         if len(parts) != 5:
-            print(
+            log(
                 f"警告：标注文件 {os.path.basename(annotation_path)} 第{line_idx}行格式错误，跳过该行：{line}"
             )
             continue
@@ -172,7 +158,7 @@ def process_annotation_file(annotation_path, new_annotation_path):
         try:
             original_class_id = int(parts[0])
         except ValueError:
-            print(
+            log(
                 f"警告：标注文件 {os.path.basename(annotation_path)} 第{line_idx}行类别ID不是数字，跳过该行：{line}"
             )
             continue
@@ -184,7 +170,7 @@ def process_annotation_file(annotation_path, new_annotation_path):
             modified_lines.append(new_line)
         else:
             modified_lines.append(line)
-            print(
+            log(
                 f"警告：标注文件 {os.path.basename(annotation_path)} 第{line_idx}行出现未配置的类别ID {original_class_id}，保留原类别"
             )
 
@@ -197,12 +183,17 @@ def process_annotation_file(annotation_path, new_annotation_path):
 
 # 处理单个描述文件（JSON格式）
 def process_caption_file(
-    caption_path, new_caption_path, original_class_code, sequence_str
+    caption_path,
+    new_caption_path,
+    original_class_code,
+    sequence_str,
+    log=print,
+    verbose=True,
 ):
     """
     处理描述文件：
     1. 读取JSON内容
-    2. 修改Image filename字段
+    2. 修改Image filename字段（verbose时输出修改内容）
     3. 保存到新文件
     """
     try:
@@ -220,9 +211,10 @@ def process_caption_file(
                 original_class_code, sequence_str
             )
             json_data["Image filename"] = new_image_filename
-            print(
-                f"📝 Image filename修改：{original_image_filename} → {new_image_filename}"
-            )
+            if verbose:
+                log(
+                    f"📝 Image filename修改：{original_image_filename} → {new_image_filename}"
+                )
 
         elif "图片的文件名" in json_data:
             original_image_filename = json_data["图片的文件名"]
@@ -230,11 +222,12 @@ def process_caption_file(
                 original_class_code, sequence_str
             )
             json_data["图片的文件名"] = new_image_filename
-            print(
-                f"📝 图片的文件名修改：{original_image_filename} → {new_image_filename}"
-            )
+            if verbose:
+                log(
+                    f"📝 图片的文件名修改：{original_image_filename} → {new_image_filename}"
+                )
         else:
-            print(
+            log(
                 f"警告：描述文件 {os.path.basename(caption_path)} 缺少Image filename字段，跳过该字段修改"
             )
 
@@ -248,176 +241,582 @@ def process_caption_file(
         raise Exception(f"JSON处理失败：{str(e)}")
 
 
-# 处理单个文件对（标注+图片，可选关联描述文件）
-def process_annotation_image_pair(annotation_filename):
-    """处理标注文件和对应的图片文件"""
-    annotation_basename = annotation_filename
-    annotation_path = os.path.join(ANNOTATIONS_INPUT_DIR, annotation_basename)
+# 扫描单个目录（只扫描一次，不逐个探测文件是否存在）
+def scan_directory(dir_path, file_type):
+    """
+    用os.scandir扫描目录，按(原类别编码, 序号)归并该类型的文件
+    返回：({(类别编码, 序号): 文件名}, [无法识别的文件名])
+    """
+    found = {}
+    unrecognized = []
+    if not os.path.isdir(dir_path):
+        print(f"⚠️  目录不存在：{dir_path}")
+        return found, unrecognized
+
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # 隐藏文件（如label_store.py的标注缓存）不属于数据集
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            record = filename_codec.try_parse(entry.name)
+            if record is None or record.kind != file_type:
+                unrecognized.append(entry.name)
+                continue
+            found[record.class_code, record.sequence] = entry.name
+    return found, sorted(unrecognized)
+
+
+# 一次扫描四个目录，生成处理清单
+def build_manifest(input_dirs=None):
+    """
+    返回：(清单, 无法识别的文件)
+    清单：{(原类别编码, 序号): {文件类型: 文件名}}，只包含实际存在的文件
+    无法识别的文件：{文件类型: [文件名]}
+    """
+    manifest = {}
+    unrecognized = {}
+    for file_type, dir_path in (input_dirs or INPUT_DIRS).items():
+        found, unrecognized[file_type] = scan_directory(dir_path, file_type)
+        for key, filename in found.items():
+            manifest.setdefault(key, {})[file_type] = filename
+    return dict(sorted(manifest.items())), unrecognized
+
+
+def _print_examples(title, items):
+    """打印问题汇总和前几个示例"""
+    if not items:
+        return
+    print(f"⚠️  {title}：{len(items)} 个")
+    for item in items[:MAX_REPORT_EXAMPLES]:
+        print(f"   - {item}")
+    if len(items) > MAX_REPORT_EXAMPLES:
+        print(f"   ...（其余 {len(items) - MAX_REPORT_EXAMPLES} 个省略）")
+
+
+# 处理前集中报告清单中的问题
+def report_manifest(manifest, unrecognized, class_mapping=None):
+    """
+    统计各类文件数量，并集中报告：
+    - 孤立文件：有图片/描述但没有标注文件（图片不会被处理）
+    - 缺失文件：有标注文件但缺少图片或描述
+    - 未配置映射的类别编码、无法识别的文件名
+    返回问题总数
+    """
+    class_mapping = class_mapping or CLASS_MAPPING
+    print(f"清单共 {len(manifest)} 个编号：")
+    for file_type, (_, label) in FILE_KINDS.items():
+        count = sum(1 for files in manifest.values() if file_type in files)
+        print(f"- {label}：{count} 个")
+
+    def name(key):
+        return filename_codec.base_name(*key)
+
+    issues = 0
+    orphans = [
+        f"{name(key)}（{'、'.join(FILE_KINDS[t][1] for t in files)}）"
+        for key, files in manifest.items()
+        if "annotation" not in files
+    ]
+    _print_examples("孤立文件（缺少标注文件）", orphans)
+    issues += len(orphans)
+
+    for file_type in ("image", "caption_cn", "caption_en"):
+        missing = [
+            name(key)
+            for key, files in manifest.items()
+            if "annotation" in files and file_type not in files
+        ]
+        _print_examples(f"缺少{FILE_KINDS[file_type][1]}", missing)
+        issues += len(missing)
+
+    unmapped = sorted({key[0] for key in manifest if key[0] not in class_mapping})
+    _print_examples("未配置映射的类别编码（相关文件将跳过）", unmapped)
+    issues += len(unmapped)
+
+    for file_type, names in unrecognized.items():
+        _print_examples(f"{FILE_KINDS[file_type][1]}目录中无法识别的文件名", names)
+        issues += len(names)
+
+    if issues == 0:
+        print("✅ 清单检查通过，四类文件一一对应")
+    return issues
+
+
+# 由清单生成处理计划
+def plan_operations(
+    manifest, input_dirs=None, output_dirs=None, include_orphan_images=False
+):
+    """
+    返回按编号、文件类型排序的操作列表：[(文件类型, 原路径, 新路径, 原类别编码, 序号)]
+    图片默认只在有对应标注文件时处理（与逐个处理标注+图片对的行为一致），
+    原地模式下孤立图片也需改名（include_orphan_images），否则会残留旧类别编码；
+    未配置映射的类别编码已在清单报告中列出，这里跳过
+    """
+    input_dirs = input_dirs or INPUT_DIRS
+    output_dirs = output_dirs or OUTPUT_DIRS
+    operations = []
+    for (class_code, sequence_str), files in manifest.items():
+        if class_code not in CLASS_MAPPING:
+            continue
+        for file_type, filename in files.items():
+            if (
+                file_type == "image"
+                and "annotation" not in files
+                and not include_orphan_images
+            ):
+                continue
+            new_filename = generate_new_filename(class_code, sequence_str, file_type)
+            operations.append(
+                (
+                    file_type,
+                    os.path.join(input_dirs[file_type], filename),
+                    os.path.join(output_dirs[file_type], new_filename),
+                    class_code,
+                    sequence_str,
+                )
+            )
+    return operations
 
-    try:
-        # 解析原文件名
-        original_class_code, sequence_str, _ = parse_base_filename(annotation_basename)
 
-        # 1. 处理标注文件
-        new_annotation_basename = generate_new_filename(
-            original_class_code, sequence_str, "annotation"
-        )
-        new_annotation_path = os.path.join(
-            ANNOTATIONS_OUTPUT_DIR, new_annotation_basename
-        )
-        valid_lines = process_annotation_file(annotation_path, new_annotation_path)
-        print(
-            f"✅ 标注文件：{annotation_basename} → {new_annotation_basename}（有效行：{valid_lines}）"
+# 执行单个操作
+def execute_operation(operation, verbose=False):
+    """
+    根据文件类型修改标注、复制图片或修改描述文件
+    在线程池中运行，不直接打印，返回该操作产生的信息列表，由主线程按计划顺序输出
+    """
+    file_type, src_path, dst_path, class_code, sequence_str = operation
+    messages = []
+    if file_type == "annotation":
+        process_annotation_file(src_path, dst_path, log=messages.append)
+    elif file_type == "image":
+        shutil.copy2(src_path, dst_path)
+    else:
+        process_caption_file(
+            src_path,
+            dst_path,
+            class_code,
+            sequence_str,
+            log=messages.append,
+            verbose=verbose,
         )
+    return messages
 
-        # 2. 处理图片文件
-        image_basename = annotation_filename.replace(ANNOTATION_SUFFIX, IMAGE_SUFFIX)
-        print(image_basename)
-        image_path = os.path.join(IMAGES_INPUT_DIR, image_basename)
-        if os.path.exists(image_path):
-            new_image_basename = generate_new_filename(
-                original_class_code, sequence_str, "image"
-            )
-            new_image_path = os.path.join(IMAGES_OUTPUT_DIR, new_image_basename)
-            shutil.copy2(image_path, new_image_path)
-            print(f"✅ 图片文件：{image_basename} → {new_image_basename}")
-        else:
-            print(f"⚠️  图片文件不存在：{image_path}，跳过")
-
-        return True
 
+def _run_operation(operation, worker, verbose):
+    """执行操作并捕获异常，返回(是否成功, 信息列表)"""
+    try:
+        return True, worker(operation, verbose)
     except Exception as e:
-        print(f"❌ 处理失败 {annotation_basename}：{str(e)}")
-        return False
-
-
-# 批量处理描述文件（中文/英文）
-def process_all_caption_files():
-    """批量处理中文和英文描述文件"""
-    print("\n" + "=" * 50)
-    print("开始处理描述文件...")
-    print("=" * 50)
-
-    # 定义需要处理的描述文件目录和类型
-    caption_configs = [
-        (CAPTION_CN_INPUT_DIR, CAPTION_CN_OUTPUT_DIR, "caption_cn", "中文"),
-        (CAPTION_EN_INPUT_DIR, CAPTION_EN_OUTPUT_DIR, "caption_en", "英文"),
-    ]
-
-    total_success = 0
-    total_fail = 0
-
-    for input_dir, output_dir, file_type, lang_name in caption_configs:
-        print(f"\n【{lang_name}描述文件】")
-        print(f"处理目录：{input_dir}")
-
-        # 筛选符合条件的文件（以对应的caption后缀结尾）
-        suffix = CAPTION_CN_SUFFIX if file_type == "caption_cn" else CAPTION_EN_SUFFIX
-        caption_filenames = [f for f in os.listdir(input_dir) if f.endswith(suffix)]
-
-        if not caption_filenames:
-            print(f"⚠️  未找到符合条件的{lang_name}描述文件（需以{suffix}结尾）")
-            continue
-
-        print(f"找到 {len(caption_filenames)} 个{lang_name}描述文件，开始处理...")
+        return False, [f"❌ 处理失败 {os.path.basename(operation[1])}：{str(e)}"]
 
-        success_count = 0
-        fail_count = 0
 
-        for filename in caption_filenames:
+# 并行执行处理计划
+def run_operations(
+    operations,
+    worker=execute_operation,
+    num_workers=None,
+    verbose=None,
+    desc="处理进度",
+):
+    """
+    用有界线程池执行全部操作（worker(operation, verbose) -> 信息列表），显示单个进度条
+    结果按计划顺序收集，输出与统计与线程调度无关
+    返回：(成功数{文件类型: 数量}, 失败数{文件类型: 数量}, 按计划顺序的信息列表)
+    """
+    num_workers = num_workers or NUM_WORKERS
+    verbose = VERBOSE if verbose is None else verbose
+    success = {file_type: 0 for file_type in FILE_KINDS}
+    fail = {file_type: 0 for file_type in FILE_KINDS}
+    messages = []
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        # executor.map按提交顺序返回结果
+        results = executor.map(
+            lambda op: _run_operation(op, worker, verbose), operations
+        )
+        for operation, (ok, op_messages) in tqdm(
+            zip(operations, results), total=len(operations), desc=desc
+        ):
+            file_type, src_path, dst_path = operation[:3]
+            if ok:
+                success[file_type] += 1
+                if verbose:
+                    op_messages.append(
+                        f"✅ {os.path.basename(src_path)} → {os.path.basename(dst_path)}"
+                    )
+            else:
+                fail[file_type] += 1
+            messages.extend(op_messages)
+    return success, fail, messages
+
+
+# ===================== 原地模式 =====================
+# 原地模式下每个操作涉及的文件：
+# - 原文件 src，最终文件 dst（与src在同一目录）
+# - 临时文件 dst + TMP_SUFFIX：第一阶段写入/改名的目标，第二阶段改名为dst
+# - 备份文件 src + BAK_SUFFIX：标注/描述文件的原内容，提交后删除，回滚时恢复
+# 第一阶段结束后所有原文件都已离开原名，第二阶段改名不会覆盖映射循环中的其他文件
+TMP_SUFFIX = ".reindex_tmp"
+BAK_SUFFIX = ".reindex_bak"
+
+
+def check_inplace_plan(operations):
+    """检查原地计划：目标文件名不能重复，也不能占用计划外已存在的文件"""
+    sources = {operation[1] for operation in operations}
+    targets = {}
+    conflicts = []
+    for operation in operations:
+        dst_path = operation[2]
+        if dst_path in targets:
+            conflicts.append(
+                f"{targets[dst_path]} 与 {operation[1]} 的目标相同：{dst_path}"
+            )
+        targets[dst_path] = operation[1]
+        if os.path.exists(dst_path) and dst_path not in sources:
+            conflicts.append(f"目标文件已存在且不在计划内：{dst_path}")
+    return conflicts
+
+
+def _inplace_phase1(operation, verbose=False):
+    """第一阶段：写出临时文件，原文件改为备份名（图片直接改为临时名）"""
+    file_type, src_path, dst_path, class_code, sequence_str = operation
+    tmp_path = dst_path + TMP_SUFFIX
+    if file_type == "image":
+        if os.path.exists(src_path):
+            os.rename(src_path, tmp_path)
+        elif not os.path.exists(tmp_path):
+            raise FileNotFoundError(f"原文件和临时文件都不存在：{src_path}")
+        return []
+
+    if os.path.exists(src_path + BAK_SUFFIX):
+        return []  # 已完成（中断后继续时跳过）
+    # 临时文件可能是中断时写了一半的，直接覆盖重写
+    messages = execute_operation(
+        (file_type, src_path, tmp_path, class_code, sequence_str), verbose
+    )
+    os.rename(src_path, src_path + BAK_SUFFIX)
+    return messages
+
+
+def _inplace_phase2(operation, verbose=False):
+    """第二阶段：临时文件改为最终文件名"""
+    dst_path = operation[2]
+    tmp_path = dst_path + TMP_SUFFIX
+    if os.path.exists(tmp_path):
+        if os.path.exists(dst_path):
+            raise FileExistsError(f"目标文件已存在：{dst_path}")
+        os.rename(tmp_path, dst_path)
+    elif not os.path.exists(dst_path):
+        raise FileNotFoundError(f"临时文件和目标文件都不存在：{dst_path}")
+    return []
+
+
+def _inplace_commit(operation, verbose=False):
+    """提交：删除备份文件"""
+    bak_path = operation[1] + BAK_SUFFIX
+    if os.path.exists(bak_path):
+        os.remove(bak_path)
+    return []
+
+
+def _inplace_undo_phase2(operation, verbose=False):
+    """回滚第二阶段：最终文件改回临时文件名"""
+    dst_path = operation[2]
+    tmp_path = dst_path + TMP_SUFFIX
+    if not os.path.exists(tmp_path) and os.path.exists(dst_path):
+        os.rename(dst_path, tmp_path)
+    return []
+
+
+def _inplace_undo_phase1(operation, verbose=False):
+    """回滚第一阶段：图片改回原名；标注/描述删除临时文件并恢复备份"""
+    file_type, src_path, dst_path = operation[:3]
+    tmp_path = dst_path + TMP_SUFFIX
+    if file_type == "image":
+        if os.path.exists(tmp_path) and not os.path.exists(src_path):
+            os.rename(tmp_path, src_path)
+        return []
+
+    bak_path = src_path + BAK_SUFFIX
+    if os.path.exists(bak_path):
+        os.replace(bak_path, src_path)
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    return []
+
+
+def _append_log(log_file, record):
+    """追加一条日志并落盘，保证日志先于文件操作写入磁盘"""
+    with open(log_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_inplace_log(log_file):
+    """读取日志，返回(计划操作列表, 已进入的阶段, 计划附带信息)"""
+    operations, phase, meta = None, 0, {}
+    with open(log_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
             try:
-                # 解析文件名
-                original_class_code, sequence_str, parsed_type = parse_base_filename(
-                    filename
-                )
-                if parsed_type != file_type:
-                    print(f"⚠️  文件名格式不匹配{lang_name}描述文件：{filename}，跳过")
-                    continue
-
-                # 生成新文件名
-                new_filename = generate_new_filename(
-                    original_class_code, sequence_str, file_type
-                )
-                input_path = os.path.join(input_dir, filename)
-                output_path = os.path.join(output_dir, new_filename)
-
-                # 处理文件内容并保存
-                if process_caption_file(
-                    input_path, output_path, original_class_code, sequence_str
-                ):
-                    print(f"✅ {filename} → {new_filename}")
-                    success_count += 1
-                else:
-                    fail_count += 1
-
-            except Exception as e:
-                print(f"❌ 处理失败 {filename}：{str(e)}")
-                fail_count += 1
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # 中断时写了一半的记录
+            if record["event"] == "plan":
+                operations = [tuple(op) for op in record["operations"]]
+                meta = {
+                    "class_mapping": record.get("class_mapping", CLASS_MAPPING),
+                    "cleanup_dirs": record.get("cleanup_dirs", []),
+                }
+            elif record["event"] == "phase":
+                phase = record["phase"]
+    if operations is None:
+        raise ValueError(f"日志中没有处理计划：{log_file}")
+    return operations, phase, meta
+
+
+def _run_phase(operations, worker, desc):
+    success, fail, messages = run_operations(operations, worker=worker, desc=desc)
+    for message in messages:
+        print(message)
+    return sum(fail.values()) == 0, success, fail
+
+
+def run_inplace(
+    operations, log_file=INPLACE_LOG_FILE, start_phase=1, cleanup_dirs=None
+):
+    """
+    原地执行计划：日志记录计划与阶段，第一阶段写临时文件，第二阶段改为最终名，最后提交
+    任一阶段有失败时停止，文件保持在可继续/可回滚的状态
+    cleanup_dirs：提交后若为空则删除的目录（文件夹重命名后的旧目录）
+    """
+    cleanup_dirs = cleanup_dirs or []
+    if start_phase <= 1:
+        if start_phase == 0:
+            _append_log(
+                log_file,
+                {
+                    "event": "plan",
+                    "class_mapping": CLASS_MAPPING,
+                    "cleanup_dirs": cleanup_dirs,
+                    "operations": operations,
+                },
+            )
+        _append_log(log_file, {"event": "phase", "phase": 1})
+        ok, success, fail = _run_phase(
+            operations, _inplace_phase1, "第一阶段（临时文件）"
+        )
+        if not ok:
+            return success, fail
+    if start_phase <= 2:
+        _append_log(log_file, {"event": "phase", "phase": 2})
+        ok, success, fail = _run_phase(
+            operations, _inplace_phase2, "第二阶段（最终文件名）"
+        )
+        if not ok:
+            return success, fail
+    _append_log(log_file, {"event": "phase", "phase": 3})
+    ok, success, fail = _run_phase(operations, _inplace_commit, "提交（删除备份）")
+    if ok:
+        for dir_path in cleanup_dirs:
+            if os.path.isdir(dir_path) and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+        os.remove(log_file)
+    return success, fail
+
+
+def rollback_inplace(log_file=INPLACE_LOG_FILE):
+    """按日志回滚中断的原地处理，恢复原文件名和原内容"""
+    operations, phase, meta = read_inplace_log(log_file)
+    if phase >= 3:
+        raise ValueError(
+            "处理已进入提交阶段，备份可能已删除，无法回滚，请使用--resume完成"
+        )
+    if phase >= 2:
+        ok, _, _ = _run_phase(operations, _inplace_undo_phase2, "回滚第二阶段")
+        if not ok:
+            return False
+    ok, _, _ = _run_phase(operations, _inplace_undo_phase1, "回滚第一阶段")
+    if ok:
+        os.remove(log_file)
+    return ok
+
+
+# 读取多类别配置
+def load_config(config_file, in_place=False):
+    """
+    读取JSON配置，返回处理任务列表：[(任务名, 输入目录字典, 输出目录字典)]
+    配置字段：
+    - input_root / output_root：原数据根目录、输出根目录
+    - trees：文件类型 -> [输入子目录, 输出子目录]（如annotation: ["bbox", "bbox_processed"]）
+    - class_mapping：原类别 -> 新类别
+    - folders：原类别文件夹名 -> 新文件夹名（如08_wheat_midge -> 07_wheat_midge）
+    原地模式下输出目录为输入根目录中的新文件夹
+    """
+    with open(config_file, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    set_class_mapping(config["class_mapping"])
+
+    input_root = config["input_root"]
+    output_root = input_root if in_place else config["output_root"]
+    jobs = []
+    for old_folder, new_folder in config["folders"].items():
+        input_dirs, output_dirs = {}, {}
+        for file_type, (input_tree, output_tree) in config["trees"].items():
+            if file_type not in FILE_KINDS:
+                raise ValueError(f"配置中的文件类型不支持：{file_type}")
+            input_dirs[file_type] = os.path.join(input_root, input_tree, old_folder)
+            output_dirs[file_type] = os.path.join(
+                output_root, input_tree if in_place else output_tree, new_folder
+            )
+        jobs.append((f"{old_folder} → {new_folder}", input_dirs, output_dirs))
+    return jobs
 
-        # 统计当前语言的处理结果
-        print(f"{lang_name}描述文件处理完成：成功{success_count}个，失败{fail_count}个")
-        total_success += success_count
-        total_fail += fail_count
 
-    return total_success, total_fail
+def print_summary(success, fail, jobs):
+    """输出总体处理结果"""
+    print("\n" + "=" * 60)
+    print("全部处理完成！" if sum(fail.values()) == 0 else "处理结束（存在失败）")
+    print("=" * 60)
+    for file_type, (_, label) in FILE_KINDS.items():
+        print(f"{label}：成功{success[file_type]}个，失败{fail[file_type]}个")
+    print(f"\n处理后的文件保存位置：")
+    for name, _, output_dirs in jobs:
+        if name:
+            print(f"【{name}】")
+        for file_type, (_, label) in FILE_KINDS.items():
+            if file_type in output_dirs:
+                print(f"- {label}：{output_dirs[file_type]}")
+    print("=" * 60)
 
 
 # 主处理函数
 def main():
+    parser = argparse.ArgumentParser(description="YOLO标注+图片+描述文件批量处理工具")
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="多类别配置文件（JSON），不指定时使用脚本中的单类别路径配置",
+    )
+    parser.add_argument(
+        "--in_place",
+        action="store_true",
+        help="在原目录中重命名并改写文件，不复制到输出目录",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="按日志继续中断的原地处理"
+    )
+    parser.add_argument(
+        "--rollback", action="store_true", help="按日志回滚中断的原地处理"
+    )
+    parser.add_argument(
+        "--log_file", type=str, default=INPLACE_LOG_FILE, help="原地模式的预写日志文件"
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="并行处理文件的线程数，默认NUM_WORKERS",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="逐个输出每个文件的处理结果"
+    )
+    args = parser.parse_args()
+
     print("=" * 60)
     print("YOLO标注+图片+描述文件批量处理工具")
     print("=" * 60)
 
-    # 1. 创建输出目录
-    create_output_dirs()
+    global NUM_WORKERS, VERBOSE
+    NUM_WORKERS = args.num_workers or NUM_WORKERS
+    VERBOSE = VERBOSE or args.verbose
 
-    # 2. 处理标注文件和图片文件
-    print("\n" + "=" * 50)
-    print("开始处理标注文件和图片文件...")
-    print("=" * 50)
-
-    # 获取所有符合条件的标注文件
-    annotation_filenames = [
-        f
-        for f in os.listdir(ANNOTATIONS_INPUT_DIR)
-        if f.endswith(ANNOTATION_SUFFIX)
-        and re.match(rf"^{FILE_PREFIX}\d{{{NUM_DIGITS_TOTAL}}}{ANNOTATION_SUFFIX}$", f)
-    ]
+    if args.rollback:
+        print("正在按日志回滚...")
+        print(
+            "✅ 回滚完成"
+            if rollback_inplace(args.log_file)
+            else "❌ 回滚未完成，可再次执行"
+        )
+        return
+    if args.resume:
+        operations, phase, meta = read_inplace_log(args.log_file)
+        # 续做第一阶段需要与中断前相同的类别映射
+        set_class_mapping(meta["class_mapping"])
+        print(
+            f"按日志继续处理：共 {len(operations)} 个操作，从第{max(phase, 1)}阶段开始"
+        )
+        success, fail = run_inplace(
+            operations,
+            args.log_file,
+            start_phase=max(phase, 1),
+            cleanup_dirs=meta["cleanup_dirs"],
+        )
+        print_summary(success, fail, [])
+        return
+    if args.in_place and os.path.exists(args.log_file):
+        print(
+            f"❌ 存在未完成的原地处理日志 {args.log_file}，请使用--resume或--rollback"
+        )
+        return
 
-    if not annotation_filenames:
-        print(f"⚠️  在标注目录 {ANNOTATIONS_INPUT_DIR} 中未找到符合格式的标注文件")
+    if args.config:
+        jobs = load_config(args.config, in_place=args.in_place)
     else:
-        print(f"找到 {len(annotation_filenames)} 个标注文件，开始处理...\n")
-
-        ann_success = 0
-        ann_fail = 0
-
-        for idx, filename in enumerate(annotation_filenames, 1):
-            print(f"\n【{idx}/{len(annotation_filenames)}】")
-            if process_annotation_image_pair(filename):
-                ann_success += 1
-            else:
-                ann_fail += 1
-
-        print(f"\n标注+图片处理统计：成功{ann_success}个，失败{ann_fail}个")
+        jobs = [("", INPUT_DIRS, INPUT_DIRS if args.in_place else OUTPUT_DIRS)]
+
+    # 1. 扫描所有类别的目录（各类别并行扫描，每个目录只扫描一次），集中报告问题
+    with ThreadPoolExecutor(max_workers=min(len(jobs), NUM_WORKERS)) as executor:
+        manifests = list(executor.map(lambda job: build_manifest(job[1]), jobs))
+    operations = []
+    for (name, input_dirs, output_dirs), (manifest, unrecognized) in zip(
+        jobs, manifests
+    ):
+        if name:
+            print(f"\n【{name}】")
+        report_manifest(manifest, unrecognized)
+        operations.extend(
+            plan_operations(
+                manifest, input_dirs, output_dirs, include_orphan_images=args.in_place
+            )
+        )
 
-    # 3. 处理描述文件
-    cap_success, cap_fail = process_all_caption_files()
+    print("\n" + "=" * 50)
+    print(f"开始按清单处理文件（{len(jobs)} 个类别，{len(operations)} 个操作）...")
+    print("=" * 50)
 
-    # 4. 输出总体处理结果
-    print("\n" + "=" * 60)
-    print("全部处理完成！")
-    print("=" * 60)
-    print(
-        f"标注+图片文件：成功{ann_success if 'ann_success' in locals() else 0}个，失败{ann_fail if 'ann_fail' in locals() else 0}个"
-    )
-    print(f"描述文件：成功{cap_success}个，失败{cap_fail}个")
-    print(f"\n处理后的文件保存位置：")
-    print(f"- 标注文件：{ANNOTATIONS_OUTPUT_DIR}")
-    print(f"- 图片文件：{IMAGES_OUTPUT_DIR}")
-    print(f"- 中文描述：{CAPTION_CN_OUTPUT_DIR}")
-    print(f"- 英文描述：{CAPTION_EN_OUTPUT_DIR}")
-    print("=" * 60)
+    # 2. 创建输出目录（原地模式下为重命名后的文件夹）
+    for _, _, output_dirs in jobs:
+        create_output_dirs(output_dirs)
+
+    if args.in_place:
+        # 3. 原地模式：检查目标冲突后两阶段执行，所有类别的操作在同一线程池中并行
+        conflicts = check_inplace_plan(operations)
+        if conflicts:
+            _print_examples("目标文件冲突，已停止（未修改任何文件）", conflicts)
+            return
+        cleanup_dirs = sorted(
+            {
+                input_dir
+                for _, input_dirs, output_dirs in jobs
+                for file_type, input_dir in input_dirs.items()
+                if input_dir != output_dirs[file_type]
+            }
+        )
+        success, fail = run_inplace(
+            operations, args.log_file, start_phase=0, cleanup_dirs=cleanup_dirs
+        )
+        print_summary(success, fail, jobs)
+        return
+
+    # 3. 复制模式：所有类别的操作在同一线程池中并行
+    success, fail, messages = run_operations(operations)
+    for message in messages:
+        print(message)
+    print_summary(success, fail, jobs)
 
 
 # 执行主函数
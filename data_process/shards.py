@@ -0,0 +1,362 @@
+"""
+WebDataset格式tar分片打包与读取
+功能：
+1. 将每个样本的图片、YOLO标注、中英文描述文件打包进按大小/样本数切分的tar分片，
+   同一样本的文件在tar中连续存放，成员名为"<类别文件夹>/<文件名>.<类型>"（WebDataset约定）：
+   图片保留原扩展名（.jpg / .png等，统一小写），其余为.labels.txt / .caption_cn.txt / .caption_en.txt
+2. 多线程读取小文件，主线程顺序写入分片；同时输出索引CSV（分片、样本、成员名、数据偏移、大小），
+   可不解包直接按偏移读取单个文件
+3. 流式读取：按顺序读取分片，逐个返回样本字典，下游只需大块顺序读，无需大量随机打开小文件
+"""
+
+import argparse
+import csv
+import io
+import os
+import random
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from coco_convert import list_images, read_split_list
+from filename_codec import SUFFIXES
+from make_splits import SPLITS
+from tobbox import IMG_EXTENSIONS
+
+# 样本内的文件类型 -> tar成员扩展名（图片使用自身的扩展名）
+MEMBER_EXTENSIONS = {
+    "annotation": "labels.txt",
+    "caption_cn": "caption_cn.txt",
+    "caption_en": "caption_en.txt",
+}
+INDEX_COLUMNS = ["shard", "key", "member", "offset", "size"]
+TAR_BLOCK = 512
+
+
+def find_caption(
+    img_path: str, caption_dirs: Sequence[str], kind: str
+) -> Optional[str]:
+    """在描述目录（及其中与图片同名的类别文件夹）中查找描述文件"""
+    base_name = os.path.splitext(os.path.basename(img_path))[0]
+    class_folder = os.path.basename(os.path.dirname(img_path))
+    name = base_name + SUFFIXES[kind]
+    for caption_dir in caption_dirs:
+        for path in (
+            os.path.join(caption_dir, class_folder, name),
+            os.path.join(caption_dir, name),
+        ):
+            if os.path.exists(path):
+                return path
+    return None
+
+
+def sample_key(img_path: str) -> str:
+    """样本名：类别文件夹/文件名（不含扩展名，WebDataset按第一个点分隔样本名与类型）"""
+    class_folder = os.path.basename(os.path.dirname(img_path))
+    base_name = os.path.splitext(os.path.basename(img_path))[0].replace(".", "_")
+    return f"{class_folder}/{base_name}" if class_folder else base_name
+
+
+def read_sample(
+    img_path: str, label_dir: Optional[str], caption_dirs: Sequence[str]
+) -> Tuple[str, List[Tuple[str, bytes, float]]]:
+    """读取一个样本的全部文件，返回(样本名, [(扩展名, 内容, 修改时间)])"""
+    paths = {"image": img_path}
+    stem = os.path.splitext(img_path)[0]
+    if label_dir:
+        class_folder = os.path.basename(os.path.dirname(img_path))
+        base_name = os.path.basename(stem)
+        candidates = [
+            os.path.join(label_dir, class_folder, base_name + ".txt"),
+            os.path.join(label_dir, base_name + ".txt"),
+        ]
+    else:
+        candidates = [stem + ".txt"]
+    paths["annotation"] = next((p for p in candidates if os.path.exists(p)), None)
+    for kind in ("caption_cn", "caption_en"):
+        paths[kind] = find_caption(img_path, caption_dirs, kind)
+
+    members = []
+    for kind, path in paths.items():
+        if path is None:
+            continue
+        if kind == "image":
+            extension = os.path.splitext(path)[1].lstrip(".").lower()
+        else:
+            extension = MEMBER_EXTENSIONS[kind]
+        with open(path, "rb") as f:
+            members.append((extension, f.read(), os.path.getmtime(path)))
+    return sample_key(img_path), members
+
+
+def padded_size(size: int) -> int:
+    """tar中数据按512字节块补齐后的大小"""
+    return (size + TAR_BLOCK - 1) // TAR_BLOCK * TAR_BLOCK
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class ShardWriter:
+    """顺序写入tar分片，超过大小或样本数上限时切换到新分片"""
+
+    def __init__(self, pattern: str, max_size: int, max_count: int, index_writer):
+        self.pattern = pattern
+        self.max_size = max_size
+        self.max_count = max_count
+        self.index_writer = index_writer
+        self.tar: Optional[tarfile.TarFile] = None
+        self.shard_paths: List[str] = []
+        self.count = 0
+
+    def _next_shard(self):
+        self.close()
+        path = self.pattern.format(len(self.shard_paths))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.tar = tarfile.open(path, "w", format=tarfile.PAX_FORMAT)
+        self.shard_paths.append(path)
+        self.count = 0
+
+    def write(self, key: str, members: List[Tuple[str, bytes, float]]):
+        # 每个成员占一个头部块加按512字节补齐的数据块
+        sample_size = sum(TAR_BLOCK + padded_size(len(data)) for _, data, _ in members)
+        if (
+            self.tar is None
+            or self.count >= self.max_count
+            or (self.count and self.tar.offset + sample_size > self.max_size)
+        ):
+            self._next_shard()
+        shard_name = os.path.basename(self.shard_paths[-1])
+        for extension, data, mtime in members:
+            info = tarfile.TarInfo(f"{key}.{extension}")
+            info.size = len(data)
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            self.tar.addfile(info, io.BytesIO(data))
+            # 写入后tar.offset位于补齐后的数据块末尾，由此反推数据起始偏移
+            offset = self.tar.offset - padded_size(info.size)
+            self.index_writer.writerow([shard_name, key, info.name, offset, info.size])
+        self.count += 1
+
+    def close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+
+def write_shards(
+    image_paths: Iterable[str],
+    output_dir: str,
+    prefix: str,
+    label_dir: Optional[str] = None,
+    caption_dirs: Sequence[str] = (),
+    max_size_mb: float = 1024,
+    max_count: int = 10000,
+    num_workers: int = 16,
+    batch_size: int = 256,
+) -> Dict[str, float]:
+    """
+    将一组样本写入output_dir/<prefix>-000000.tar等分片，索引写入output_dir/<prefix>_index.csv
+    返回统计信息
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_file = os.path.join(output_dir, f"{prefix}_index.csv")
+    stats = {"samples": 0, "bytes": 0, "missing_labels": 0}
+    with open(index_file, "w", newline="", encoding="utf-8") as f:
+        index_writer = csv.writer(f)
+        index_writer.writerow(INDEX_COLUMNS)
+        writer = ShardWriter(
+            os.path.join(output_dir, prefix + "-{:06d}.tar"),
+            int(max_size_mb * 1024 * 1024),
+            max_count,
+            index_writer,
+        )
+        try:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                for batch in _batches(image_paths, batch_size):
+                    # 小文件多线程读取，写入保持输入顺序
+                    for key, members in executor.map(
+                        lambda p: read_sample(p, label_dir, caption_dirs), batch
+                    ):
+                        writer.write(key, members)
+                        stats["samples"] += 1
+                        stats["bytes"] += sum(len(data) for _, data, _ in members)
+                        stats["missing_labels"] += all(
+                            ext != MEMBER_EXTENSIONS["annotation"]
+                            for ext, _, _ in members
+                        )
+        finally:
+            writer.close()
+    stats["shards"] = len(writer.shard_paths)
+    return stats
+
+
+def split_member_name(name: str) -> Tuple[str, str]:
+    """成员名 -> (样本名, 扩展名)，按文件名中第一个点分隔"""
+    directory, _, base_name = name.rpartition("/")
+    stem, _, extension = base_name.partition(".")
+    return (f"{directory}/{stem}" if directory else stem), extension
+
+
+def iter_samples(
+    shard_paths: Sequence[str], shuffle_shards: bool = False, seed: int = 0
+) -> Iterator[Dict[str, bytes]]:
+    """
+    流式读取分片，逐个返回样本字典：{"__key__": 样本名, "__shard__": 分片路径, 扩展名: 内容}
+    同一样本的成员在tar中连续存放，读到新的样本名时返回上一个样本
+    """
+    shard_paths = list(shard_paths)
+    if shuffle_shards:
+        random.Random(seed).shuffle(shard_paths)
+    for shard_path in shard_paths:
+        sample: Dict[str, bytes] = {}
+        with tarfile.open(shard_path, "r|") as tar:
+            for info in tar:
+                if not info.isfile():
+                    continue
+                key, extension = split_member_name(info.name)
+                if sample and sample["__key__"] != key:
+                    yield sample
+                    sample = {}
+                if not sample:
+                    sample = {"__key__": key, "__shard__": shard_path}
+                sample[extension] = tar.extractfile(info).read()
+        if sample:
+            yield sample
+
+
+def decode_sample(sample: Dict[str, bytes]) -> dict:
+    """
+    解码样本：图片 -> BGR数组，标注 -> parse_label_text结果，描述 -> 文本
+    """
+    import cv2
+    import numpy as np
+
+    from label_store import parse_label_text
+
+    decoded = {"__key__": sample["__key__"]}
+    image_key = next((k for k in sample if f".{k}" in IMG_EXTENSIONS), None)
+    if image_key is not None:
+        buffer = np.frombuffer(sample[image_key], dtype=np.uint8)
+        decoded["image"] = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if "labels.txt" in sample:
+        decoded["boxes"], _ = parse_label_text(sample["labels.txt"].decode("utf-8"))
+    for kind in ("caption_cn", "caption_en"):
+        extension = MEMBER_EXTENSIONS[kind]
+        if extension in sample:
+            decoded[kind] = sample[extension].decode("utf-8")
+    return decoded
+
+
+def read_member(shard_path: str, offset: int, size: int) -> bytes:
+    """按索引中的偏移与大小直接读取分片中的单个文件"""
+    with open(shard_path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def list_shards(index_file: str) -> List[str]:
+    """按索引文件中出现的顺序返回分片路径（与索引文件在同一目录）"""
+    with open(index_file, "r", encoding="utf-8") as f:
+        shards = dict.fromkeys(row["shard"] for row in csv.DictReader(f))
+    base_dir = os.path.dirname(os.path.abspath(index_file))
+    return [os.path.join(base_dir, name) for name in shards]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebDataset格式tar分片打包与读取")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    write_parser = subparsers.add_parser("write", help="打包样本为tar分片")
+    source = write_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
+        "--split_dir", type=str, help="make_splits.py的输出目录（每个子集单独打包）"
+    )
+    source.add_argument("--image_dir", type=str, help="图片目录（含类别子文件夹）")
+    write_parser.add_argument(
+        "--label_dir", type=str, default=None, help="YOLO标注目录，默认与图片同目录"
+    )
+    write_parser.add_argument(
+        "--caption_dir",
+        type=str,
+        nargs="*",
+        default=[],
+        help="描述文件目录（可多个，如caption与caption_en）",
+    )
+    write_parser.add_argument(
+        "--output_dir", type=str, required=True, help="分片输出目录"
+    )
+    write_parser.add_argument(
+        "--name", type=str, default="all", help="--image_dir模式下的分片名前缀"
+    )
+    write_parser.add_argument(
+        "--max_size", type=float, default=1024, help="单个分片最大MB数"
+    )
+    write_parser.add_argument(
+        "--max_count", type=int, default=10000, help="单个分片最大样本数"
+    )
+    write_parser.add_argument("--num_workers", type=int, default=16, help="读取线程数")
+
+    read_parser = subparsers.add_parser("read", help="顺序读取分片并统计吞吐")
+    read_parser.add_argument("--index", type=str, required=True, help="分片索引CSV")
+    read_parser.add_argument("--decode", action="store_true", help="同时解码图片与标注")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "read":
+        num_samples = 0
+        num_bytes = 0
+        for sample in iter_samples(list_shards(args.index)):
+            num_samples += 1
+            num_bytes += sum(
+                len(v) for k, v in sample.items() if not k.startswith("__")
+            )
+            if args.decode:
+                decode_sample(sample)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(
+            f"读取完成：{num_samples} 个样本，{num_bytes / 1024 ** 2:.1f} MB，耗时 {elapsed:.1f}s"
+            f"（{num_samples / elapsed:.1f} 个/s，{num_bytes / 1024 ** 2 / elapsed:.1f} MB/s）"
+        )
+        return
+
+    if args.split_dir:
+        jobs = [
+            (split, read_split_list(os.path.join(args.split_dir, f"{split}.txt")))
+            for split in SPLITS
+            if os.path.exists(os.path.join(args.split_dir, f"{split}.txt"))
+        ]
+    else:
+        jobs = [(args.name, list_images(args.image_dir))]
+
+    for prefix, image_paths in jobs:
+        split_start = time.perf_counter()
+        stats = write_shards(
+            image_paths,
+            args.output_dir,
+            prefix,
+            label_dir=args.label_dir,
+            caption_dirs=args.caption_dir,
+            max_size_mb=args.max_size,
+            max_count=args.max_count,
+            num_workers=args.num_workers,
+        )
+        elapsed = max(time.perf_counter() - split_start, 1e-9)
+        print(
+            f"{prefix}：{stats['samples']} 个样本写入 {stats['shards']} 个分片，"
+            f"{stats['bytes'] / 1024 ** 2:.1f} MB，耗时 {elapsed:.1f}s"
+            f"（{stats['samples'] / elapsed:.1f} 个/s），缺少标注 {stats['missing_labels']} 个"
+        )
+    print(f"全部完成，耗时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+以图搜图工具（基于corpus_index.py建立的特征索引）
+功能：
+1. 索引只加载一次，按图片路径（索引内图片直接取已存特征）或新图片查询最相似的top_k张
+2. 支持按文件名中的类别编码、描述文件中的害虫生命阶段过滤结果
+3. 命令行单次查询，或交互模式连续查询（模型与索引常驻内存）
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from corpus_index import CorpusIndex, normalize
+from filename_codec import SUFFIXES, class_code_of
+from image_deduplication import extract_features
+
+# 描述文件后缀，按顺序查找（英文描述优先）
+CAPTION_SUFFIXES = (SUFFIXES["caption_en"], SUFFIXES["caption_cn"])
+# 描述JSON中表示生命阶段的字段名关键字
+LIFE_STAGE_KEYS = ("life stage", "生命阶段")
+
+
+def extract_life_stages(caption: dict) -> Set[str]:
+    """递归取出描述JSON中所有生命阶段字段的值（小写）"""
+    stages = set()
+    for key, value in caption.items():
+        if isinstance(value, dict):
+            stages |= extract_life_stages(value)
+        elif isinstance(value, str) and any(k in key.lower() for k in LIFE_STAGE_KEYS):
+            if value.strip():
+                stages.add(value.strip().lower())
+    return stages
+
+
+def read_life_stages(image_path: str, caption_dir: str) -> Set[str]:
+    """读取图片对应描述文件中的生命阶段，缺失或解析失败时返回空集合"""
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    stages = set()
+    for suffix in CAPTION_SUFFIXES:
+        caption_path = os.path.join(caption_dir, base_name + suffix)
+        if not os.path.exists(caption_path):
+            continue
+        try:
+            with open(caption_path, "r", encoding="utf-8") as f:
+                content = re.sub(r",\s*}", "}", f.read())
+            stages |= extract_life_stages(json.loads(content))
+        except (OSError, ValueError) as e:
+            print(f"无法解析描述文件 {caption_path}: {e}")
+    return stages
+
+
+class SimilaritySearch:
+    """加载一次索引，重复回答top_k相似图片查询"""
+
+    def __init__(
+        self,
+        index_dir: str,
+        caption_dir: Optional[str] = None,
+        weights: Optional[str] = None,
+        num_workers: int = 16,
+    ):
+        start = time.perf_counter()
+        # 索引外的图片要用weights提取特征，须与建索引时的模型一致
+        self.index = CorpusIndex.load(index_dir, weights, verify_model=True)
+        self.weights = weights
+        self.row_of = {path: i for i, path in enumerate(self.index.paths)}
+        self.class_codes = np.array([class_code_of(p) for p in self.index.paths])
+
+        # 生命阶段在加载时一次性读取，查询时只做集合判断
+        self.life_stages: Optional[List[Set[str]]] = None
+        if caption_dir:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                self.life_stages = list(
+                    executor.map(
+                        lambda path: read_life_stages(path, caption_dir),
+                        self.index.paths,
+                    )
+                )
+        print(
+            f"索引已加载：{self.index.count} 张图片，耗时 {time.perf_counter() - start:.2f}s"
+        )
+
+    def _filter_mask(
+        self, class_code: Optional[str], life_stage: Optional[str]
+    ) -> Optional[np.ndarray]:
+        """根据过滤条件生成索引条目掩码，无过滤时返回None"""
+        mask = None
+        if class_code:
+            mask = self.class_codes == int(class_code)
+        if life_stage:
+            if self.life_stages is None:
+                raise ValueError("按生命阶段过滤需要提供描述文件目录（caption_dir）")
+            stage = life_stage.strip().lower()
+            # 子串匹配，例如adult可匹配male adult/female adult
+            stage_mask = np.array(
+                [any(stage in s for s in stages) for stages in self.life_stages],
+                dtype=bool,
+            )
+            mask = stage_mask if mask is None else mask & stage_mask
+        return mask
+
+    def embed(self, image_path: str) -> np.ndarray:
+        """索引内的图片直接使用已存特征，否则用索引的模型提取"""
+        row = self.row_of.get(image_path)
+        if row is not None:
+            return self.index.matrix[row]
+        backbone, int8_model = self.index.model_key
+        features = extract_features(
+            [image_path],
+            batch_size=1,
+            backbone=backbone,
+            int8_model=int8_model,
+            weights=self.weights,
+        )
+        if image_path not in features:
+            raise ValueError(f"无法读取图片：{image_path}")
+        return normalize(features[image_path][None, :])[0]
+
+    def query(
+        self,
+        image_path: str,
+        top_k: int = 10,
+        class_code: Optional[str] = None,
+        life_stage: Optional[str] = None,
+    ) -> List[Tuple[str, float]]:
+        """返回与image_path最相似的top_k张图片[(路径, 相似度)]，不包含图片本身"""
+        query = self.embed(image_path)
+        candidates = np.arange(self.index.count)
+        mask = self._filter_mask(class_code, life_stage)
+        if mask is not None:
+            candidates = candidates[mask]
+        self_row = self.row_of.get(image_path)
+        if self_row is not None:
+            candidates = candidates[candidates != self_row]
+        if len(candidates) == 0:
+            return []
+
+        similarity = self.index.matrix[candidates] @ query
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-similarity, k - 1)[:k]
+        top = top[np.argsort(-similarity[top])]
+        return [(self.index.paths[candidates[i]], float(similarity[i])) for i in top]
+
+
+def print_results(image_path: str, results: List[Tuple[str, float]], elapsed: float):
+    print(f"查询 {image_path}（{elapsed * 1000:.1f}ms）：")
+    if not results:
+        print("  没有满足条件的结果")
+    for rank, (path, score) in enumerate(results, 1):
+        print(f"  {rank:>3}. {score:.4f}  {path}")
+
+
+def run_query(searcher: SimilaritySearch, image_path: str, options: Dict) -> List:
+    start = time.perf_counter()
+    results = searcher.query(image_path, **options)
+    print_results(image_path, results, time.perf_counter() - start)
+    return results
+
+
+def interactive(searcher: SimilaritySearch, options: Dict):
+    """交互模式：每行输入 图片路径 [--top_k N] [--class_code CCC] [--life_stage 阶段]"""
+    parser = argparse.ArgumentParser(prog="query", add_help=False, exit_on_error=False)
+    parser.add_argument("image_path")
+    parser.add_argument("--top_k", type=int, default=options["top_k"])
+    parser.add_argument("--class_code", default=options["class_code"])
+    parser.add_argument("--life_stage", default=options["life_stage"])
+
+    print(
+        "交互模式：输入 图片路径 [--top_k N] [--class_code CCC] [--life_stage 阶段]，输入 q 退出"
+    )
+    while True:
+        try:
+            line = input("> ").strip()
+        except EOFError:
+            break
+        if line in ("q", "quit", "exit"):
+            break
+        if not line:
+            continue
+        try:
+            args = parser.parse_args(shlex.split(line))
+            run_query(
+                searcher,
+                args.image_path,
+                {
+                    "top_k": args.top_k,
+                    "class_code": args.class_code,
+                    "life_stage": args.life_stage,
+                },
+            )
+        except SystemExit:
+            # argparse已打印用法说明，继续等待下一次输入
+            continue
+        except (argparse.ArgumentError, ValueError) as e:
+            print(f"查询失败：{e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以图搜图工具")
+    parser.add_argument("--index_dir", type=str, required=True, help="特征索引目录")
+    parser.add_argument(
+        "--query", type=str, nargs="*", default=[], help="查询图片路径（可多个）"
+    )
+    parser.add_argument("--top_k", type=int, default=10, help="返回的相似图片数量")
+    parser.add_argument(
+        "--class_code", type=str, default=None, help="只返回该类别编码的图片"
+    )
+    parser.add_argument(
+        "--life_stage", type=str, default=None, help="只返回该生命阶段的图片（如Larva）"
+    )
+    parser.add_argument(
+        "--caption_dir",
+        type=str,
+        default=None,
+        help="描述文件目录（按生命阶段过滤时需要）",
+    )
+    parser.add_argument("--weights", type=str, default=None, help="本地权重文件或目录")
+    parser.add_argument("--output_csv", type=str, default=None, help="保存查询结果CSV")
+    parser.add_argument("--interactive", action="store_true", help="进入交互查询模式")
+    args = parser.parse_args()
+
+    searcher = SimilaritySearch(args.index_dir, args.caption_dir, args.weights)
+    options = {
+        "top_k": args.top_k,
+        "class_code": args.class_code,
+        "life_stage": args.life_stage,
+    }
+
+    rows = []
+    for image_path in args.query:
+        for rank, (path, score) in enumerate(
+            run_query(searcher, image_path, options), 1
+        ):
+            rows.append(
+                {
+                    "query": image_path,
+                    "rank": rank,
+                    "image_path": path,
+                    "similarity": round(score, 4),
+                }
+            )
+    if args.output_csv and rows:
+        import pandas as pd
+
+        pd.DataFrame(rows).to_csv(args.output_csv, index=False, encoding="utf-8-sig")
+        print(f"查询结果已保存到 {args.output_csv}")
+
+    if args.interactive:
+        interactive(searcher, options)
+
+
+if __name__ == "__main__":
+    main()
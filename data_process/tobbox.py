@@ -1,78 +1,142 @@
-import cv2
-import numpy as np
+import argparse
+import multiprocessing
 import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Tuple, Optional
 
+import cv2
+import numpy as np
 
-def draw_yolo_annotations(
-    img_path: str,
-    txt_path: str,
-    output_path: str,
+from label_store import LabelStore, parse_label_file, to_records
+
+IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif")
+# 输出格式 -> (文件扩展名, cv2.imwrite质量参数)；png的quality表示压缩级别0-9
+OUTPUT_FORMATS = {
+    "jpg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY),
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+}
+
+# 预览模式：解码时直接缩小到1/2、1/4、1/8（JPEG在解码阶段降采样，不解码全分辨率）
+PREVIEW_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+PREVIEW_FORMAT = "jpg"  # 预览模式未指定输出格式时使用
+PREVIEW_QUALITY = 75  # 预览模式未指定输出质量时使用
+
+# 自定义类别颜色（格式：BGR，与OpenCV一致）
+CUSTOM_COLORS = [
+    (200, 180, 255),
+    (23, 164, 243),
+    (70, 83, 238),
+    (150, 247, 255),
+    (188, 115, 141),
+    (212, 221, 164),
+    (55, 171, 83),
+    (197, 173, 50),
+]
+
+
+def read_image(img_path: str, preview_scale: int = 1) -> np.ndarray:
+    """读取图片，preview_scale>1时按缩小倍数解码"""
+    if preview_scale not in PREVIEW_FLAGS:
+        raise ValueError(
+            f"预览缩小倍数只支持{list(PREVIEW_FLAGS)}，当前为{preview_scale}"
+        )
+    img = cv2.imread(img_path, PREVIEW_FLAGS[preview_scale])
+    if img is None:
+        raise FileNotFoundError(f"无法读取图片: {img_path}")
+    return img
+
+
+def write_image(
+    output_path: str, img: np.ndarray, quality: Optional[int] = None
+) -> None:
+    """按输出文件扩展名选择编码参数保存图片，quality为None时使用OpenCV默认值"""
+    ext = os.path.splitext(output_path)[1].lower().lstrip(".")
+    ext = "jpg" if ext == "jpeg" else ext
+    params = []
+    if quality is not None and ext in OUTPUT_FORMATS:
+        params = [OUTPUT_FORMATS[ext][1], int(quality)]
+    if not cv2.imwrite(output_path, img, params):
+        raise IOError(f"无法保存图片: {output_path}")
+
+
+def load_annotations(
+    txt_path: str, store: Optional[LabelStore] = None
+) -> Tuple[Optional[list], List[int]]:
+    """
+    读取YOLO标注（class_id x_center y_center width height，均为归一化值）
+    返回：([(class_id, x_center, y_center, width, height, 序号)], 格式错误的行号)，
+    标注文件不存在时标注列表为None；序号为标注所在行号
+    """
+    if store is not None:
+        if txt_path not in store:
+            return None, []
+        boxes = store.get(txt_path)
+        error_lines = store.errors_of(txt_path)["line"].tolist()
+    elif os.path.exists(txt_path):
+        rows, errors = parse_label_file(txt_path)
+        boxes = to_records(rows)
+        error_lines = [line for line, _ in errors]
+    else:
+        return None, []
+
+    annotations = list(
+        zip(
+            boxes["cls"].tolist(),
+            boxes["cx"].tolist(),
+            boxes["cy"].tolist(),
+            boxes["w"].tolist(),
+            boxes["h"].tolist(),
+            boxes["line"].tolist(),
+        )
+    )
+    return annotations, error_lines
+
+
+def render_annotations(
+    img: np.ndarray,
+    annotations: list,
     class_colors: Optional[List[Tuple[int, int, int]]] = None,
     line_thickness: int = 2,
     font_scale: float = 0.5,
     font_thickness: int = 1,
-) -> None:
+    preview_scale: int = 1,
+) -> np.ndarray:
     """
-    从YOLO格式的txt标注文件中读取标注信息，在图片上绘制标注框（带序号）
-
-    参数:
-        img_path: 图片文件路径
-        txt_path: YOLO格式标注文件路径
-        output_path: 输出图片路径
-        class_colors: 每个类别的颜色列表，格式为[(B, G, R), ...]，长度需≥类别数
-                     若为None，将自动生成随机颜色
-        line_thickness: 标注框线条粗细
-        font_scale: 序号字体大小缩放比例
-        font_thickness: 序号字体粗细
+    在图片上绘制标注框和序号（原地修改并返回img）
+    preview_scale>1时img为缩小解码的图片，线宽、序号文字和背景框按同样倍数缩小
     """
-    # 1. 读取图片
-    img = cv2.imread(img_path)
-    if img is None:
-        raise FileNotFoundError(f"无法读取图片: {img_path}")
     img_h, img_w = img.shape[:2]
+    # 线宽、文字等像素尺寸按预览倍数缩小，至少保留1像素
+    line_thickness = max(1, round(line_thickness / preview_scale))
+    font_scale = font_scale / preview_scale
+    text_scale = 1 / preview_scale
+    text_thickness = max(1, round(2 / preview_scale))
+    label_size = max(1, round(25 / preview_scale))
 
-    # 2. 读取YOLO标注文件
-    annotations = []
-    if os.path.exists(txt_path):
-        with open(txt_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
-            for idx, line in enumerate(lines):
-                line = line.strip()
-                if not line:
-                    continue
-                # YOLO格式：class_id x_center y_center width height（均为归一化值）
-                parts = list(map(float, line.split()))
-                if len(parts) != 5:
-                    print(f"警告：标注文件第{idx+1}行格式错误，跳过")
-                    continue
-                class_id, x_center, y_center, width, height = parts
-                annotations.append(
-                    (int(class_id), x_center, y_center, width, height, idx + 1)
-                )  # 加入序号
-    else:
-        print(f"警告：标注文件不存在: {txt_path}，仅保存原图")
-        cv2.imwrite(output_path, img)
-        return
-
-    # 3. 处理类别颜色
+    # 处理类别颜色
+    max_class_id = max([ann[0] for ann in annotations], default=0)
     if class_colors is None:
         # 自动生成随机颜色（确保不同类别颜色不同）
-        max_class_id = max([ann[0] for ann in annotations], default=0)
         class_colors = []
         np.random.seed(42)  # 固定随机种子，保证颜色一致性
         for _ in range(max_class_id + 1):
             color = tuple(np.random.randint(0, 256, 3).tolist())
             class_colors.append(color)
-    else:
+    elif len(class_colors) <= max_class_id:
         # 检查颜色列表是否足够
-        max_class_id = max([ann[0] for ann in annotations], default=0)
-        if len(class_colors) <= max_class_id:
-            raise ValueError(
-                f"类别颜色列表长度不足（需要≥{max_class_id+1}，当前为{len(class_colors)}）"
-            )
+        raise ValueError(
+            f"类别颜色列表长度不足（需要≥{max_class_id+1}，当前为{len(class_colors)}）"
+        )
 
-    # 4. 绘制标注框和序号
+    # 绘制标注框和序号
     for ann in annotations:
         class_id, x_center, y_center, width, height, seq_num = ann
 
@@ -102,8 +166,8 @@ def draw_yolo_annotations(
         )
         # 文本背景框（避免文字与边框重叠）
         bg_x1 = x1
-        bg_y1 = y1 - 25 - baseline
-        bg_x2 = x1 + 25
+        bg_y1 = y1 - label_size - baseline
+        bg_x2 = x1 + label_size
         bg_y2 = y1
         # 确保背景框在图片内
         bg_y1 = max(0, bg_y1)
@@ -115,20 +179,136 @@ def draw_yolo_annotations(
             text,
             (x1, y1 - baseline),
             cv2.FONT_HERSHEY_SIMPLEX,
-            1,
+            text_scale,
             (0, 0, 0),
-            2,
+            text_thickness,
             cv2.LINE_AA,
         )
-        # print(min(x2-x1, y2-y1))
-        # print(max(x2-x1, y2-y1))
-        # print(min(x2-x1, y2-y1)/ max(x2-x1, y2-y1))
-        print(x_center)
-        print(1 - y_center)
+    return img
+
+
+def draw_yolo_annotations(
+    img_path: str,
+    txt_path: str,
+    output_path: str,
+    class_colors: Optional[List[Tuple[int, int, int]]] = None,
+    line_thickness: int = 2,
+    font_scale: float = 0.5,
+    font_thickness: int = 1,
+    store: Optional[LabelStore] = None,
+    quality: Optional[int] = None,
+    verbose: bool = True,
+    preview_scale: int = 1,
+) -> None:
+    """
+    从YOLO格式的txt标注文件中读取标注信息，在图片上绘制标注框（带序号）
+
+    参数:
+        img_path: 图片文件路径
+        txt_path: YOLO格式标注文件路径
+        output_path: 输出图片路径（扩展名决定输出格式：.jpg/.png/.webp）
+        class_colors: 每个类别的颜色列表，格式为[(B, G, R), ...]，长度需≥类别数
+                     若为None，将自动生成随机颜色
+        line_thickness: 标注框线条粗细
+        font_scale: 序号字体大小缩放比例
+        font_thickness: 序号字体粗细
+        store: 已加载的标注列式存储（批量处理时传入），为None时直接解析txt_path
+        quality: 输出质量（jpg/webp为0-100，png为压缩级别0-9），None为默认值
+        verbose: 是否输出警告和完成信息
+        preview_scale: 预览模式缩小倍数（1/2/4/8），大于1时缩小解码并按比例绘制
+    """
+    # 1. 读取图片
+    img = read_image(img_path, preview_scale)
+
+    # 2. 读取YOLO标注文件
+    annotations, error_lines = load_annotations(txt_path, store)
+    if annotations is None:
+        if verbose:
+            print(f"警告：标注文件不存在: {txt_path}，仅保存原图")
+        write_image(output_path, img, quality)
+        return
+    if verbose:
+        for line in error_lines:
+            print(f"警告：标注文件第{line}行格式错误，跳过")
+
+    # 3. 绘制标注框和序号
+    render_annotations(
+        img,
+        annotations,
+        class_colors,
+        line_thickness,
+        font_scale,
+        font_thickness,
+        preview_scale,
+    )
+
+    # 4. 保存结果图片
+    write_image(output_path, img, quality)
+    if verbose:
+        print(f"标注可视化完成，保存至: {output_path}")
+
+
+def _render_task(task: tuple) -> Tuple[str, bool, int, Optional[str]]:
+    """
+    子进程中渲染单张图片
+    返回：(图片文件名, 是否有标注文件, 格式错误行数, 错误信息)，成功时错误信息为None
+    """
+    img_file, img_path, annotations, num_errors, output_path, options = task
+    try:
+        img = read_image(img_path, options["preview_scale"])
+        if annotations is not None:
+            render_annotations(
+                img,
+                annotations,
+                options["class_colors"],
+                options["line_thickness"],
+                options["font_scale"],
+                options["font_thickness"],
+                options["preview_scale"],
+            )
+        write_image(output_path, img, options["quality"])
+        return img_file, annotations is not None, num_errors, None
+    except Exception as e:
+        return img_file, annotations is not None, num_errors, str(e)
+
+
+def _init_worker():
+    # 每个进程处理一张图片，关闭OpenCV内部线程避免与进程池争抢CPU
+    cv2.setNumThreads(1)
+
 
-    # 5. 保存结果图片
-    cv2.imwrite(output_path, img)
-    print(f"标注可视化完成，保存至: {output_path}")
+def summarize_batch(results, total: int, start: float, verbose: bool) -> None:
+    """汇总批量渲染结果并输出吞吐量"""
+    success = 0
+    missing_labels = 0
+    malformed_lines = 0
+    failures = []
+    for img_file, has_label, num_errors, error in results:
+        missing_labels += not has_label
+        malformed_lines += num_errors
+        if error is None:
+            success += 1
+            if verbose:
+                print(f"标注可视化完成: {img_file}")
+        else:
+            failures.append((img_file, error))
+            if verbose:
+                print(f"处理 {img_file} 时出错: {error}")
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"批量处理完成：成功 {success}/{total} 张，耗时 {elapsed:.1f}s"
+        f"（{success / max(elapsed, 1e-9):.1f} 张/s）"
+    )
+    if missing_labels:
+        print(f"警告：{missing_labels} 张图片没有标注文件，仅保存原图")
+    if malformed_lines:
+        print(f"警告：共跳过 {malformed_lines} 行格式错误的标注")
+    if failures and not verbose:
+        for img_file, error in failures[:10]:
+            print(f"处理 {img_file} 时出错: {error}")
+        if len(failures) > 10:
+            print(f"...（其余 {len(failures) - 10} 个错误省略）")
 
 
 def batch_draw_annotations(
@@ -139,92 +319,192 @@ def batch_draw_annotations(
     line_thickness: int = 2,
     font_scale: float = 0.5,
     font_thickness: int = 1,
+    image_format: Optional[str] = None,
+    quality: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    chunksize: int = 16,
+    verbose: bool = False,
+    preview_scale: int = 1,
 ) -> None:
     """
-    批量处理文件夹中的图片和标注文件
+    批量处理文件夹中的图片和标注文件（多进程，按chunksize分块分发任务）
 
     参数:
         img_dir: 图片文件夹路径
         txt_dir: 标注文件文件夹路径（与图片文件名一一对应）
         output_dir: 输出文件夹路径
+        image_format: 输出格式jpg/png/webp，None时与原图相同
+        quality: 输出质量，见draw_yolo_annotations
+        num_workers: 进程数，默认CPU核数；为1时在当前进程中处理
+        chunksize: 每次分发给子进程的图片数
+        verbose: 是否逐张输出处理结果
+        preview_scale: 预览模式缩小倍数（1/2/4/8），未指定格式/质量时输出较小的JPEG
         其他参数: 同draw_yolo_annotations
     """
+    start = time.perf_counter()
+    if preview_scale not in PREVIEW_FLAGS:
+        raise ValueError(
+            f"预览缩小倍数只支持{list(PREVIEW_FLAGS)}，当前为{preview_scale}"
+        )
+    if preview_scale > 1:
+        image_format = image_format or PREVIEW_FORMAT
+        quality = PREVIEW_QUALITY if quality is None else quality
     # 创建输出文件夹
     os.makedirs(output_dir, exist_ok=True)
 
     # 获取所有图片文件
-    img_extensions = (".jpg", ".jpeg", ".png", ".bmp", ".tif")
-    img_files = [f for f in os.listdir(img_dir) if f.lower().endswith(img_extensions)]
+    img_files = sorted(
+        f for f in os.listdir(img_dir) if f.lower().endswith(IMG_EXTENSIONS)
+    )
+    # 整个目录的标注一次加载（带缓存），子进程只接收各自图片的标注
+    store = LabelStore.load(txt_dir)
+    options = {
+        "class_colors": class_colors,
+        "line_thickness": line_thickness,
+        "font_scale": font_scale,
+        "font_thickness": font_thickness,
+        "quality": quality,
+        "preview_scale": preview_scale,
+    }
+
+    def output_name(img_file: str) -> str:
+        stem, ext = os.path.splitext(img_file)
+        return stem + (OUTPUT_FORMATS[image_format][0] if image_format else ext)
 
+    # 统一输出格式后x.jpg与x.png会写到同一个文件（Windows下不区分大小写），
+    # 冲突的文件在输出名中保留原扩展名，如x.png.webp
+    name_counts = Counter(output_name(f).lower() for f in img_files)
+    collisions = [f for f in img_files if name_counts[output_name(f).lower()] > 1]
+    if collisions:
+        print(
+            f"⚠️  {len(collisions)} 张图片输出文件名冲突，输出名保留原扩展名："
+            + "、".join(collisions[:5])
+            + ("…" if len(collisions) > 5 else "")
+        )
+
+    tasks = []
     for img_file in img_files:
         # 构建文件路径
-        img_path = os.path.join(img_dir, img_file)
-        txt_file = os.path.splitext(img_file)[0] + ".txt"
-        txt_path = os.path.join(txt_dir, txt_file)
-        output_path = os.path.join(output_dir, img_file)
-
-        try:
-            draw_yolo_annotations(
-                img_path=img_path,
-                txt_path=txt_path,
-                output_path=output_path,
-                class_colors=class_colors,
-                line_thickness=line_thickness,
-                font_scale=font_scale,
-                font_thickness=font_thickness,
+        stem, _ = os.path.splitext(img_file)
+        txt_path = os.path.join(txt_dir, stem + ".txt")
+        out_name = output_name(img_file)
+        if name_counts[out_name.lower()] > 1:
+            out_name = img_file + os.path.splitext(out_name)[1]
+        annotations, error_lines = load_annotations(txt_path, store)
+        tasks.append(
+            (
+                img_file,
+                os.path.join(img_dir, img_file),
+                annotations,
+                len(error_lines),
+                os.path.join(output_dir, out_name),
+                options,
             )
-        except Exception as e:
-            print(f"处理 {img_file} 时出错: {str(e)}")
+        )
+
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers <= 1 or len(tasks) < 2 * chunksize:
+        results = map(_render_task, tasks)
+        summarize_batch(results, len(tasks), start, verbose)
+        return
+
+    # spawn启动的子进程不继承父进程的状态，各平台行为一致
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as executor:
+        results = executor.map(_render_task, tasks, chunksize=chunksize)
+        summarize_batch(results, len(tasks), start, verbose)
 
 
 # ------------------------------
 # 示例使用
 # ------------------------------
 if __name__ == "__main__":
-    # 方式1：处理单张图片
+    # 方式1：处理单张图片（默认路径）
     single_img_path = r"D:\25.10.29backup\25.7.24\pest_text\api\data_processed\images\03_fall_armyworm\PD16-MW-00300001.jpg"  # 输入图片路径
     single_txt_path = r"D:\25.10.29backup\25.7.24\pest_text\api\data_processed\bbox\03_fall_armyworm\PD16-MW-00300001.txt"  # 对应的YOLO标注文件路径
     single_output_path = "test_annotated.jpg"  # 输出图片路径
 
-    # 自定义类别颜色（格式：BGR，与OpenCV一致）
-    custom_colors = [
-        (200, 180, 255),
-        (23, 164, 243),
-        (70, 83, 238),
-        (150, 247, 255),
-        (188, 115, 141),
-        (212, 221, 164),
-        (55, 171, 83),
-        (197, 173, 50),
-    ]
+    parser = argparse.ArgumentParser(description="YOLO标注框可视化")
+    parser.add_argument("--img", type=str, default=single_img_path, help="单张图片路径")
+    parser.add_argument(
+        "--txt", type=str, default=single_txt_path, help="单张图片的标注文件"
+    )
+    parser.add_argument(
+        "--output", type=str, default=single_output_path, help="单张输出路径"
+    )
+    # 方式2：批量处理文件夹（指定--img_dir时生效）
+    parser.add_argument(
+        "--img_dir", type=str, default=None, help="批量处理的图片文件夹"
+    )
+    parser.add_argument(
+        "--txt_dir", type=str, default=None, help="标注文件夹，默认同图片文件夹"
+    )
+    parser.add_argument(
+        "--output_dir", type=str, default="annotated_images", help="批量输出文件夹"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default=None,
+        choices=list(OUTPUT_FORMATS),
+        help="输出格式",
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=None,
+        help="输出质量（jpg/webp为0-100，png为0-9）",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=None, help="进程数，默认CPU核数"
+    )
+    parser.add_argument(
+        "--chunksize", type=int, default=16, help="每次分发给子进程的图片数"
+    )
+    parser.add_argument("--verbose", action="store_true", help="逐张输出处理结果")
+    parser.add_argument(
+        "--preview",
+        type=int,
+        default=1,
+        choices=list(PREVIEW_FLAGS),
+        help="预览模式：按1/2、1/4、1/8缩小解码并绘制，输出小尺寸JPEG/WebP",
+    )
+    args = parser.parse_args()
 
-    try:
-        draw_yolo_annotations(
-            img_path=single_img_path,
-            txt_path=single_txt_path,
-            output_path=single_output_path,
-            class_colors=custom_colors,  # 若不指定，将自动生成
-            line_thickness=2,
-            font_scale=0.6,
-            font_thickness=1,
-        )
-    except Exception as e:
-        print(f"单张图片处理失败: {str(e)}")
-
-    # 方式2：批量处理文件夹（可选）
-    # batch_img_dir = "images"      # 图片文件夹
-    # batch_txt_dir = "labels"      # 标注文件文件夹
-    # batch_output_dir = "annotated_images"  # 输出文件夹
-    #
-    # try:
-    #     batch_draw_annotations(
-    #         img_dir=batch_img_dir,
-    #         txt_dir=batch_txt_dir,
-    #         output_dir=batch_output_dir,
-    #         class_colors=custom_colors,
-    #         line_thickness=2,
-    #         font_scale=0.6,
-    #         font_thickness=1
-    #     )
-    # except Exception as e:
-    #     print(f"批量处理失败: {str(e)}")
+    if args.img_dir:
+        try:
+            batch_draw_annotations(
+                img_dir=args.img_dir,
+                txt_dir=args.txt_dir or args.img_dir,
+                output_dir=args.output_dir,
+                class_colors=CUSTOM_COLORS,
+                line_thickness=2,
+                font_scale=0.6,
+                font_thickness=1,
+                image_format=args.format,
+                quality=args.quality,
+                num_workers=args.num_workers,
+                chunksize=args.chunksize,
+                verbose=args.verbose,
+                preview_scale=args.preview,
+            )
+        except Exception as e:
+            print(f"批量处理失败: {str(e)}")
+    else:
+        try:
+            draw_yolo_annotations(
+                img_path=args.img,
+                txt_path=args.txt,
+                output_path=args.output,
+                class_colors=CUSTOM_COLORS,  # 若不指定，将自动生成
+                line_thickness=2,
+                font_scale=0.6,
+                font_thickness=1,
+                quality=args.quality,
+                preview_scale=args.preview,
+            )
+        except Exception as e:
+            print(f"单张图片处理失败: {str(e)}")
@@ -0,0 +1,262 @@
+"""
+YOLO标注批量校验与统计
+功能：
+1. 基于label_store.py的列式存储，对整个数据集的检测框一次性向量化校验：
+   - malformed：格式错误的行（字段数、非数字、类别非整数）
+   - out_of_bounds：中心点或框边界超出[0, 1]
+   - non_positive_size：宽或高小于等于0
+   - duplicate / overlap：同一图片中IoU>=阈值的两个框（几乎完全重合的记为duplicate）
+   - class_mismatch：类别编号与文件名中的类别编码不一致
+2. 问题清单输出为CSV或JSONL（每条一行：文件、行号、类别、问题类型、详情），便于脚本处理
+3. 按类别输出检测框数量、图片数量、尺寸与面积等统计
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import filename_codec
+from label_store import LabelStore
+
+ISSUE_COLUMNS = ["file", "line", "class", "issue", "detail"]
+# IoU达到该值视为重复标注，低于该值但超过--iou_threshold视为重叠
+DUPLICATE_IOU = 0.99
+# 边界判断的容差（标注工具导出时的舍入误差）
+BOUNDS_EPS = 1e-6
+
+
+def box_pairs(counts: np.ndarray, offsets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    生成同一文件内所有检测框对（i < j）在boxes数组中的下标
+    按每个文件的框数分组，同样框数的文件一次生成，不逐个文件循环
+    """
+    firsts = [np.zeros(0, dtype=np.int64)]
+    seconds = [np.zeros(0, dtype=np.int64)]
+    starts_all = offsets[:-1]
+    for k in np.unique(counts[counts >= 2]):
+        starts = starts_all[counts == k]
+        i, j = np.triu_indices(int(k), 1)
+        firsts.append((starts[:, None] + i).ravel())
+        seconds.append((starts[:, None] + j).ravel())
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def pair_iou(boxes: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """计算检测框对(a[k], b[k])的IoU"""
+    x1 = boxes["cx"] - boxes["w"] / 2
+    y1 = boxes["cy"] - boxes["h"] / 2
+    x2 = boxes["cx"] + boxes["w"] / 2
+    y2 = boxes["cy"] + boxes["h"] / 2
+    inter_w = np.clip(np.minimum(x2[a], x2[b]) - np.maximum(x1[a], x1[b]), 0, None)
+    inter_h = np.clip(np.minimum(y2[a], y2[b]) - np.maximum(y1[a], y1[b]), 0, None)
+    inter = inter_w * inter_h
+    area = np.clip(boxes["w"], 0, None) * np.clip(boxes["h"], 0, None)
+    union = area[a] + area[b] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def file_class_codes(store: LabelStore) -> np.ndarray:
+    """每个标注文件名中的类别编码，无法解析的为-1"""
+    codes = np.full(len(store.files), -1, dtype=np.int64)
+    for i, path in enumerate(store.files):
+        record = filename_codec.try_parse(os.path.basename(path))
+        if record is not None:
+            codes[i] = record.class_code
+    return codes
+
+
+def validate(
+    store: LabelStore,
+    iou_threshold: float = 0.7,
+    class_offset: Optional[int] = 0,
+) -> pd.DataFrame:
+    """
+    校验全部检测框，返回问题清单（ISSUE_COLUMNS）
+    class_offset：期望的类别编号 = 文件名类别编码 + class_offset；为None时不检查类别
+    """
+    boxes = store.boxes
+    files = np.array(store.files, dtype=object)
+    parts: List[pd.DataFrame] = []
+
+    def add(indices: np.ndarray, issue: str, detail):
+        if len(indices) == 0:
+            return
+        parts.append(
+            pd.DataFrame(
+                {
+                    "file": files[boxes["file"][indices]],
+                    "line": boxes["line"][indices],
+                    "class": boxes["cls"][indices],
+                    "issue": issue,
+                    "detail": detail,
+                }
+            )
+        )
+
+    if len(store.errors):
+        parts.append(
+            pd.DataFrame(
+                {
+                    "file": files[store.errors["file"]],
+                    "line": store.errors["line"],
+                    "class": -1,
+                    "issue": "malformed",
+                    "detail": store.errors["reason"],
+                }
+            )
+        )
+
+    cx, cy, w, h = boxes["cx"], boxes["cy"], boxes["w"], boxes["h"]
+    # 宽高非正
+    bad_size = np.flatnonzero((w <= 0) | (h <= 0))
+    add(bad_size, "non_positive_size", [f"w={w[i]:.6g},h={h[i]:.6g}" for i in bad_size])
+
+    # 中心点或框边界越界
+    low = -BOUNDS_EPS
+    high = 1 + BOUNDS_EPS
+    out = np.zeros(len(boxes), dtype=bool)
+    for value in (cx, cy, cx - w / 2, cx + w / 2, cy - h / 2, cy + h / 2):
+        out |= (value < low) | (value > high)
+    out_idx = np.flatnonzero(out)
+    add(
+        out_idx,
+        "out_of_bounds",
+        [
+            f"x=[{cx[i] - w[i] / 2:.4f},{cx[i] + w[i] / 2:.4f}],"
+            f"y=[{cy[i] - h[i] / 2:.4f},{cy[i] + h[i] / 2:.4f}]"
+            for i in out_idx
+        ],
+    )
+
+    # 同一图片内重复/重叠的框
+    a, b = box_pairs(store.counts, store.offsets)
+    iou = pair_iou(boxes, a, b)
+    hit = iou >= min(iou_threshold, DUPLICATE_IOU)
+    a, b, iou = a[hit], b[hit], iou[hit]
+    duplicate = iou >= DUPLICATE_IOU
+    overlap = ~duplicate & (iou >= iou_threshold)
+    for mask, issue in ((duplicate, "duplicate"), (overlap, "overlap")):
+        add(
+            b[mask],
+            issue,
+            [
+                f"与第{boxes['line'][i]}行IoU={v:.4f}"
+                for i, v in zip(a[mask], iou[mask])
+            ],
+        )
+
+    # 类别编号与文件名类别编码不一致
+    if class_offset is not None:
+        codes = file_class_codes(store)[boxes["file"]]
+        expected = codes + class_offset
+        mismatch = np.flatnonzero((codes >= 0) & (boxes["cls"] != expected))
+        add(mismatch, "class_mismatch", [f"期望类别{expected[i]}" for i in mismatch])
+
+    if not parts:
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
+    issues = pd.concat(parts, ignore_index=True)[ISSUE_COLUMNS]
+    return issues.sort_values(
+        ["file", "line", "issue"], kind="stable", ignore_index=True
+    )
+
+
+def class_statistics(store: LabelStore) -> pd.DataFrame:
+    """按类别统计检测框数量、所在图片数量、尺寸与面积分布"""
+    boxes = store.boxes
+    df = pd.DataFrame(
+        {
+            "class": boxes["cls"],
+            "file": boxes["file"],
+            "w": boxes["w"],
+            "h": boxes["h"],
+            "area": boxes["w"] * boxes["h"],
+        }
+    )
+    grouped = df.groupby("class")
+    stats = pd.DataFrame(
+        {
+            "boxes": grouped.size(),
+            "images": grouped["file"].nunique(),
+            "mean_w": grouped["w"].mean(),
+            "mean_h": grouped["h"].mean(),
+            "area_p10": grouped["area"].quantile(0.1),
+            "area_median": grouped["area"].median(),
+            "area_p90": grouped["area"].quantile(0.9),
+        }
+    )
+    return stats.round(4)
+
+
+def save_issues(issues: pd.DataFrame, output_file: str):
+    """按扩展名保存为CSV或JSONL"""
+    if output_file.lower().endswith(".jsonl"):
+        with open(output_file, "w", encoding="utf-8") as f:
+            for record in issues.to_dict("records"):
+                record["line"] = int(record["line"])
+                record["class"] = int(record["class"])
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        issues.to_csv(output_file, index=False, encoding="utf-8-sig")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="YOLO标注批量校验与统计")
+    parser.add_argument(
+        "--label_dir", type=str, required=True, help="标注文件目录（含子目录）"
+    )
+    parser.add_argument("--cache_file", type=str, default=None, help="标注缓存文件路径")
+    parser.add_argument(
+        "--iou_threshold",
+        type=float,
+        default=0.7,
+        help="同一图片内两框IoU达到该值即报告重叠",
+    )
+    parser.add_argument(
+        "--class_offset",
+        type=int,
+        default=0,
+        help="期望类别编号 = 文件名类别编码 + class_offset（重新编号前的1起编号数据用-1）",
+    )
+    parser.add_argument(
+        "--no_class_check", action="store_true", help="不检查类别与文件名是否一致"
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./label_issues.csv",
+        help="问题清单（.csv或.jsonl）",
+    )
+    parser.add_argument("--stats_csv", type=str, default=None, help="按类别统计结果CSV")
+    parser.add_argument("--num_workers", type=int, default=16, help="读取标注的线程数")
+    args = parser.parse_args()
+
+    store = LabelStore.load(args.label_dir, args.cache_file, args.num_workers)
+    start = time.perf_counter()
+    issues = validate(
+        store,
+        iou_threshold=args.iou_threshold,
+        class_offset=None if args.no_class_check else args.class_offset,
+    )
+    print(
+        f"校验完成：{len(store.boxes)} 个检测框，耗时 {time.perf_counter() - start:.2f}s，"
+        f"发现 {len(issues)} 个问题（涉及 {issues['file'].nunique()} 个文件）"
+    )
+    for issue, count in issues["issue"].value_counts().items():
+        print(f"- {issue}：{count}")
+    save_issues(issues, args.output)
+    print(f"问题清单已保存到 {args.output}")
+
+    stats = class_statistics(store)
+    print(stats.to_string())
+    if args.stats_csv:
+        stats.to_csv(args.stats_csv, encoding="utf-8-sig")
+        print(f"类别统计已保存到 {args.stats_csv}")
+
+
+if __name__ == "__main__":
+    main()